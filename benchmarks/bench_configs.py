@@ -0,0 +1,50 @@
+"""Cost of formatting a document under several candidate configurations:
+formatting it once per configuration, compared to a single parse with the
+layout of the parts they agree on shared.
+
+Run with `python -m benchmarks.bench_configs`.
+"""
+from timeit import repeat
+
+from ptx_formatter.formatter import formatPretext, formatPretextConfigs
+from ptx_formatter.utils.config import Config, Preference
+
+SECTION = """  <section xml:id="sec-{0}">
+    <title>A section</title>
+    <p>Some text with <em>emphasis</em> and math <m>x^2</m>.</p>
+    <exercise>
+      <statement><p>Compute <m>\\int_0^1 x\\,dx</m>.</p></statement>
+      <solution><p>It is <m>1/2</m>.</p></solution>
+    </exercise>
+    <program language="python"><input>print("hello")</input></program>
+  </section>
+"""
+
+
+def candidates() -> list[Config]:
+  """Configurations that each change the standard one in a single way."""
+  configs = [Config.standard() for _ in range(8)]
+  configs[1].set_emptyline_before(["section"])
+  configs[2].set_emptyline_after(["title"])
+  configs[3].add_tag_prefs({"statement": Preference.BlockNoIndent})
+  configs[4].add_tag_prefs({"solution": Preference.Inline})
+  configs[5].set_cdata(["input"])
+  configs[6].set_self_closing_space(False)
+  configs[7].set_indent(4)
+  return configs
+
+
+def main():
+  configs = candidates()
+  text = f"<chapter>\n{''.join(SECTION.format(i) for i in range(2000))}</chapter>"
+  for name, stmt in [
+      ("formatPretext per config",
+       lambda: [formatPretext(text, config) for config in configs]),
+      ("formatPretextConfigs", lambda: formatPretextConfigs(text, configs)),
+  ]:
+    best = min(repeat(stmt, number=1, repeat=3))
+    print(f"{len(configs)} configs {name:26} {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,39 @@
+"""Cost of finding the changes made by formatting a large, mostly formatted
+document: text edits from the aligned trees, compared to a difflib diff.
+
+Run with `python -m benchmarks.bench_edits`.
+"""
+import difflib
+from timeit import repeat
+
+from ptx_formatter.formatter import formatPretext, formatPretextEdits
+from ptx_formatter.utils.config import Config
+
+SECTION = """  <section>
+    <title>A section</title>
+    <p>Some text with <em>emphasis</em> and math <m>x^2</m>.</p>
+    <p>Another paragraph.</p>
+  </section>
+"""
+
+
+def main():
+  config = Config.standard()
+  for sections in [1000, 10000]:
+    text = formatPretext(f"<chapter>\n{SECTION * sections}</chapter>", config)
+    # Introduce a few formatting problems
+    text = text.replace("<p>Another", "  <p>Another", 3)
+    for name, stmt in [
+        ("formatPretext", lambda: formatPretext(text, config)),
+        ("formatPretextEdits", lambda: formatPretextEdits(text, config)),
+        ("formatPretext + difflib", lambda: list(
+            difflib.unified_diff(text.splitlines(),
+                                 formatPretext(text, config).splitlines()))),
+    ]:
+      best = min(repeat(stmt, number=1, repeat=3))
+      print(f"{sections:6} sections {name:25} {best * 1000:8.1f} ms")
+  print("edits:", formatPretextEdits(text, config))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,61 @@
+"""Latency of formatting a large document again after a one-character
+edit: parsing and rendering the whole text, compared to editing the parsed
+`Document`, which parses again only the element around the edit, and
+rendering it, which lays out again only that element and its ancestors.
+
+Run with `python -m benchmarks.bench_incremental`.
+"""
+import random
+from time import perf_counter
+
+from ptx_formatter.document import parse, render
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils.config import Config
+
+SECTION = """  <section>
+    <title>A section</title>
+    <p>Some text with <em>emphasis</em> and math <m>x^2</m>.</p>
+    <p>Another paragraph.</p>
+  </section>
+"""
+
+EDITS = 20
+
+
+def main():
+  config = Config.standard()
+  rng = random.Random(0)
+  for sections in [1000, 10000]:
+    text = formatPretext(f"<book>\n{SECTION * sections}</book>\n", config)
+    positions = [
+        text.index("emphasis", rng.randrange(len(text) - 200))
+        for _ in range(EDITS)
+    ]
+    full = []
+    for pos in positions:
+      text = text[:pos] + "E" + text[pos + 1:]
+      start = perf_counter()
+      formatPretext(text, config)
+      full.append(perf_counter() - start)
+    document = parse(text)
+    render(document, config)
+    edits = []
+    renders = []
+    for pos in positions:
+      start = perf_counter()
+      document.edit(pos, pos + 1, "e")
+      edited = perf_counter()
+      render(document, config)
+      edits.append(edited - start)
+      renders.append(perf_counter() - edited)
+    print(f"{sections:6} sections ({len(text) / 1e6:.1f} MB), "
+          f"median of {EDITS} one-character edits")
+    for name, times in [("formatPretext", full), ("Document.edit", edits),
+                        ("render after edit", renders),
+                        ("edit + render",
+                         [a + b for a, b in zip(edits, renders)])]:
+      print(f"  {name:20} {sorted(times)[EDITS // 2] * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+  main()
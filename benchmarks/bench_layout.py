@@ -0,0 +1,31 @@
+"""Cost of laying out a large document with and without line wrapping.
+
+Run with `python -m benchmarks.bench_layout`.
+"""
+from timeit import repeat
+
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils.config import Config
+
+PARAGRAPH = ("<p>A paragraph with <em>emphasis</em>, some math <m>x^2</m> and "
+             "enough words to need wrapping at most common line widths.</p>")
+
+
+def document(paragraphs: int) -> str:
+  return f"<section>{PARAGRAPH * paragraphs}</section>"
+
+
+def main():
+  for width in ["never", 80, 40]:
+    config = Config.standard()
+    config.set_max_line_width(width)
+    for paragraphs in [1000, 10000]:
+      text = document(paragraphs)
+      best = min(repeat(lambda: formatPretext(text, config), number=1,
+                        repeat=3))
+      print(f"max-line-width={width!s:6} {paragraphs:6} paragraphs:"
+            f" {best * 1000:8.1f} ms ({best / paragraphs * 1e6:5.1f} us each)")
+
+
+if __name__ == "__main__":
+  main()
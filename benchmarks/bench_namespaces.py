@@ -0,0 +1,48 @@
+"""Cost of formatting namespace-heavy documents: many XIncludes, and images
+drawn with SVG and formulas written in MathML in their default namespaces.
+
+Run with `python -m benchmarks.bench_namespaces`.
+"""
+from timeit import repeat
+
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils.config import Config
+
+XINCLUDES = """  <section xml:id="sec-{0}">
+    <xi:include href="sec-{0}-a.ptx" />
+    <xi:include href="sec-{0}-b.ptx" xpointer="xmlns(p=http://pretextbook.org)" />
+    <p xml:id="p-{0}" xml:lang="en">Text</p>
+  </section>
+"""
+
+SVG = """  <image xml:id="img-{0}">
+    <svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" viewBox="0 0 10 10">
+      <g stroke="black">
+        <path d="M0 0L10 10" />
+        <circle cx="5" cy="5" r="2" />
+        <use xlink:href="#dot" x="1" />
+      </g>
+    </svg>
+  </image>
+"""
+
+MATHML = """  <p>
+    <math xmlns="http://www.w3.org/1998/Math/MathML">
+      <mrow><mi>x</mi><mo>+</mo><msup><mi>y</mi><mn>2</mn></msup></mrow>
+    </math>
+  </p>
+"""
+
+ROOT = ('<pretext xmlns:xi="http://www.w3.org/2001/XInclude">\n{}</pretext>')
+
+
+def main():
+  config = Config.standard()
+  for name, part in [("xinclude", XINCLUDES), ("svg", SVG), ("mathml", MATHML)]:
+    text = ROOT.format("".join(part.format(i) for i in range(2000)))
+    best = min(repeat(lambda: formatPretext(text, config), number=1, repeat=5))
+    print(f"{name:10} {len(text) / 1e6:5.2f} MB {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,55 @@
+"""Per-call overhead of formatting small (about 1 KB) snippets.
+
+Run with `python -m benchmarks.bench_session`.
+"""
+from timeit import repeat
+
+from ptx_formatter.formatter import PtxFormatter, formatPretext
+from ptx_formatter.utils.config import Config
+
+BODY = """  <title>Introduction</title>
+  <p>Some text with <em>emphasis</em> and math <m>x^2 + y^2 = z^2</m>.</p>
+  <ul>
+    <li><p>First item with a <xref ref="thm-main" /> reference.</p></li>
+    <li><p>Second item with <c>code</c> in it.</p></li>
+  </ul>
+  <program language="python">
+    <input>
+    def f(x):
+        return x &lt; 3 and x &gt; 1
+    </input>
+  </program>
+  <p>A final paragraph that makes this snippet about one kilobyte long,
+  give or take a few characters of filler text here and there.</p>
+"""
+SNIPPET = f'<section xml:id="sec-intro">\n{BODY * 2}</section>\n'
+SNIPPETS = [SNIPPET] * 2000
+
+
+def best_per_call(stmt, number: int) -> float:
+  return min(repeat(stmt, number=1, repeat=3)) / number * 1e6
+
+
+def main():
+  config = Config.standard()
+  session = PtxFormatter(config)
+  count = len(SNIPPETS)
+  print(f"snippet size: {len(SNIPPET)} characters, {count} snippets")
+  rows = [
+      ("formatPretext(text)", lambda: [formatPretext(s) for s in SNIPPETS]),
+      ("formatPretext(text, config)",
+       lambda: [formatPretext(s, config) for s in SNIPPETS]),
+      ("Config.standard() per call",
+       lambda: [formatPretext(s, Config.standard()) for s in SNIPPETS]),
+      ("PtxFormatter.format", lambda: [session.format(s) for s in SNIPPETS]),
+      ("format_many(workers=4, thread)",
+       lambda: session.format_many(SNIPPETS, workers=4)),
+      ("format_many(workers=4, process)", lambda: session.format_many(
+          SNIPPETS, workers=4, executor="process", chunksize=64)),
+  ]
+  for name, stmt in rows:
+    print(f"{name:35} {best_per_call(stmt, count):8.1f} us/call")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,36 @@
+"""Cost of formatting documents made mostly of long verbatim blocks, with
+the blocks written in the form the configuration asks for (copied from the
+source) or in the other one (rebuilt).
+
+Run with `python -m benchmarks.bench_verbatim`.
+"""
+from timeit import repeat
+
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils.config import Config
+
+CODE = "".join(
+    f"    if (x{i} < y && y > z) {{ total += x{i}; }}\n" for i in range(200))
+ESCAPED = CODE.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def document(contents: str, blocks: int) -> str:
+  program = f"  <program>\n    <input>\n{contents}    </input>\n  </program>\n"
+  return f"<section>\n{program * blocks}</section>"
+
+
+def main():
+  for cdata in ["never", "always"]:
+    config = Config.standard()
+    config.set_cdata(cdata)
+    for form, contents in [("escaped", ESCAPED),
+                           ("cdata", f"<![CDATA[\n{CODE}]]>")]:
+      text = document(contents, 200)
+      best = min(repeat(lambda: formatPretext(text, config), number=1,
+                        repeat=5))
+      print(f"cdata={cdata:6} source={form:7} {len(text) / 1e6:5.1f} MB "
+            f"{best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+  main()
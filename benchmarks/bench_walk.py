@@ -0,0 +1,54 @@
+"""Cost of finding the files to format in a book repository whose build
+output holds 50,000 files: globbing all of them first, compared to the
+walker that skips the output directory and produces files as it goes.
+
+Run with `python -m benchmarks.bench_walk`.
+"""
+from glob import glob
+from pathlib import Path
+import tempfile
+import time
+
+from ptx_formatter.utils.walk import walk_files
+
+
+def make_repository(root: Path):
+  for chapter in range(20):
+    directory = root / "source" / f"ch{chapter}"
+    directory.mkdir(parents=True)
+    for section in range(10):
+      (directory / f"sec{section}.ptx").write_text("<section/>")
+  for part in range(100):
+    directory = root / "output" / "web" / f"part{part}"
+    directory.mkdir(parents=True)
+    for page in range(500):
+      (directory / f"page{page}.html").touch()
+
+
+def timed(find_files) -> tuple[float, float, int]:
+  """The time to the first file, the total time and the number of files."""
+  start = time.perf_counter()
+  first = None
+  count = 0
+  for _ in find_files():
+    if first is None:
+      first = time.perf_counter() - start
+    count += 1
+  return first, time.perf_counter() - start, count
+
+
+def main():
+  with tempfile.TemporaryDirectory() as tmp:
+    root = Path(tmp)
+    make_repository(root)
+    for name, files in [
+        ("glob", lambda: glob("**/*.ptx", root_dir=root, recursive=True)),
+        ("walk_files", lambda: walk_files(root)),
+    ]:
+      first, total, count = timed(files)
+      print(f"{name:12} {count} files, first after {first * 1000:7.2f} ms, "
+            f"all after {total * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+  main()
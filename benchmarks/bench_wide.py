@@ -0,0 +1,47 @@
+"""Cost of normalizing the children of an element with many rows, each
+followed by an inline comment. It should grow linearly with the rows.
+
+Run with `python -m benchmarks.bench_wide`.
+"""
+from timeit import repeat
+
+from ptx_formatter.utils.ast import Comment, Element, Text
+from ptx_formatter.utils.config import Config
+from ptx_formatter.utils.context import Context
+
+
+def wide_element(count: int) -> Element:
+  """An element with `count` rows, each followed by an inline comment."""
+  element = Element("tabular")
+  for idx in range(count):
+    element.addChild(Text("\n  "))
+    element.addChild(Element("row", {}, [Text(str(idx))]))
+    element.addChild(Text(" "))
+    element.addChild(Comment(f" row {idx} "))
+  element.addChild(Text("\n"))
+  return element
+
+
+def normalize_time(count: int) -> float:
+  ctx = Context(Config.standard())
+  element = wide_element(count)
+
+  def normalize():
+    element._normalized = None
+    element._block_children(ctx)
+
+  return min(repeat(normalize, number=1, repeat=3))
+
+
+def main():
+  small = None
+  for rows in [10000, 100000]:
+    best = normalize_time(rows)
+    small = small or best
+    # Linear is 10 times as long for 10 times the rows, quadratic 100 times
+    print(f"{rows:7} rows: {best * 1000:8.1f} ms"
+          f" ({best / small:5.1f} times the smallest)")
+
+
+if __name__ == "__main__":
+  main()
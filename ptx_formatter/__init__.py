@@ -38,25 +38,101 @@ You can also specify one or both files as arguments:
 ```shell
 ptx-format inputFile.ptx outputFile.ptx
 ```
+Standard output is written as the document is laid out, in pieces of
+`--buffer-size` characters, so that the next command of a pipeline can start
+before the whole document is formatted.
 
 You can process a file in-place:
 ```shell
 ptx-format -p inputFile.ptx
 ```
+Or any number of files, as when the formatter runs as a pre-commit hook.
+They are formatted at the same time by `--jobs` worker processes, and
+reported in the order given:
+```shell
+ptx-format -p chapter1.ptx chapter2.ptx appendix.ptx
+```
 Or you can in-place process all `*.ptx` files in a directory and its subdirectiories:
 ```shell
 ptx-format -pr documentDirectory
 ```
+Files are formatted as soon as they are found. Only the files whose
+formatting changes are written, so the others keep their modification time,
+and each one is replaced atomically, through a temporary file. For large
+runs, `--fsync batch` flushes all the files to the disk once, at the end,
+instead of one at a time. Hidden directories, the
+directories `node_modules`, `output`, `generated-assets` and `__pycache__`,
+and anything listed in `.gitignore` files are skipped. Use `--exclude` to
+replace the default list, or `--extend-exclude` to add to it. Both take
+`.gitignore`-style patterns and can be repeated:
+```shell
+ptx-format -pr --extend-exclude "drafts/" --extend-exclude "*-old.ptx" documentDirectory
+```
+
+A file that cannot be parsed or written is reported on standard error, and
+the run goes on with the others; the exit status is then 1. With `--report`,
+every file gets a JSON record with its status, the position of a parse
+error, its size, the number and depth of its elements and the time spent
+parsing and rendering it, which helps find the files that slow a run down:
+```shell
+ptx-format -pr --report - documentDirectory | jq -s 'sort_by(-.render_ms) | .[:5]'
+```
+A pathological file can also be kept from stalling the run. With
+`--timeout` or `--max-memory`, files are formatted in a worker process that
+is stopped, and started again for the next file, when a file goes over the
+limit. `--max-file-size` skips the largest files without reading them:
+```shell
+ptx-format -pr --timeout 30 --max-memory 1000 --max-file-size 5 documentDirectory
+```
+
+To keep the diffs of a large file small, you can format only the lines
+you touched. `--lines START:END`, which can be repeated, formats the
+elements on those lines, and `--git-hunks` the elements on the lines
+changed since the last commit. The smallest elements laid out on lines of
+their own that hold the lines are formatted, where they are in the
+document, and the rest of the file is kept byte for byte. The whole
+document is formatted when the lines are at its top level:
+```shell
+ptx-format -p --git-hunks chapter1.ptx
+ptx-format --lines 120:140 --lines 300:310 chapter1.ptx
+```
+
+Tools that format many documents held in memory can send them all to a
+single `ptx-format --batch`, and pay the start-up time only once. Each line
+of standard input is a JSON object with the document under `text`, and
+optionally the `path` it comes from, whose configuration is then
+discovered, a `config` file to use instead, and an `id`. Each line of
+standard output is the result for one document, in the same order, with the
+formatted `text` or an `error`, along with the `id` and `path` of the
+document. The documents are formatted by `--jobs` worker processes, and each
+result is written as soon as the results before it are:
+```shell
+echo '{"id": 1, "path": "book/ch1.ptx", "text": "<p>Hi</p>"}' | ptx-format --batch
+{"id": 1, "path": "book/ch1.ptx", "text": "<p>Hi</p>"}
+```
 
 The command allows a number of options. See also `ptx-format --help`.
 
 ### Options
 
 * `--add-doc-type / --skip-doc-type`: Whether to include or skip the XML doc identifier <?xml ...>. The identifier will by default be added if the output is a file and skipped if the output is stdout.
+* `--exclude TEXT`: A .gitignore-style pattern of files and directories to skip in recursive mode. Can be given more than once. Replaces the default patterns.
+* `--extend-exclude TEXT`: Like --exclude, but adds to the default patterns instead of replacing them.
+* `--fsync [always|batch|never]`: When files changed in place are flushed to the disk: each one before it replaces the original (always), all of them at the end of the run (batch), or when the system decides (never).  [default: always]
+* `--report TEXT`: With --in-place, write a JSON record of each file to this file: its status (unchanged, reformatted or error, with the position of parse errors), its size before and after, its number of elements and depth, and the milliseconds spent parsing and rendering it. A file name ending with .jsonl, or - for standard output, gets one JSON object per line.
+* `--timeout FLOAT`: With --in-place, the seconds each file can take. Files are then formatted in a separate worker process, which is stopped when a file takes longer. The file is reported as an error and the run goes on.
+* `--max-memory FLOAT`: With --in-place, the megabytes of memory each file can use. Files are then formatted in a separate worker process. A file that needs more is reported as an error and the run goes on. Only on systems that can limit the memory of a process.
+* `--max-file-size FLOAT`: With --in-place, skip the files larger than this many megabytes without reading them.
+* `--buffer-size INTEGER RANGE`: The number of characters written to standard output at a time. The output is written as it is laid out, so that the next command of a pipeline can start on it before the whole document is formatted.  [default: 65536; x>=1]
+* `--lines START:END`: Only format the elements on the lines from START to END, counting from 1, and keep the rest of the input as it is. Can be given more than once.
+* `--git-hunks`: Only format the elements on the lines of the input file changed since the last commit, as git diff reports them, and keep the rest of the file as it is. A file that git does not track is formatted as a whole.
 * `-i, --indent INTEGER`: Number of characters for space-indent. Overwrites the standard configuration. Ignored if tab_indent is set.
 * `-t, --tab-indent`: Indent using tabs instead. Overwrites the standard configuration.
-* `-c, --config-file FILENAME`: File to use as configuration. If omitted, a standard configuration file is loaded.
-* `--show-config`: Print the current configuration and exit. This is in a TOML form that could be saved to a file and used as a start file.
+* `-c, --config-file FILENAME`: File to use as configuration. If omitted, each file uses the closest ptx-formatter.toml file, or pyproject.toml file with a [tool.ptx-formatter] table, in its directory or above, and the standard configuration if there is none. Can be given more than once with --compare.
+* `--compare`: Compare the configuration files given with --config-file: report which input files each of them would change, without changing any. The input can be a file, standard input, or a directory to compare all of its *.ptx files.
+* `--batch`: Format many documents in one run: read one JSON object per line from standard input, with the document under text and optionally its path, a config file and an id, and write one JSON object per line to standard output, with the formatted text or an error, in the same order.
+* `-j, --jobs INTEGER RANGE`: The number of files formatted at the same time with --in-place, or of documents with --batch, each in a worker process. Defaults to the number of processors.  [x>=1]
+* `--show-config`: Print the configuration that applies to the input file, or to the current directory, and exit. This is in a TOML form that could be saved to a file and used as a start file.
 * `--version`: Print the version and exit.
 * `--help`: Show this message and exit.
 
@@ -73,6 +149,100 @@ s = formatPretext(source)
 print(s)
 ```
 
+Editors and review tools that only need the changes can use
+`formatPretextEdits` instead. It returns a list of `(start, end, replacement)`
+edits, with offsets into the source string, which is empty if the source
+is already formatted:
+
+```python
+from ptx_formatter import formatPretextEdits
+
+for start, end, replacement in reversed(formatPretextEdits(source)):
+    source = source[:start] + replacement + source[end:]
+```
+
+To format only some lines of a document, such as the lines an author
+changed, use `formatPretextLines`. The lines are given as `(first, last)`
+pairs, counting from 1, and the rest of the document is kept as it is:
+
+```python
+from ptx_formatter import formatPretextLines
+
+s = formatPretextLines(source, [(120, 140), (300, 310)])
+```
+
+A part of a document, such as a selection, can be formatted on its own
+with `formatFragment`. The fragment can hold several elements, or text
+mixed with elements, with no single root. It is laid out like the contents
+of a block element, with every line indented by `base_indent_level` levels:
+
+```python
+from ptx_formatter import formatFragment
+
+s = formatFragment("<p>One</p> <p>Two <em>b</em></p>", config, base_indent_level=2)
+```
+
+If you format many documents with the same configuration, create a
+`PtxFormatter` session once and reuse it. It keeps the configuration and
+formatting context around between calls, and can format a batch of
+documents on a thread or process pool, returning the results in order:
+
+```python
+from ptx_formatter import PtxFormatter, Config
+
+session = PtxFormatter(Config.standard())
+s = session.format(source)
+results = session.format_many(sources, workers=4, executor="process")
+```
+
+To keep the parsed form of a document, for instance to format it again
+later under another configuration, use `parse` and `render`. A `Document`
+can be serialized with `to_bytes`, or with `pickle`, and cached between
+runs:
+
+```python
+from ptx_formatter import Document, parse, render
+
+document = parse(source)
+s = render(document, config)
+data = document.to_bytes()
+s = render(Document.from_bytes(data), other_config)
+```
+
+Editors can keep a `Document` for each open file and apply each change to
+it with `edit`. Only the smallest element around the change is parsed
+again, and rendering the document again only lays out that element and its
+ancestors:
+
+```python
+document.edit(start, end, replacement)
+s = render(document, config)
+```
+
+To compare several configurations, `formatPretextConfigs` formats a document
+under each of them, parsing it only once. The parts of the document that
+the configurations format the same way are laid out only once. The command
+line does the same for a whole directory with `--compare`:
+
+```shell
+ptx-format --compare -c current.toml -c candidate.toml documentDirectory
+```
+
+Applications running on `asyncio` can use the functions in `ptx_formatter.aio`,
+which format on a bounded worker pool without blocking the event loop.
+`iter_format_pretext_async` yields the result in pieces, so that a response
+can start before the whole document is formatted:
+
+```python
+from ptx_formatter import format_pretext_async
+from ptx_formatter.aio import format_many_async, iter_format_pretext_async
+
+s = await format_pretext_async(source, config)
+results = await format_many_async(sources, config, limit=8)
+async for piece in iter_format_pretext_async(source, config):
+    await response.write(piece)
+```
+
 ## Formatting Style and Customization
 
 Elements in the PtxFormatter can be rendered broadly in two modes:
@@ -227,6 +397,21 @@ Configurations can be stored to and loaded from [TOML](https://toml.io/en/)
 format files. An example file is produced by the `Config.print` function, or by
 using `--show-config` in the command line.
 
+When no configuration file is given, the command line looks for one for each
+file it formats. It walks up from the file's directory and uses the first
+`ptx-formatter.toml` file it finds, or the `[tool.ptx-formatter]` table of
+the first `pyproject.toml` file that has one. Files in a subproject with its
+own configuration file therefore use that one. Files with no configuration
+above them use the standard configuration. To see which configuration
+applies to a file, run:
+
+```shell
+ptx-format --show-config chapters/intro.ptx
+```
+
+From Python, `ptx_formatter.utils.discovery.ConfigFinder` performs the same
+search.
+
 The following entries are expected/allowed:
 
 - `indent`, with value a number of spaces or a string to use for indent
@@ -248,10 +433,23 @@ The following entries are expected/allowed:
   is consulted. If it is 0 then the first of the attributes is in the same line
   as the opening tag and the other attributes line up with it. If it is some other number
   then all attributes go on their own lines indented by that amount.
+- `max-line-width` can be the string `"never"` (the default), in which case
+  elements rendered in inline mode stay on one line, or a number of characters.
+  Inline elements whose line would grow longer than that are wrapped at the
+  whitespace in their text, with continuation lines indented one more level.
+  The contents of nested inline elements are never broken.
 - `tags`, a table whose entry keys are specific tag classifications
   (see just below) and whose values are arrays of the tags belonging
   to that classification. Only tags that need to be handled in a certain
-  way need to be included. The allowed classifications are:
+  way need to be included. Tags can also be given as shell-style patterns,
+  such as `"svg:*"` or `"*-preamble"`, where `*` matches any characters, `?`
+  a single character and `[...]` one of a set of characters. A tag listed by
+  name wins over the patterns that match it, and among patterns the one with
+  the most characters other than wildcards wins. A tag can also be given
+  with its parents, as a path such as `"li > p"`, which applies only to the
+  `p` elements directly inside an `li`. Each step of a path is a tag name or
+  a pattern. A matching path wins over the tag itself, and a longer path
+  over a shorter one. The allowed classifications are:
   - `verbatim` for tags whose contents are to be rendered verbatim
   - `inline` for tags that are to be inlined
   - `inline-empty` for tags that are to be inline only when empty
@@ -261,6 +459,14 @@ The following entries are expected/allowed:
 
 """
 
-from ptx_formatter.formatter import formatPretext, Config
-
-__all__ = [formatPretext, Config]
+from ptx_formatter.formatter import (formatPretext, formatPretextEdits,
+                                     formatPretextConfigs, formatPretextLines,
+                                     formatFragment, Config, PtxFormatter)
+from ptx_formatter.document import Document, parse, render
+from ptx_formatter.aio import format_pretext_async
+
+__all__ = [
+    formatPretext, formatPretextEdits, formatPretextConfigs, formatPretextLines,
+    formatFragment, Config, PtxFormatter, Document, parse, render,
+    format_pretext_async
+]
@@ -0,0 +1,131 @@
+"""
+Asyncio-friendly formatting functions.
+
+Formatting is CPU-bound work, so these functions hand it off to an executor
+and leave the event loop free to serve other requests in the meantime. By
+default a small, bounded thread pool shared by all calls is used. Pass a
+`concurrent.futures.ProcessPoolExecutor` as `executor` to format on other
+cores instead.
+
+Cancelling one of these coroutines stops waiting for the result right away.
+Documents that have not started formatting yet are dropped. A document that is
+already being formatted in a worker runs to completion and its result is
+discarded, except in `iter_format_pretext_async`, which stops at the next
+chunk.
+"""
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import threading
+from typing import AsyncIterator, Iterable
+
+from ptx_formatter.formatter import PtxFormatter, formatPretext, standard_config
+from ptx_formatter.utils.config import Config
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+"""The size of the thread pool used when no executor is provided."""
+
+DEFAULT_LIMIT = DEFAULT_WORKERS
+"""The default number of documents a batch formats concurrently."""
+
+MAX_PENDING_CHUNKS = 16
+"""The number of pieces `iter_format_pretext_async` renders ahead of its
+consumer, after which the rendering waits for them to be taken."""
+
+_default_executor: ThreadPoolExecutor | None = None
+_default_executor_lock = threading.Lock()
+
+
+async def format_pretext_async(text: str,
+                               config: Config = None,
+                               *,
+                               executor: Executor = None) -> str:
+  """Asynchronous version of `ptx_formatter.formatPretext`. The formatting
+  runs on `executor`, or on a shared bounded thread pool if omitted."""
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(executor or _get_default_executor(),
+                                    formatPretext, text, config)
+
+
+async def format_many_async(texts: Iterable[str],
+                            config: Config = None,
+                            *,
+                            executor: Executor = None,
+                            limit: int = DEFAULT_LIMIT) -> list[str]:
+  """Format a number of documents, returning the results in the same order.
+  At most `limit` documents are handed to the executor at any one time.
+  If some of them fail, the others are cancelled and an `ExceptionGroup` of
+  the errors is raised, as by `asyncio.TaskGroup`. Use `except*` to handle
+  a kind of error, such as `xml.etree.ElementTree.ParseError`."""
+  if limit < 1:
+    raise ValueError("The concurrency limit must be at least 1.")
+  semaphore = asyncio.Semaphore(limit)
+
+  async def format_one(text: str) -> str:
+    async with semaphore:
+      return await format_pretext_async(text, config, executor=executor)
+
+  async with asyncio.TaskGroup() as group:
+    tasks = [group.create_task(format_one(text)) for text in texts]
+  return [task.result() for task in tasks]
+
+
+async def iter_format_pretext_async(
+    text: str,
+    config: Config = None,
+    *,
+    executor: Executor = None) -> AsyncIterator[str]:
+  """Format a document, yielding the result in pieces as they are rendered,
+  so that a response can start before the whole document is done.
+  Joining the pieces gives the result of `format_pretext_async`.
+
+  Rendering stops while `MAX_PENDING_CHUNKS` pieces are waiting, so that a
+  slow consumer does not have the whole result held in memory.
+
+  Streaming needs a thread executor. With a process executor the whole
+  document is formatted in the worker and comes back as a single piece."""
+  if isinstance(executor, ProcessPoolExecutor):
+    yield await format_pretext_async(text, config, executor=executor)
+    return
+  loop = asyncio.get_running_loop()
+  queue = asyncio.Queue()
+  # Taken by the worker for each piece it renders and given back as the
+  # pieces are consumed. The queue cannot be bounded itself, as the worker
+  # thread cannot wait on it.
+  room = threading.Semaphore(MAX_PENDING_CHUNKS)
+  stopped = threading.Event()
+  done = object()
+
+  def produce():
+    try:
+      session = PtxFormatter(config or standard_config())
+      for chunk in session.iter_format(text):
+        room.acquire()
+        if stopped.is_set():
+          return
+        loop.call_soon_threadsafe(queue.put_nowait, chunk)
+    except BaseException as e:
+      loop.call_soon_threadsafe(queue.put_nowait, e)
+    loop.call_soon_threadsafe(queue.put_nowait, done)
+
+  producer = loop.run_in_executor(executor or _get_default_executor(), produce)
+  try:
+    while (item := await queue.get()) is not done:
+      if isinstance(item, BaseException):
+        raise item
+      room.release()
+      yield item
+    await producer
+  finally:
+    stopped.set()
+    # Wake the worker if it is waiting for room
+    room.release()
+
+
+def _get_default_executor() -> ThreadPoolExecutor:
+  global _default_executor
+  with _default_executor_lock:
+    if _default_executor is None:
+      _default_executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS,
+                                             thread_name_prefix="ptx-format")
+    return _default_executor
@@ -1,13 +1,25 @@
-from glob import glob
+from functools import partial
+from itertools import chain
+import os
 from pathlib import Path
 import time
-from typing import Annotated, Optional
+from typing import Annotated, Iterable, Optional
 from rich.progress import track
 
 import sys
 import typer
 
-from ptx_formatter.formatter import formatPretext, Config
+from ptx_formatter.formatter import (formatPretextConfigs, formatPretextLines,
+                                     Config, PtxFormatter)
+from ptx_formatter.utils.doc import CHUNK_SIZE
+from ptx_formatter.utils.batch import run_batch
+from ptx_formatter.utils.discovery import ConfigFinder
+from ptx_formatter.utils.files import Sync, read_source, replace_file
+from ptx_formatter.utils.lines import LineRange, git_hunks, parse_line_range
+from ptx_formatter.utils.report import (FileReport, ReportWriter, Status,
+                                        format_with_report, is_out_of_memory)
+from ptx_formatter.utils.walk import DEFAULT_EXCLUDES, walk_files
+from ptx_formatter.utils.workers import FileWorker, FileWorkerPool
 from ptx_formatter.version import __version__
 
 
@@ -50,6 +62,86 @@ def _mainPtx(
             show_default=False,
         ),
     ] = False,
+    exclude: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--exclude",
+            help=
+            f"A .gitignore-style pattern of files and directories to skip in recursive mode. Can be given more than once. Replaces the default patterns: {' '.join(DEFAULT_EXCLUDES)}",
+            show_default=False,
+        )] = None,
+    extendExclude: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--extend-exclude",
+            help=
+            "Like --exclude, but adds to the default patterns instead of replacing them.",
+            show_default=False,
+        )] = None,
+    fsync: Annotated[
+        Sync,
+        typer.Option(
+            "--fsync",
+            help=
+            "When files changed in place are flushed to the disk: each one before it replaces the original (always), all of them at the end of the run (batch), or when the system decides (never).",
+        )] = Sync.always,
+    report: Annotated[
+        Optional[str],
+        typer.Option(
+            "--report",
+            help=
+            "With --in-place, write a JSON record of each file to this file: its status (unchanged, reformatted or error, with the position of parse errors), its size before and after, its number of elements and depth, and the milliseconds spent parsing and rendering it. A file name ending with .jsonl, or - for standard output, gets one JSON object per line.",
+            show_default=False,
+        )] = None,
+    timeout: Annotated[
+        Optional[float],
+        typer.Option(
+            "--timeout",
+            help=
+            "With --in-place, the seconds each file can take. Files are then formatted in a separate worker process, which is stopped when a file takes longer. The file is reported as an error and the run goes on.",
+            show_default=False,
+        )] = None,
+    maxMemory: Annotated[
+        Optional[float],
+        typer.Option(
+            "--max-memory",
+            help=
+            "With --in-place, the megabytes of memory each file can use. Files are then formatted in a separate worker process. A file that needs more is reported as an error and the run goes on. Only on systems that can limit the memory of a process.",
+            show_default=False,
+        )] = None,
+    maxFileSize: Annotated[
+        Optional[float],
+        typer.Option(
+            "--max-file-size",
+            help=
+            "With --in-place, skip the files larger than this many megabytes without reading them.",
+            show_default=False,
+        )] = None,
+    bufferSize: Annotated[
+        int,
+        typer.Option(
+            "--buffer-size",
+            help=
+            "The number of characters written to standard output at a time. The output is written as it is laid out, so that the next command of a pipeline can start on it before the whole document is formatted.",
+            min=1,
+        )] = CHUNK_SIZE,
+    lines: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            "--lines",
+            metavar="START:END",
+            help=
+            "Only format the elements on the lines from START to END, counting from 1, and keep the rest of the input as it is. Can be given more than once.",
+            show_default=False,
+        )] = None,
+    gitHunks: Annotated[
+        bool,
+        typer.Option(
+            "--git-hunks",
+            help=
+            "Only format the elements on the lines of the input file changed since the last commit, as git diff reports them, and keep the rest of the file as it is. A file that git does not track is formatted as a whole.",
+            show_default=False,
+        )] = False,
     indent: Annotated[
         Optional[int],
         typer.Option(
@@ -69,12 +161,41 @@ def _mainPtx(
             "Indent using tabs instead. Overwrites the standard configuration."
         )] = None,
     configFile: Annotated[
-        Optional[typer.FileText],
+        Optional[list[typer.FileText]],
         typer.Option(
             "--config-file",
             "-c",
             help=
-            "File to use as configuration. If omitted, a standard configuration file is loaded.",
+            "File to use as configuration. If omitted, each file uses the closest ptx-formatter.toml file, or pyproject.toml file with a [tool.ptx-formatter] table, in its directory or above, and the standard configuration if there is none. Can be given more than once with --compare.",
+            show_default=False,
+        ),
+    ] = None,
+    compare: Annotated[
+        bool,
+        typer.Option(
+            "--compare",
+            help=
+            "Compare the configuration files given with --config-file: report which input files each of them would change, without changing any. The input can be a file, standard input, or a directory to compare all of its *.ptx files.",
+            show_default=False,
+        ),
+    ] = False,
+    batch: Annotated[
+        bool,
+        typer.Option(
+            "--batch",
+            help=
+            "Format many documents in one run: read one JSON object per line from standard input, with the document under text and optionally its path, a config file and an id, and write one JSON object per line to standard output, with the formatted text or an error, in the same order.",
+            show_default=False,
+        ),
+    ] = False,
+    jobs: Annotated[
+        Optional[int],
+        typer.Option(
+            "--jobs",
+            "-j",
+            help=
+            "The number of files formatted at the same time with --in-place, or of documents with --batch, each in a worker process. Defaults to the number of processors.",
+            min=1,
             show_default=False,
         ),
     ] = None,
@@ -83,26 +204,18 @@ def _mainPtx(
         typer.Option(
             "--show-config",
             help=
-            "Print the current configuration and exit. This is in a TOML form that could be saved to a file and used as a start file."
+            "Print the configuration that applies to the input file, or to the current directory, and exit. This is in a TOML form that could be saved to a file and used as a start file."
         )] = False,
     version: Annotated[bool,
                        typer.Option("--version",
                                     callback=version_callback,
                                     help="Print the version and exit.",
                                     is_eager=True)] = None,
-    input_file: Annotated[
-        Optional[Path],
-        typer.Argument(
-            help=
-            "File to use as input. If omitted, read the contents of standard input.",
-            show_default=False,
-        ),
-    ] = None,
-    output_file: Annotated[
-        Optional[Path],
+    files: Annotated[
+        Optional[list[Path]],
         typer.Argument(
             help=
-            "File to use as output. If omitted, write the results to standard output.",
+            "The file to use as input, and the file to use as output. If the input is omitted, read the contents of standard input, and if the output is omitted, write the results to standard output. With --in-place, any number of files to format, or of directories with --recursive.",
             show_default=False,
         ),
     ] = None,
@@ -110,36 +223,209 @@ def _mainPtx(
   """
   Reformats a PreText XML document to follow a standard format.
   """
+  files = files or []
+  if len(files) > 2 and not inPlace:
+    print("ERROR: Several input files require --in-place.")
+    raise typer.Abort()
+  input_file = files[0] if files else None
+  output_file = files[1] if len(files) > 1 and not inPlace else None
   if addDocId is None:
-    addDocId = output_file is not None or inPlace
-  config = assemble_config(configFile, indent, tabIndent, addDocId)
+    addDocId = output_file is not None or inPlace or compare
+  configFiles = configFile or []
+  if compare:
+    if len(files) > 1:
+      print("ERROR: --compare takes a single input.")
+      raise typer.Abort()
+    if configFiles == []:
+      print("ERROR: --compare requires at least one --config-file.")
+      raise typer.Abort()
+    configs = [
+        assemble_config(file, indent, tabIndent, addDocId)
+        for file in configFiles
+    ]
+    excludes = (DEFAULT_EXCLUDES
+                if exclude is None else exclude) + (extendExclude or [])
+    return process_compare(input_file, configs,
+                           [file.name for file in configFiles], excludes)
+  if len(configFiles) > 1:
+    print("ERROR: Several configuration files can only be used with --compare.")
+    raise typer.Abort()
+  if batch:
+    if inPlace or input_file is not None:
+      print("ERROR: --batch reads standard input and cannot take files.")
+      raise typer.Abort()
+    adjust = partial(adjust_config,
+                     indent=indent,
+                     tabIndent=tabIndent,
+                     addDocId=addDocId)
+    config = (assemble_config(configFiles[0], indent, tabIndent, addDocId)
+              if configFiles else None)
+    failed = run_batch(sys.stdin, sys.stdout, jobs or os.cpu_count() or 1,
+                       config, adjust)
+    raise typer.Exit(1 if failed else 0)
+  if configFiles:
+    config = assemble_config(configFiles[0], indent, tabIndent, addDocId)
+    finder = None
+  else:
+    # Each file gets the configuration discovered above it
+    finder = ConfigFinder(
+        lambda config: adjust_config(config, indent, tabIndent, addDocId))
+    config = finder.config_for(input_file or Path.cwd())
   if showConfig:
+    if finder is not None:
+      config_file = finder.config_file_for(input_file or Path.cwd())
+      if config_file is not None:
+        sys.stdout.write(f"# Configuration from {config_file}\n")
     sys.stdout.write(config.print())
     raise typer.Exit()
+  if not inPlace and (report is not None or timeout is not None or
+                      maxMemory is not None or maxFileSize is not None):
+    print("ERROR: --report, --timeout, --max-memory and --max-file-size "
+          "require --in-place.")
+    raise typer.Abort()
+  limits = Limits(timeout, maxMemory, maxFileSize)
+  jobs = jobs or os.cpu_count() or 1
   if recursive:
-    if not inPlace or input_file is None or not input_file.is_dir():
+    if not inPlace or files == [] or not all(path.is_dir() for path in files):
       print("ERROR: recursive option requires --in-place and a directory.")
       raise typer.Abort()
-    return process_recursive(input_file, config)
-  if inPlace:
-    if output_file is not None:
-      print("ERROR: Cannot specify both --in-place and an output file.")
+    excludes = (DEFAULT_EXCLUDES
+                if exclude is None else exclude) + (extendExclude or [])
+    return process_recursive(files, config, finder, excludes, fsync, report,
+                             limits, jobs)
+  if lines or gitHunks:
+    if recursive or len(files) > 1 and inPlace:
+      print("ERROR: --lines and --git-hunks take a single input.")
+      raise typer.Abort()
+    if (report is not None or timeout is not None or maxMemory is not None or
+        maxFileSize is not None):
+      print("ERROR: --lines and --git-hunks do not take --report, --timeout, "
+            "--max-memory or --max-file-size.")
       raise typer.Abort()
-    output_file = input_file
+    if gitHunks and input_file is None:
+      print("ERROR: --git-hunks requires an input file.")
+      raise typer.Abort()
+    try:
+      ranges = [parse_line_range(text) for text in lines or []]
+      if gitHunks:
+        hunks = git_hunks(input_file)
+        # An untracked file is new as a whole
+        ranges += [(1, sys.maxsize)] if hunks is None else hunks
+    except (ValueError, RuntimeError) as e:
+      print(f"ERROR: {e}")
+      raise typer.Abort()
+    return process_lines(input_file, output_file if not inPlace else input_file,
+                         ranges, config, fsync)
+  if inPlace and files != []:
+    if len(files) == 1:
+      return process_in_place(files, config, None, fsync, report, limits)
+    return process_in_place(files, config, finder, fsync, report, limits,
+                            min(jobs, len(files)))
   inputString = read_file_or_stdin(input_file)
-  formatted = formatPretext(inputString, config)
+  formatted = PtxFormatter(config).iter_format(inputString, bufferSize)
   write_file_or_stdout(output_file, formatted)
 
 
-def process_recursive(directory: Path, config: Config) -> None:
-  files = glob("**/*.ptx", root_dir=directory, recursive=True)
-  if sys.stdout.isatty():
-    for file in track(files, description="Processing ..."):
-      write_in_place(directory / file, config)
+def process_recursive(directories: list[Path],
+                      config: Config,
+                      finder: ConfigFinder | None,
+                      excludes: list[str],
+                      fsync: Sync,
+                      report: str | None = None,
+                      limits: "Limits" = None,
+                      jobs: int = 1) -> None:
+  """Format the files in place, with `config`, or with the configuration
+  that `finder` discovers for each file. Files are formatted as soon as
+  they are found."""
+  files = chain.from_iterable(
+      walk_files(directory, excludes=excludes) for directory in directories)
+  if sys.stdout.isatty() and report != "-":
+    files = track(files, description="Processing ...")
+  process_in_place(files, config, finder, fsync, report, limits, jobs)
+
+
+def process_in_place(files: Iterable[Path],
+                     config: Config,
+                     finder: ConfigFinder | None,
+                     fsync: Sync,
+                     report: str | None = None,
+                     limits: "Limits" = None,
+                     jobs: int = 1) -> None:
+  """Format the files in place. A file that fails or goes over the limits
+  is reported, and the run goes on with the next one.
+
+  With more than one job, that many files are formatted at the same time,
+  each in a worker process. The files are still reported in the order
+  given, so the output of a run does not depend on which file is done
+  first."""
+  limits = limits or Limits()
+  stats = InPlaceStats(None if report is None else ReportWriter(report))
+  # The configurations are found here, so that each is read only once
+  jobs_args = ((path, config if finder is None else finder.config_for(path))
+               for path in files)
+
+  def format_file(args: tuple[Path, Config], worker: FileWorker | None):
+    return limits.format_in_place(*args, fsync, worker)
+
+  if jobs > 1:
+    with limits.pool(jobs) as pool:
+      for file_report in pool.map(format_file, jobs_args):
+        stats.add(file_report)
+  else:
+    worker = limits.worker()
+    try:
+      for args in jobs_args:
+        stats.add(format_file(args, worker))
+    finally:
+      if worker is not None:
+        worker.close()
+  stats.finish(fsync)
+  raise typer.Exit(1 if stats.failed else 0)
+
+
+def process_lines(input_file: Path | None, output_file: Path | None,
+                  ranges: list[LineRange], config: Config, fsync: Sync) -> None:
+  """Format the elements of the input on the given lines, and keep the rest
+  of it. A file formatted in place is only written if it changes."""
+  if input_file is None:
+    data, text = None, sys.stdin.read()
+  else:
+    data, text = read_source(input_file)
+  result = formatPretextLines(text, ranges, config)
+  if input_file is not None and output_file == input_file:
+    if result.encode("utf-8") != data:
+      replace_file(input_file, result.encode("utf-8"), fsync == Sync.always)
+    return
+  write_file_or_stdout(output_file, [result])
+
+
+def process_compare(input_file: Path | None, configs: list[Config],
+                    names: list[str], excludes: list[str]) -> None:
+  if input_file is None:
+    files = [None]
+  elif input_file.is_dir():
+    files = list(walk_files(input_file, excludes=excludes))
   else:
-    for file in files:
-      write_in_place(directory / file, config)
-  raise typer.Exit()
+    files = [input_file]
+  changed = [[] for _ in configs]
+  failed = 0
+  for file in files:
+    try:
+      text = read_file_or_stdin(file)
+      results = formatPretextConfigs(text, configs)
+    except Exception as e:
+      print(f"ERROR: {file or '<stdin>'}: {e}")
+      failed += 1
+      continue
+    for idx, result in enumerate(results):
+      if result != text:
+        changed[idx].append(file or "<stdin>")
+  for name, files_changed in zip(names, changed):
+    print(f"{name}: {len(files_changed)} of {len(files) - failed} "
+          "files would change")
+    for file in files_changed:
+      print(f"  {file}")
+  raise typer.Exit(1 if failed else 0)
 
 
 def read_file_or_stdin(input_file: Path | None) -> str:
@@ -149,19 +435,143 @@ def read_file_or_stdin(input_file: Path | None) -> str:
     return f.read()
 
 
-def write_file_or_stdout(output_file: Path | None, data: str) -> str:
+def write_file_or_stdout(output_file: Path | None, chunks: Iterable[str]):
+  """Write the pieces of the output to standard output as they come, or to
+  the output file once they are all there, so that a failure part way
+  leaves the file as it was."""
   if output_file is None:
-    return sys.stdout.write(data)
+    for chunk in chunks:
+      sys.stdout.write(chunk)
+      sys.stdout.flush()
+    return
+  data = "".join(chunks)
   with open(output_file, "w", encoding="utf-8") as f:
-    return f.write(data)
+    f.write(data)
+
+
+class Limits:
+  """The limits on each file formatted in place."""
+  timeout: float | None
+  """The seconds a file can take."""
+  max_memory: float | None
+  """The megabytes of memory a file can use."""
+  max_file_size: float | None
+  """The size in megabytes of the largest file formatted."""
+
+  def __init__(self,
+               timeout: float | None = None,
+               max_memory: float | None = None,
+               max_file_size: float | None = None):
+    self.timeout = timeout
+    self.max_memory = max_memory
+    self.max_file_size = max_file_size
 
+  def worker(self) -> FileWorker | None:
+    """The worker process that enforces the limits on time and memory, if
+    there are any."""
+    if self.timeout is None and self.max_memory is None:
+      return None
+    return FileWorker(write_in_place, self.timeout, self.max_memory)
 
-def write_in_place(inPlaceFile, config):
-  with open(inPlaceFile, "r") as f:
-    inputString = f.read()
-  result = formatPretext(inputString, config)
-  with open(inPlaceFile, "w") as f:
-    f.write(result)
+  def pool(self, size: int) -> FileWorkerPool:
+    """Worker processes for formatting `size` files at a time within the
+    limits."""
+    return FileWorkerPool(write_in_place, size, self.timeout, self.max_memory)
+
+  def format_in_place(self, path: Path, config: Config, fsync: Sync,
+                      worker: FileWorker | None) -> FileReport:
+    """Format a file in place within the limits, with `worker` if there is
+    one."""
+    report = FileReport(str(path))
+    try:
+      if self.max_file_size is not None:
+        size = os.stat(path).st_size
+        if size > self.max_file_size * 1024 * 1024:
+          report.input_bytes = size
+          report.skip(f"larger than {self.max_file_size:g} MB")
+          return report
+      if worker is None:
+        return write_in_place(path, config, fsync)
+      return worker.run(path, config, fsync)
+    except Exception as e:
+      report.fail(e)
+      return report
+
+
+class InPlaceStats:
+  """Counts the files formatted in place during a run."""
+  files: int
+  changed: int
+  failed: int
+  skipped: int
+  bytes_written: int
+  writer: ReportWriter | None
+  """Where the record of each file goes, if a report was asked for."""
+
+  def __init__(self, writer: ReportWriter | None = None):
+    self.files = 0
+    self.changed = 0
+    self.failed = 0
+    self.skipped = 0
+    self.bytes_written = 0
+    self.writer = writer
+
+  def add(self, report: FileReport):
+    """Note the outcome of a file."""
+    self.files += 1
+    if report.status == Status.reformatted:
+      self.changed += 1
+      self.bytes_written += report.output_bytes
+    elif report.status == Status.skipped:
+      self.skipped += 1
+      print(f"SKIPPED: {report.path}: {report.error}", file=sys.stderr)
+    elif report.status == Status.error:
+      self.failed += 1
+      position = "" if report.line is None else f"{report.line}:{report.column}:"
+      print(f"ERROR: {report.path}:{position} {report.error}", file=sys.stderr)
+    if self.writer is not None:
+      self.writer.add(report)
+
+  def finish(self, fsync: Sync):
+    """Flush the files written if that was left for the end, and report
+    the counts on standard error."""
+    if fsync == Sync.batch and self.changed > 0:
+      os.sync()
+    if self.writer is not None:
+      self.writer.close()
+    extra = "".join(f" {count} files {what}."
+                    for count, what in [(self.skipped,
+                                         "skipped"), (self.failed, "failed")]
+                    if count)
+    print(
+        f"{self.changed} of {self.files} files reformatted, "
+        f"{self.bytes_written} bytes written.{extra}",
+        file=sys.stderr)
+
+
+def write_in_place(inPlaceFile: Path,
+                   config: Config,
+                   fsync: Sync = Sync.always) -> FileReport:
+  """Format a file, and replace it only if the result differs from it.
+  Errors are recorded in the report of the file instead of raised, except
+  for running out of memory, which raises `MemoryError` so that the worker
+  process that ran the file is replaced (see `Limits.format_in_place`)."""
+  report = FileReport(str(inPlaceFile))
+  try:
+    data, inputString = read_source(inPlaceFile)
+    report.input_bytes = len(data)
+    result = format_with_report(inputString, config, report).encode("utf-8")
+    report.output_bytes = len(result)
+    if result != data:
+      replace_file(inPlaceFile, result, fsync == Sync.always)
+      report.status = Status.reformatted
+  except MemoryError:
+    raise
+  except Exception as e:
+    if is_out_of_memory(e):
+      raise MemoryError() from e
+    report.fail(e)
+  return report
 
 
 def main():
@@ -174,14 +584,19 @@ def assemble_config(configFile, indent: int | None, tabIndent: bool | None,
     config = Config.fromFile(configFile)
   else:
     config = Config.standard()
+  adjust_config(config, indent, tabIndent, addDocId)
+  return config
 
+
+def adjust_config(config: Config, indent: int | None, tabIndent: bool | None,
+                  addDocId: bool):
+  """Apply the command-line options to a configuration."""
   config.set_add_doc_id(addDocId)
 
   if tabIndent is not None:
     config.set_indent("\t")
   elif indent is not None:
     config.set_indent(indent)
-  return config
 
 
 if __name__ == "__main__":
@@ -0,0 +1,245 @@
+"""
+Parsed documents that can be kept, serialized, and rendered any number of
+times, under any configuration.
+
+`parse` turns the text of a document into a `Document`, and `render` formats
+a `Document` under a configuration, without parsing it again. A `Document`
+serializes compactly with `Document.to_bytes`, or with `pickle`, so that the
+parsed form of a file can be cached between runs.
+
+A document keeps the layout of its last rendering under each configuration.
+After `Document.edit`, which parses again only the smallest element around
+the edit, rendering the document again only lays out that element and its
+ancestors.
+
+The tree of a document is made of the classes of `ptx_formatter.utils.ast`:
+- `Element`, with its `tag` (None for the root), its `attrs` as a dictionary,
+  its `children`, and its `start`, `inner_start`, `inner_end` and `end`
+  offsets in the source text.
+- `Text`, `Comment` and `Processing`, which hold their text in `txt`.
+"""
+import marshal
+from typing import Self
+
+from ptx_formatter.formatter import (Config, Formatter, keep_final_newline,
+                                     standard_config)
+from ptx_formatter.utils.ast import Attrs, Comment, Element, Processing, Text
+from ptx_formatter.utils.context import Context
+from ptx_formatter.utils.doc import render as render_layout
+from ptx_formatter.utils.shared import SharedDocs
+import xml.etree.ElementTree as ET
+
+FORMAT_VERSION = 1
+"""The version of the serialized form. Data written with another version
+is rejected by `Document.from_bytes`."""
+
+_ELEMENT = 0
+_COMMENT = 1
+_PROCESSING = 2
+
+
+class Document:
+  """A parsed document: the tree of its nodes and the text it came from.
+  The tree should only be changed through `edit` once the document has been
+  rendered."""
+  root: Element
+  """The root of the tree, with tag None. Its children are the top-level
+  nodes of the document."""
+  source: str
+  """The text the document was parsed from. Parts of it are copied to the
+  output as they are when possible."""
+  _layouts: SharedDocs | None
+  """The layout documents of the elements, kept from earlier renderings."""
+
+  def __init__(self: Self, root: Element, source: str):
+    self.root = root
+    self.source = source
+    self._layouts = None
+
+  def edit(self: Self, start: int, end: int, replacement: str):
+    """Replace `source[start:end]` with `replacement`, and update the tree
+    to match. Only the contents of the smallest element that contains the
+    edit, and whose tags it leaves alone, are parsed again. The offsets of
+    the elements after the edit are shifted. Raises
+    `xml.etree.ElementTree.ParseError`, and leaves the document as it was,
+    if the new text is not well-formed."""
+    if not 0 <= start <= end <= len(self.source):
+      raise ValueError(f"Edit {start}:{end} outside of the source")
+    source = self.source[:start] + replacement + self.source[end:]
+    delta = len(replacement) - (end - start)
+    path = _enclosing_path(self.root, start, end)
+    element = path[-1]
+    if element is self.root:
+      self._replace(parse(source))
+      return
+    contents = source[element.inner_start:element.inner_end + delta]
+    try:
+      fragment = Formatter(contents,
+                           standard_config(),
+                           fragment=True,
+                           namespaces=_namespaces(path)).root
+    except ET.ParseError:
+      # The edit may be fine in the whole document, as when it closes an
+      # element and opens another. Its error positions are also right.
+      self._replace(parse(source))
+      return
+    for node in fragment.children:
+      if isinstance(node, Element):
+        _shift(node, element.inner_start)
+    for parent, child in zip(path, path[1:]):
+      parent.inner_end += delta
+      parent.end += delta
+      following = parent.children[parent.children.index(child) + 1:]
+      for node in following:
+        if isinstance(node, Element):
+          _shift(node, delta)
+    element.inner_end += delta
+    element.end += delta
+    element.children = fragment.children
+    element._normalized = None
+    for parent in path:
+      parent._tag_mask = parent._source_forms = None
+    self.source = source
+    if self._layouts is not None:
+      self._layouts.forget(path)
+
+  def _replace(self: Self, other: Self):
+    self.root = other.root
+    self.source = other.source
+    self._layouts = None
+
+  def to_bytes(self: Self) -> bytes:
+    """The serialized form of the document. Tags are stored by name, so the
+    data can be read in another process.
+
+    The nodes are stored as a flat list in document order. Each element
+    is followed by its descendants and records its number of children, so
+    that trees of any depth can be read and written without recursion."""
+    nodes = []
+    stack = [self.root]
+    while stack:
+      node = stack.pop()
+      if isinstance(node, Element):
+        nodes.append(
+            (_ELEMENT, node.tag, node.attrs, node.start, node.inner_start,
+             node.inner_end, node.end, len(node.children)))
+        stack.extend(reversed(node.children))
+      elif isinstance(node, Text):
+        nodes.append(node.txt)
+      elif isinstance(node, Comment):
+        nodes.append((_COMMENT, node.txt))
+      elif isinstance(node, Processing):
+        nodes.append((_PROCESSING, node.txt))
+      else:
+        raise TypeError(f"Cannot serialize node {node}")
+    return marshal.dumps((FORMAT_VERSION, self.source, nodes))
+
+  @classmethod
+  def from_bytes(cls, data: bytes) -> Self:
+    """Read a document serialized by `to_bytes`. Raises `ValueError` if
+    the data is not a serialized document of the current version."""
+    try:
+      version, source, nodes = marshal.loads(data)
+    except (EOFError, TypeError, ValueError):
+      raise ValueError("Not a serialized document") from None
+    if version != FORMAT_VERSION:
+      raise ValueError(f"Unsupported document format version {version}")
+    root, count = _element(nodes[0])
+    # The elements whose children are being read, with how many are left
+    stack = [[root, count]]
+    for idx in range(1, len(nodes)):
+      while stack[-1][1] == 0:
+        stack.pop()
+      parent = stack[-1]
+      parent[1] -= 1
+      node = nodes[idx]
+      if type(node) is str:
+        child = Text(node)
+      elif node[0] == _ELEMENT:
+        child, count = _element(node)
+        if count > 0:
+          stack.append([child, count])
+      elif node[0] == _COMMENT:
+        child = Comment(node[1])
+      else:
+        child = Processing(node[1])
+      parent[0].children.append(child)
+    return cls(root, source)
+
+  def __reduce__(self: Self):
+    return (Document.from_bytes, (self.to_bytes(),))
+
+
+def parse(text: str) -> Document:
+  """Parse the text of a document. Raises `xml.etree.ElementTree.ParseError`
+  if it is not well-formed."""
+  return Document(Formatter(text, standard_config()).root, text)
+
+
+def render(document: Document, config: Config = None) -> str:
+  """Format a parsed document using the provided `ptx_formatter.Config`, or
+  a standard one. The result is the same as `ptx_formatter.formatPretext`
+  on the text of the document."""
+  config = config or standard_config()
+  if document._layouts is None:
+    document._layouts = SharedDocs()
+  document._layouts.start(config)
+  ctx = Context(config, source=document.source, shared=document._layouts)
+  result = render_layout(document.root.doc_block(ctx), ctx.max_line_width())
+  return keep_final_newline(document.source, result)
+
+
+def _element(node: tuple) -> tuple[Element, int]:
+  """The element of a serialized node, and its number of children."""
+  _, tag, attrs, start, inner_start, inner_end, end, count = node
+  element = Element(tag, attrs)
+  element.start = start
+  element.inner_start = inner_start
+  element.inner_end = inner_end
+  element.end = end
+  return element, count
+
+
+def _enclosing_path(root: Element, start: int, end: int) -> list[Element]:
+  """The elements from the root down to the smallest one whose contents
+  contain the source range from `start` to `end`."""
+  path = [root]
+  while True:
+    child = _enclosing_child(path[-1], start, end)
+    if child is None:
+      return path
+    path.append(child)
+
+
+def _enclosing_child(element: Element, start: int, end: int) -> Element | None:
+  for child in element.children:
+    if isinstance(child, Element):
+      if child.start > start:
+        return None
+      if (child.inner_start <= start and end <= child.inner_end and
+          child.inner_end < child.end):
+        return child
+  return None
+
+
+def _namespaces(path: list[Element]) -> Attrs:
+  """The `xmlns` attributes of the namespaces in scope in the contents of
+  the last element of `path`."""
+  namespaces = {}
+  for element in path:
+    for k, v in element.attrs.items():
+      if k == "xmlns" or k.startswith("xmlns:"):
+        namespaces[k] = v
+  return namespaces
+
+
+def _shift(element: Element, delta: int):
+  """Shift the offsets of the element and of its descendants by `delta`."""
+  stack = [element]
+  while stack:
+    element = stack.pop()
+    element.start += delta
+    element.inner_start += delta
+    element.inner_end += delta
+    element.end += delta
+    stack.extend(ch for ch in element.children if isinstance(ch, Element))
@@ -1,13 +1,23 @@
 """
 Formatter for PreText and other XML files
 """
-from typing import Self
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache
+from typing import Iterable, Iterator, Literal, Self
 import xml.etree.ElementTree as ET
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
 
 from ptx_formatter.utils.ast import Element, Attrs, Comment, Text, Processing
 from ptx_formatter.utils.context import Context
 from ptx_formatter.utils.namespace import Namespace
 from ptx_formatter.utils.config import Config
+from ptx_formatter.utils.doc import CHUNK_SIZE, Doc, layout, render
+from ptx_formatter.utils.edits import TextEdit, apply_edits, compute_edits
+from ptx_formatter.utils.indent import Indent
+from ptx_formatter.utils.lines import LineRange, line_edits
+from ptx_formatter.utils.shared import SharedDocs
+from ptx_formatter.utils.workers import process_context
 
 
 def formatPretext(
@@ -17,36 +27,401 @@ def formatPretext(
   """Format the provided (valid) XML trees using the provided `ptx_formatter.Config`
   object. Use a standard Config object if one is not provided.
   """
-  formatter = Formatter(text, config or Config.standard())
-  result = formatter.format()
+  formatter = Formatter(text, config or standard_config())
+  return keep_final_newline(text, formatter.format())
+
+
+def formatPretextEdits(
+    text: str,
+    config: Config = None,
+) -> list[TextEdit]:
+  """Format the provided document like `formatPretext`, but return the
+  changes to make to `text` instead of the whole formatted document.
+
+  The result is a list of `(start, end, replacement)` edits, sorted and
+  non-overlapping, with offsets into `text`. An already formatted document
+  gives an empty list. Use `ptx_formatter.utils.edits.apply_edits` to apply
+  them."""
+  return Formatter(text, config or standard_config()).edits()
+
+
+def formatPretextLines(
+    text: str,
+    lines: Iterable[LineRange],
+    config: Config = None,
+) -> str:
+  """Format only the elements of the document on the given lines, and keep
+  the rest of it as it is. `lines` are `(first, last)` pairs of line
+  numbers, counting from 1, with both lines included, such as the lines
+  changed by an author.
+
+  Each line range is formatted through the smallest element laid out in
+  block mode that starts a line and holds the range, or through the
+  elements that overlap it. The whole document is formatted when there is
+  none. See `ptx_formatter.utils.lines`."""
+  formatter = Formatter(text, config or standard_config())
+  return apply_edits(text, formatter.line_edits(lines))
+
+
+def formatFragment(
+    text: str,
+    config: Config = None,
+    base_indent_level: int = 0,
+) -> str:
+  """Format a fragment of a document: any sequence of elements, text,
+  comments and processing instructions that could appear inside an
+  element, such as a selection in an editor. The fragment is laid out as
+  the contents of a block element would be, with its lines indented by
+  `base_indent_level` levels. No document identifier is added."""
+  config = config or standard_config()
+  ctx = Context(config, Indent(config._base_indent, base_indent_level))
+  formatter = Formatter(text, config, ctx, fragment=True)
+  return keep_final_newline(text, formatter.format())
+
+
+def formatPretextConfigs(
+    text: str,
+    configs: Iterable[Config],
+) -> list[str]:
+  """Format the provided document under each of the `configs`, returning the
+  results in the same order. The document is parsed only once, and the
+  layout of the parts of the document that the configurations format the
+  same way is shared between them."""
+  formatter = Formatter(text, standard_config())
+  return [
+      keep_final_newline(text, result)
+      for result in formatter.format_configs(configs)
+  ]
+
+
+class PtxFormatter:
+  """A reusable formatting session for library callers that format many
+  documents with the same `ptx_formatter.Config`.
+
+  The configuration and the base formatting context are set up once, when
+  the session is created, and shared by all calls to `format` and
+  `format_many`. The configuration should not be changed while the
+  session is in use.
+  """
+  config: Config
+  """The configuration used for all documents of this session."""
+  _ctx: Context
+  """The base context shared by all documents."""
+
+  def __init__(self: Self, config: Config = None):
+    self.config = config or Config.standard()
+    self._ctx = Context(self.config)
+
+  def format(self: Self, text: str) -> str:
+    """Format a single document. Same as `formatPretext`."""
+    formatter = Formatter(text, self.config, self._ctx)
+    return keep_final_newline(text, formatter.format())
+
+  def iter_format(self: Self,
+                  text: str,
+                  chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Format a single document, producing the result in pieces of about
+    `chunk_size` characters as they are rendered. Joining the pieces gives
+    the result of `format`."""
+    formatter = Formatter(text, self.config, self._ctx)
+    return _keep_final_newline_chunks(text, formatter.iter_format(chunk_size))
+
+  def format_edits(self: Self, text: str) -> list[TextEdit]:
+    """Format a single document, returning the edits to make to `text`.
+    Same as `formatPretextEdits`."""
+    return Formatter(text, self.config, self._ctx).edits()
+
+  def format_many(self: Self,
+                  texts: Iterable[str],
+                  workers: int = 1,
+                  executor: Literal["thread", "process"] = "thread",
+                  chunksize: int = 16) -> list[str]:
+    """Format a number of documents, returning the results in the same order.
+
+    - `workers` is the number of documents formatted concurrently. With the
+      default of 1 the documents are formatted one after the other in the
+      current thread.
+    - `executor` is either `"thread"` or `"process"`. Process workers each
+      receive a copy of the configuration once, when they start.
+    - `chunksize` is the number of documents sent to a process worker at a
+      time. It is ignored for threads.
+    """
+    if workers <= 1:
+      return [self.format(text) for text in texts]
+    if executor == "thread":
+      with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(self.format, texts))
+    if executor == "process":
+      with ProcessPoolExecutor(max_workers=workers,
+                               mp_context=process_context(),
+                               initializer=_init_worker,
+                               initargs=(self.config,)) as pool:
+        return list(pool.map(_format_in_worker, texts, chunksize=chunksize))
+    raise ValueError(f"Unknown executor kind: {executor}")
+
+
+_worker_session: PtxFormatter | None = None
+"""The session used by the current process worker of `format_many`."""
+
+
+def _init_worker(config: Config):
+  global _worker_session
+  _worker_session = PtxFormatter(config)
+
+
+def _format_in_worker(text: str) -> str:
+  return _worker_session.format(text)
+
+
+@cache
+def standard_config() -> Config:
+  """The standard configuration, loaded once and shared by all the callers
+  that are not given one. It must not be modified."""
+  return Config.standard()
+
+
+def keep_final_newline(text: str, result: str) -> str:
+  """The formatted `result` of `text`, ending with a newline if `text` does.
+  The layout drops the final newline, which most files have."""
   if text.endswith("\n") and not result.endswith("\n"):
     result += "\n"
   return result
 
 
-class Formatter(ET.TreeBuilder):
+def _keep_final_newline_chunks(text: str,
+                               chunks: Iterable[str]) -> Iterator[str]:
+  last = ""
+  for chunk in chunks:
+    if chunk:
+      last = chunk
+      yield chunk
+  if text.endswith("\n") and not last.endswith("\n"):
+    yield "\n"
+
+
+class Formatter:
+  """Parses a document into a tree of `ptx_formatter.utils.ast.Element`
+  objects and formats it.
+
+  The parse is driven by expat directly, so that each element can record
+  where it starts and ends in the source text. See `Element.start`."""
   final_string: str | None = None
   """The resulting formatted string. Returned from `format`"""
+  source: str
+  """The source text of the document."""
+  root: Element
+  """The root of the tree. Its children are the top-level nodes."""
   _pending: list[Element]
   """The list of currently open elements contexts."""
   _current: Element
   """The current context whose contents are processed"""
   _ns: Namespace
   """Manages the active namespaces."""
+  _text: list[str]
+  """Character data not yet added to the current element."""
+  _opened: Element | None
+  """An element whose start tag was the last event seen. Its contents start
+  where the next event starts."""
+  _closed: Element | None
+  """An element whose end tag was the last event seen. It ends where the
+  next event starts."""
+  _fragment: bool
+  """Whether the text is a fragment, whose top-level nodes are laid out as
+  the contents of an element. See `formatFragment`."""
+  _namespaces: Attrs | None
+  """The `xmlns` attributes of the namespaces in scope for a fragment."""
+  _offset: int
+  """The number of bytes fed to the parser before the text itself."""
 
-  def __init__(self: Self, text: str, config: Config = None):
-    self.base_ctx = Context(config or Config.standard())
+  def __init__(self: Self,
+               text: str,
+               config: Config = None,
+               base_ctx: Context = None,
+               fragment: bool = False,
+               namespaces: Attrs = None):
+    """With `fragment`, the text is parsed as a fragment, in which the
+    prefixes declared by the `xmlns` attributes of `namespaces` can be
+    used."""
+    base_ctx = base_ctx or Context(config or Config.standard())
+    self.base_ctx = base_ctx.with_source(text)
+    self.source = text
+    self._fragment = fragment
+    self._namespaces = namespaces
     self._ns = Namespace()
     self._pending = []
     self.root = Element()
     self._current = self.root
-    ET.fromstring(text, parser=ET.XMLParser(target=self))
+    self._text = []
+    self._opened = None
+    self._closed = None
+    self._parse(text)
 
   def format(self: Self) -> str:
     if self.final_string is None:
-      self.final_string = self.root.render_block(self.base_ctx)
+      self.final_string = render(self.document(), self._width())
     return self.final_string
 
+  def iter_format(self: Self, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Produce the formatted string in pieces of about `chunk_size`
+    characters, as soon as they are laid out. The layout of each block
+    element is only built when the output reaches it, so the first pieces
+    come before the rest of the document is laid out."""
+    if self.final_string is not None:
+      yield self.final_string
+      return
+    yield from layout(self.document(self.base_ctx.deferring()), self._width(),
+                      chunk_size)
+
+  def edits(self: Self) -> list[TextEdit]:
+    """The edits that turn the source text into the formatted text."""
+    spans = {}
+    doc = self.document(self.base_ctx.recording_spans())
+    output = keep_final_newline(self.source, render(doc, self._width(), spans))
+    return compute_edits(self.source, output, self.root, spans)
+
+  def line_edits(self: Self, lines: Iterable[LineRange]) -> list[TextEdit]:
+    """The edits that format the elements on the given lines. See
+    `formatPretextLines`."""
+    edits = line_edits(self.source, self.root, self.base_ctx, lines)
+    return self.edits() if edits is None else edits
+
+  def format_configs(self: Self, configs: Iterable[Config]) -> list[str]:
+    """Format the parsed document under each of several configurations.
+    See `formatPretextConfigs`."""
+    shared = SharedDocs()
+    results = []
+    for config in configs:
+      shared.start(config)
+      ctx = Context(config, source=self.source, shared=shared)
+      results.append(render(self.document(ctx), ctx.max_line_width()))
+    return results
+
+  def document(self: Self, ctx: Context = None) -> Doc:
+    """The layout document of the whole tree. See `ptx_formatter.utils.doc`."""
+    if self._fragment:
+      return self.root.doc_fragment(ctx or self.base_ctx)
+    return self.root.doc_block(ctx or self.base_ctx)
+
+  def _width(self: Self) -> int | None:
+    return self.base_ctx.max_line_width()
+
+  def _parse(self: Self, text: str):
+    data = text.encode("utf-8")
+    parser = expat.ParserCreate("utf-8", "}")
+    self._parser = parser
+    self._ascii = len(data) == len(text)
+    self._offset = 0
+    parser.StartElementHandler = self._on_start
+    parser.EndElementHandler = self._on_end
+    if self._fragment:
+      # Expat needs a single root element. Its tags are fed around the
+      # text, but no element is made for it.
+      start = _fragment_start(self._namespaces)
+      self._offset = len(start)
+      data = start + data + FRAGMENT_END
+      parser.StartElementHandler = self._on_fragment_start
+      parser.EndElementHandler = self._on_fragment_end
+    self._data = data
+    self._byte_pos = self._offset
+    self._char_pos = 0
+    parser.CharacterDataHandler = self._on_data
+    parser.CommentHandler = self._on_comment
+    parser.ProcessingInstructionHandler = self._on_pi
+    parser.StartNamespaceDeclHandler = self.start_ns
+    parser.EndNamespaceDeclHandler = self.end_ns
+    parser.StartCdataSectionHandler = self._on_markup
+    parser.EndCdataSectionHandler = self._on_markup
+    parser.DefaultHandlerExpand = self._on_default
+    try:
+      parser.Parse(data, True)
+    except expat.ExpatError as e:
+      raise _parse_error(e, self._offset) from None
+    self._settle(len(text))
+    self.root.start = self.root.inner_start = 0
+    self.root.end = self.root.inner_end = len(text)
+    del self._parser, self._data
+
+  def _position(self: Self) -> int:
+    """The position in the source text of the current event. Expat reports
+    byte offsets into the UTF-8 encoded text; these are translated into
+    offsets into the text itself."""
+    idx = self._parser.CurrentByteIndex
+    if self._ascii:
+      return idx - self._offset
+    self._char_pos += len(self._data[self._byte_pos:idx].decode("utf-8"))
+    self._byte_pos = idx
+    return self._char_pos
+
+  def _event(self: Self) -> int:
+    """Note the start of a new event, which is where the previous one ends."""
+    pos = self._position()
+    self._settle(pos)
+    return pos
+
+  def _settle(self: Self, pos: int):
+    if self._opened is not None:
+      self._opened.inner_start = pos
+      self._opened = None
+    if self._closed is not None:
+      self._closed.end = pos
+      self._closed = None
+
+  def _flush_text(self: Self):
+    if self._text:
+      self._current.addChild(Text("".join(self._text)))
+      self._text = []
+
+  def _on_start(self: Self, tag: str, attrs: Attrs):
+    pos = self._event()
+    self._flush_text()
+    self.start(_expat_name(tag), _expat_attrs(attrs))
+    self._current.start = pos
+    self._opened = self._current
+
+  def _on_end(self: Self, tag: str):
+    pos = self._event()
+    self._flush_text()
+    element = self._current
+    element.inner_end = pos
+    self.end(_expat_name(tag))
+    self._closed = element
+
+  def _on_fragment_start(self: Self, tag: str, attrs: Attrs):
+    # The start of the wrapping element. The others are handled as usual.
+    self._parser.StartElementHandler = self._on_start
+    # Its namespaces are in scope, but not declared by the first element
+    list(self._ns.process_new_ns())
+
+  def _on_fragment_end(self: Self, tag: str):
+    if self._current is not self.root:
+      return self._on_end(tag)
+    # The end of the wrapping element
+    self._event()
+    self._flush_text()
+
+  def _on_data(self: Self, text: str):
+    # Text often comes in many pieces, split at references and line breaks.
+    # Only the first piece after a tag can end an event.
+    if self._opened is not None or self._closed is not None:
+      self._event()
+    self._text.append(text)
+
+  def _on_comment(self: Self, text: str):
+    self._event()
+    self._flush_text()
+    self.comment(text)
+
+  def _on_pi(self: Self, target: str, text: str):
+    self._event()
+    self._flush_text()
+    self.pi(target, text)
+
+  def _on_markup(self: Self):
+    self._event()
+
+  def _on_default(self: Self, text: str):
+    self._event()
+
   def start(self, tag: str, attrs: Attrs):
     # Need to fix the namespace-related attributes
     tag = self._ns.adjust_str(tag)
@@ -61,17 +436,52 @@ class Formatter(ET.TreeBuilder):
       raise RuntimeError(f"tag {self._current.tag} was matched by {closeTag}")
     self._current = self._pending.pop().addChild(self._current)
 
-  def data(self, text: str):
-    self._current.addChild(Text(text))
-
   def comment(self: Self, text: str):
     self._current.addChild(Comment(text))
 
-  def start_ns(self: Self, prefix: str, uri: str):
-    self._ns.add_prefix(prefix, uri)
+  def start_ns(self: Self, prefix: str | None, uri: str | None):
+    self._ns.add_prefix(prefix or "", uri or "")
 
-  def end_ns(self: Self, prefix: str):
-    self._ns.remove_prefix(prefix)
+  def end_ns(self: Self, prefix: str | None):
+    self._ns.remove_prefix(prefix or "")
 
   def pi(self: Self, target: str, text: str):
     self._current.addChild(Processing(f"{target} {text}"))
+
+
+FRAGMENT_TAG = "ptx-formatter-fragment"
+FRAGMENT_END = f"</{FRAGMENT_TAG}>".encode("utf-8")
+
+
+def _fragment_start(namespaces: Attrs | None) -> bytes:
+  """The start tag of the element wrapping a fragment, declaring the
+  namespaces in scope."""
+  attrs = "".join(f" {k}={quoteattr(v)}" for k, v in (namespaces or {}).items())
+  return f"<{FRAGMENT_TAG}{attrs}>".encode("utf-8")
+
+
+def _expat_name(name: str) -> str:
+  """Expat reports namespaced names as `uri}local`. Turn them into
+  the `{uri}local` form used by ElementTree."""
+  return "{" + name if "}" in name else name
+
+
+def _expat_attrs(attrs: Attrs) -> Attrs:
+  """The attributes reported by expat, with names in the `{uri}local` form.
+  The same dictionary is returned if none of them has a namespace."""
+  for k in attrs:
+    if "}" in k:
+      return {_expat_name(k): v for k, v in attrs.items()}
+  return attrs
+
+
+def _parse_error(e: expat.ExpatError, offset: int = 0) -> ET.ParseError:
+  """Report expat errors the same way as ElementTree does. The columns of
+  the first line are shifted back by the `offset` bytes fed before the
+  text."""
+  column = e.offset - offset if e.lineno == 1 else e.offset
+  err = ET.ParseError(
+      f"{expat.ErrorString(e.code)}: line {e.lineno}, column {column}")
+  err.code = e.code
+  err.position = (e.lineno, column)
+  return err
@@ -4,10 +4,13 @@ the XML file parse
 """
 
 from abc import ABC, abstractmethod
-from typing import Dict, Self, TypeAlias
+import re
+from typing import Dict, Generator, Self, TypeAlias
 
-from ptx_formatter.utils.context import Context
-from ptx_formatter.utils.config import Preference
+from ptx_formatter.utils.context import Context, Mode
+from ptx_formatter.utils.tags import tag_id
+from ptx_formatter.utils.doc import (Defer, Doc, INDENTATION, LINE, SOFT_BREAK,
+                                     Mark, Nest, rstrip_parts, strip_parts)
 from xml.sax.saxutils import escape as xmlescape, unescape as xmlunescape
 from functools import cmp_to_key
 
@@ -16,21 +19,35 @@ Attrs: TypeAlias = Dict[str, str]
 CDATA_OPEN = "<![CDATA["
 CDATA_CLOSE = "]]>"
 
+XML_WHITESPACE = re.compile("[ \t\r\n]+")
+
+NOT_ESCAPED_TEXT = re.compile("[<>\r]|&(?!(?:amp|gt|lt);)")
+"""Matches anything in the source that keeps it from being the escaped form
+of its text: markup, unescaped `>`, other references, or carriage returns,
+which the parser turns into line feeds."""
+
+# The bits of `Element.source_forms`.
+SOURCE_SPACED = 1
+"""The source is the inline layout when self-closing tags end with ` />`."""
+SOURCE_UNSPACED = 2
+"""The source is the inline layout when self-closing tags end with `/>`."""
+
 
 class Child(ABC):
 
   @abstractmethod
-  def render_inline(self: Self, ctx: Context) -> str:
-    """Render the child in inline mode."""
+  def doc_inline(self: Self, ctx: Context) -> Doc:
+    """Lay out the child in inline mode."""
     pass
 
   @abstractmethod
-  def render_block(self: Self, ctx: Context) -> str:
-    """Render the child in block mode."""
+  def doc_block(self: Self, ctx: Context) -> Doc:
+    """Lay out the child in block mode. The indentation of the first line
+    is provided by the parent."""
 
   @abstractmethod
-  def render_verbatim(self: Self, ctx: Context) -> str:
-    """Render the child in verbatim mode."""
+  def verbatim_text(self: Self, ctx: Context) -> str:
+    """The text of the child in verbatim mode."""
 
   @abstractmethod
   def is_inlineable(self: Self, ctx: Context) -> bool:
@@ -48,13 +65,13 @@ class Text(Child):
   def __str__(self: Self):
     return "<Text: " + repr(self.txt) + ">"
 
-  def render_inline(self: Self, ctx: Context) -> str:
+  def doc_inline(self: Self, ctx: Context) -> Doc:
     return xmlescape(self.txt)
 
-  def render_block(self: Self, ctx: Context) -> str:
-    return f"{ctx.indent}{xmlescape(self.txt).lstrip()}"
+  def doc_block(self: Self, ctx: Context) -> Doc:
+    return xmlescape(self.txt).lstrip()
 
-  def render_verbatim(self: Self, ctx: Context) -> str:
+  def verbatim_text(self: Self, ctx: Context) -> str:
     return xmlescape(self.txt)
 
   def is_inlineable(self: Self, ctx: Context) -> bool:
@@ -75,13 +92,13 @@ class Comment(Child):
   def __str__(self: Self) -> str:
     return f"<!--{self.txt}-->"
 
-  def render_inline(self: Self, ctx: Context) -> str:
+  def doc_inline(self: Self, ctx: Context) -> Doc:
     return f"<!--{self.txt}-->"
 
-  def render_block(self: Self, ctx: Context) -> str:
-    return f"{ctx.indent}<!--{self.txt}-->"
+  def doc_block(self: Self, ctx: Context) -> Doc:
+    return f"<!--{self.txt}-->"
 
-  def render_verbatim(self: Self, ctx: Context) -> str:
+  def verbatim_text(self: Self, ctx: Context) -> str:
     return f"<!--{self.txt}-->"
 
   def is_inlineable(self: Self, ctx: Context) -> bool:
@@ -99,13 +116,13 @@ class Processing(Child):
   def __str__(self: Self) -> str:
     return f"<?{self.txt}?>"
 
-  def render_inline(self: Self, ctx: Context) -> str:
+  def doc_inline(self: Self, ctx: Context) -> Doc:
     return f"<?{self.txt}?>"
 
-  def render_block(self: Self, ctx: Context) -> str:
-    return f"{ctx.indent}<?{self.txt}?>"
+  def doc_block(self: Self, ctx: Context) -> Doc:
+    return f"<?{self.txt}?>"
 
-  def render_verbatim(self: Self, ctx: Context) -> str:
+  def verbatim_text(self: Self, ctx: Context) -> str:
     return f"<?{self.txt}?>"
 
   def is_inlineable(self: Self, ctx: Context) -> bool:
@@ -118,14 +135,14 @@ class EmptyLine(Child):
   def __str__(self: Self) -> str:
     return f"<emptyline>"
 
-  def render_inline(self: Self, ctx: Context) -> str:
+  def doc_inline(self: Self, ctx: Context) -> Doc:
     # TODO: Is this right behavior?
     return "\n"
 
-  def render_block(self: Self, ctx: Context) -> str:
+  def doc_block(self: Self, ctx: Context) -> Doc:
     return "\n"
 
-  def render_verbatim(self: Self, ctx: Context) -> str:
+  def verbatim_text(self: Self, ctx: Context) -> str:
     return "\n"
 
   def is_inlineable(self: Self, ctx: Context) -> bool:
@@ -139,20 +156,54 @@ class Element(Child):
      An element with tag None is meant to be the root of the tree."""
 
   tag: str | None
+  tag_id: int
+  """The interned id of the tag, see `ptx_formatter.utils.tags`."""
   attrs: Attrs
   children: list[Child]
+  _normalized: list[Child] | None
+  """The children with inline comments recognized and blank text removed.
+  Computed the first time the element is laid out in block mode."""
+  _tag_mask: int | None
+  """The cached result of `tag_mask`."""
+  _source_forms: int | None
+  """The cached result of `source_forms`."""
+  start: int | None
+  """Where the element starts in the source text, at the `<` of its start
+  tag. None for elements that were not parsed from a source."""
+  inner_start: int | None
+  """Where the contents of the element start, just after its start tag."""
+  inner_end: int | None
+  """Where the contents of the element end, at the start of its end tag.
+  Equal to `end` for an empty-element tag like `<br/>`."""
+  end: int | None
+  """Where the element ends in the source text, just after its end tag."""
 
   def __init__(self: Self,
                tag: str = None,
                attrs: Attrs = {},
                children: list[Child] = []):
     self.tag = tag
+    self.tag_id = tag_id(tag)
     self.attrs = attrs
     self.children = children or []
+    self._normalized = None
+    self._tag_mask = None
+    self._source_forms = None
+    self.start = self.inner_start = self.inner_end = self.end = None
 
   def __str__(self: Self):
     return f"<{self.tag} ...>"
 
+  def __getstate__(self: Self) -> dict:
+    # Tag ids differ between processes
+    state = dict(self.__dict__)
+    state["tag_id"] = state["_tag_mask"] = state["_normalized"] = None
+    return state
+
+  def __setstate__(self: Self, state: dict):
+    self.__dict__.update(state)
+    self.tag_id = tag_id(self.tag)
+
   def addChild(self: Self, child: Child) -> Self:
     if isinstance(child, Text) and len(self.children) > 0 and isinstance(
         self.children[-1], Text):
@@ -162,111 +213,282 @@ class Element(Child):
       self.children.append(child)
     return self
 
-  def render_inline(self: Self, ctx: Context) -> str:
+  def doc_inline(self: Self, ctx: Context) -> Doc:
+    return _lay_out(_request(self, Mode.Inline, ctx))
+
+  def doc_block(self: Self, ctx: Context) -> Doc:
+    return _lay_out(_request(self, Mode.Block, ctx))
+
+  def doc_fragment(self: Self, ctx: Context) -> Doc:
+    """The layout document of the children alone, laid out as in block mode
+    but without the tags of the element, and indented at the level of
+    `ctx`. See `ptx_formatter.formatter.formatFragment`."""
+    return _lay_out(self._doc_fragment(ctx))
+
+  def verbatim_text(self: Self, ctx: Context) -> str:
+    return _lay_out(_request(self, Mode.Verbatim, ctx))
+
+  def tag_mask(self: Self) -> int:
+    """The tags used in the subtree of the element, as a mask with the bit
+    of each tag id set."""
+    if self._tag_mask is None:
+      # The elements of the subtree whose mask is missing, parents first
+      todo = [self]
+      for element in todo:
+        todo.extend(ch for ch in element.children
+                    if isinstance(ch, Element) and ch._tag_mask is None)
+      for element in reversed(todo):
+        mask = 1 << element.tag_id
+        for ch in element.children:
+          if isinstance(ch, Element):
+            mask |= ch._tag_mask
+        element._tag_mask = mask
+    return self._tag_mask
+
+  def source_forms(self: Self, source: str) -> int:
+    """Whether the source text of the element, which must be `source`, is
+    already what laying it out inline gives, as the bits `SOURCE_SPACED` and
+    `SOURCE_UNSPACED` for each setting of the space in self-closing tags.
+    Inline layouts do not depend on the other settings. The source is then
+    copied instead of being laid out. Computed for the whole subtree the
+    first time, and kept."""
+    if self._source_forms is None:
+      # The elements of the subtree whose forms are missing, parents first
+      todo = [self]
+      for element in todo:
+        todo.extend(ch for ch in element.children
+                    if isinstance(ch, Element) and ch._source_forms is None)
+      for element in reversed(todo):
+        element._source_forms = element._compute_source_forms(source)
+    return self._source_forms
+
+  def _compute_source_forms(self: Self, source: str) -> int:
+    """The forms of the element, once those of its children are known."""
+    if self.start is None or self.tag is None:
+      return 0
+    tag_start = f"<{self.tag}{''.join(process_attrs(self.attrs))}"
     if self.children == []:
-      return self._self_closing_tag(True, ctx)
-    childStrings = [ch.render_inline(ctx) for ch in self.children]
-    return f"{self._open_tag(True, ctx)}{''.join(childStrings).strip()}{self._close_tag()}"
-
-  def render_block(self: Self, ctx: Context) -> str:
-    self._recognize_inline_comments()
-    self._remove_empty_lines()
-    self._insert_needed_emptylines(ctx)
+      if source.startswith(" />", self.start + len(tag_start), self.end):
+        form = SOURCE_SPACED
+      elif source.startswith("/>", self.start + len(tag_start), self.end):
+        form = SOURCE_UNSPACED
+      else:
+        return 0
+      return form if source.startswith(tag_start, self.start) else 0
+    if (self.inner_start - self.start != len(tag_start) + 1 or
+        not source.startswith(tag_start, self.start) or
+        source[self.inner_start - 1] != ">" or
+        source[self.inner_end:self.end] != f"</{self.tag}>"):
+      return 0
+    # The text must be in its escaped form, and the elements in theirs
+    forms = SOURCE_SPACED | SOURCE_UNSPACED
+    pos = self.inner_start
+    for ch in self.children:
+      if isinstance(ch, Element):
+        forms &= ch._source_forms
+        if forms == 0 or NOT_ESCAPED_TEXT.search(source, pos, ch.start):
+          return 0
+        pos = ch.end
+      elif not isinstance(ch, Text):
+        return 0
+    if NOT_ESCAPED_TEXT.search(source, pos, self.inner_end):
+      return 0
+    # Inline layouts strip the contents
+    first, last = self.children[0], self.children[-1]
+    if ((isinstance(first, Text) and first.txt != first.txt.lstrip()) or
+        (isinstance(last, Text) and last.txt != last.txt.rstrip())):
+      return 0
+    return forms
+
+  def _source_inline(self: Self, ctx: Context) -> str | None:
+    """The source text of the element, if it is its inline layout."""
+    if ctx.source is None or self.start is None:
+      return None
+    form = SOURCE_SPACED if ctx.use_self_closing_space() else SOURCE_UNSPACED
+    if self.source_forms(ctx.source) & form == 0:
+      return None
+    return ctx.source[self.start:self.end]
+
+  # The layout of an element is built by generators, which yield a request
+  # `(element, mode, ctx)` for the layout of each child element and receive
+  # it in return. `_lay_out` runs them with an explicit stack, so that
+  # documents of any depth are laid out without recursion.
+
+  def _layout_steps(self: Self, mode: Mode, ctx: Context) -> "LayoutSteps":
+    if mode is Mode.Block:
+      return self._doc_block(ctx)
+    if mode is Mode.Inline:
+      return self._doc_inline_or_source(ctx)
+    return self._verbatim_text(ctx)
+
+  def _cached_layout(self: Self, mode: Mode, ctx: Context) -> Doc | None:
+    """The layout shared with another configuration, if there is one."""
+    if ctx.shared is None or mode is Mode.Verbatim:
+      return None
+    return ctx.shared.get(self, mode is Mode.Block, ctx.indent.level)
+
+  def _finish_layout(self: Self, doc: Doc, mode: Mode, ctx: Context) -> Doc:
+    if mode is Mode.Verbatim:
+      return doc
+    if ctx.shared is not None:
+      ctx.shared.put(self, mode is Mode.Block, ctx.indent.level, doc)
+      return doc
+    return Mark(self, doc) if ctx.record_spans else doc
+
+  def _doc_fragment(self: Self, ctx: Context) -> "LayoutSteps":
+    parts = yield from self._block_children_parts(self._block_children(ctx),
+                                                  ctx)
+    return Nest(str(ctx.indent), [INDENTATION, strip_parts(parts)])
+
+  def _doc_block(self: Self, ctx: Context) -> "LayoutSteps":
+    children = self._block_children(ctx)
     if self.tag is None:
-      return self._render_root(ctx)
-    if self._is_verbatim_tag(ctx) and self.children != []:
-      return self.render_verbatim(ctx)
-    if self._will_inline(ctx):
-      return f"{ctx.indent}{self.render_inline(ctx)}"
+      return (yield from self._doc_root(children, ctx))
+    if self._is_verbatim_tag(ctx) and children != []:
+      return (yield from self._doc_verbatim(children, ctx))
+    if self._will_inline(children, ctx):
+      fill = ctx.max_line_width() is not None
+      if not fill and _same_children(children, self.children):
+        return (yield from self._doc_inline_or_source(ctx))
+      return (yield from self._doc_inline(children, ctx, fill))
     # Otherwise we render block
-    if self.children == []:
+    if children == []:
       # Special case of empty block, render open+close tags
-      return f"{ctx.indent}{self._open_tag(False, ctx)}{self._close_tag()}"
-    childCtx = ctx.get_child_context(self.tag)
-    childString = self._block_render_children(childCtx)
-    openTag = f"{ctx.indent}{self._open_tag(False, ctx)}"
-    closeTag = f"{ctx.indent}{self._close_tag()}"
-    return f"{openTag}{childString.rstrip()}\n{closeTag}"
+      return [*self._open_tag(False, ctx), self._close_tag()]
+    childCtx = ctx.get_child_context(self.tag_id)
+    parts = rstrip_parts((yield from
+                          self._block_children_parts(children, childCtx)))
+    if childCtx.indent is not ctx.indent:
+      parts = Nest(ctx.config._base_indent, parts)
+    return [*self._open_tag(False, ctx), parts, LINE, self._close_tag()]
 
   def is_inlineable(self: Self, ctx: Context):
-    return ctx.must_inline(self.tag, self._is_empty())
-
-  def _insert_needed_emptylines(self: Self, ctx: Context):
+    return ctx.must_inline(self.tag_id, self._is_empty())
+
+  def _doc_inline_or_source(self: Self, ctx: Context) -> "LayoutSteps":
+    """Lay out the element on one line, or copy its source if it is
+    already laid out that way."""
+    source = self._source_inline(ctx)
+    if source is not None:
+      return source
+    return (yield from self._doc_inline(self.children, ctx))
+
+  def _doc_inline(self: Self,
+                  children: list[Child],
+                  ctx: Context,
+                  fill: bool = False) -> "LayoutSteps":
+    """Lay out the element and its children on one line. If `fill` is
+    set, the whitespace in the text of the element can be used to break
+    the line when it gets too long."""
+    if children == []:
+      return self._self_closing_tag(True, ctx)
+    parts = []
+    inner = ctx.inside(self.tag_id)
+    for ch in children:
+      if fill and isinstance(ch, Text):
+        parts.extend(fill_words(xmlescape(ch.txt)))
+      else:
+        parts.append((yield from _child_doc(ch, Mode.Inline, inner)))
+    strip_parts(parts)
+    if fill:
+      parts = Nest(ctx.config._base_indent, parts)
+    return [*self._open_tag(True, ctx), parts, self._close_tag()]
+
+  def _block_children(self: Self, ctx: Context) -> list[Child]:
+    """The children as they are laid out in block mode."""
+    if self._normalized is None:
+      self._normalized = self._normalize_children(self.children)
+    return self._insert_needed_emptylines(self._normalized, ctx)
+
+  def _insert_needed_emptylines(self: Self, children: list[Child],
+                                ctx: Context) -> list[Child]:
+    if not ctx.has_emptylines():
+      return children
     new_children = []
-    for idx, el in enumerate(self.children):
+    last = len(children) - 1
+    for idx, el in enumerate(children):
       if isinstance(el, Element):
-        tag = el.tag
-        if ctx.must_emptyline_before(tag) and not_at_start(new_children):
+        if ctx.must_emptyline_before(el.tag_id) and not_at_start(new_children):
           new_children.append(EmptyLine())
         new_children.append(el)
-        if ctx.must_emptyline_after(tag) and not_at_end(self.children, idx):
+        if ctx.must_emptyline_after(el.tag_id) and idx < last:
           new_children.append(EmptyLine())
       else:
         new_children.append(el)
-    self.children = new_children
+    return new_children
 
-  def _block_render_children(self, ctx):
-    childString = ""
+  def _block_children_parts(self: Self, children: list[Child],
+                            ctx: Context) -> "LayoutSteps":
+    parts = []
     lastIsInline = False
     lastLineEmpty = False
-    for ch in self.children:
+    for ch in children:
       isInlineable = ch.is_inlineable(ctx)
       if isInlineable and lastIsInline:
         # combine in existing line
-        childString += ch.render_inline(ctx)
+        parts.append((yield from _child_doc(ch, Mode.Inline, ctx)))
         lastIsInline = True
         lastLineEmpty = False
-      else:
+      elif isinstance(ch, EmptyLine):
+        parts.append("\n")
+        lastLineEmpty = True
+      elif not is_blank_string(ch):
         # start new line
-        block = ch.render_block(ctx)
-        if isinstance(ch, EmptyLine):
-          childString += "\n"
-          lastLineEmpty = True
-        elif block.lstrip() != "":
-          if not lastLineEmpty:
-            childString = childString.rstrip()
-          childString = childString + "\n" + block
-          lastIsInline = isInlineable
-          lastLineEmpty = False
-    return childString
-
-  def _recognize_inline_comments(self: Self):
-    for idx, el in enumerate(self.children):
-      if isinstance(el, Element):
-        nextEl = self._child_at_index(idx + 1)
-        nextNextEl = self._child_at_index(idx + 2)
+        if not lastLineEmpty:
+          rstrip_parts(parts)
+        parts.append(LINE)
+        if ctx.deferred and isinstance(ch, (Element, ElementWithInlineComment)):
+          parts.append(Defer(ch.doc_block, ctx))
+        else:
+          parts.append((yield from _child_doc(ch, Mode.Block, ctx)))
+        lastIsInline = isInlineable
+        lastLineEmpty = False
+    return parts
+
+  def _normalize_children(self: Self, children: list[Child]) -> list[Child]:
+    """The children with blank text removed, and each element followed by a
+    comment, possibly after some spaces, combined with it into an
+    `ElementWithInlineComment`. Done in a single pass over the children."""
+    result = []
+    count = len(children)
+    idx = 0
+    while idx < count:
+      el = children[idx]
+      idx += 1
+      if isinstance(el, Element) and idx < count:
+        nextEl = children[idx]
         if isinstance(nextEl, Comment):
-          del self.children[idx]
-          del self.children[idx]
-          self.children.insert(idx, ElementWithInlineComment(el, "", nextEl))
-        elif is_only_spaces(nextEl) and isinstance(nextNextEl, Comment):
-          del self.children[idx]
-          del self.children[idx]
-          del self.children[idx]
-          self.children.insert(
-              idx, ElementWithInlineComment(el, nextEl.txt, nextNextEl))
-
-  def _child_at_index(self: Self, idx: int) -> Child | None:
-    if idx < len(self.children):
-      return self.children[idx]
-    else:
-      return None
-
-  def _remove_empty_lines(self: Self):
-    self.children = [el for el in self.children if not is_blank_string(el)]
-
-  def _open_tag(self: Self, inline: bool, ctx: Context) -> str:
-    return f"{self._tag_start(inline, ctx)}>"
-
-  def _self_closing_tag(self: Self, inline: bool, ctx: Context) -> str:
+          result.append(ElementWithInlineComment(el, "", nextEl))
+          idx += 1
+          continue
+        if (idx + 1 < count and isinstance(children[idx + 1], Comment) and
+            is_only_spaces(nextEl)):
+          result.append(
+              ElementWithInlineComment(el, nextEl.txt, children[idx + 1]))
+          idx += 2
+          continue
+      if not is_blank_string(el):
+        result.append(el)
+    return result
+
+  def _open_tag(self: Self,
+                inline: bool,
+                ctx: Context,
+                indentation: Doc = INDENTATION) -> list[Doc]:
+    return [*self._tag_start(inline, ctx, indentation), ">"]
+
+  def _self_closing_tag(self: Self, inline: bool, ctx: Context) -> list[Doc]:
     space = " " if ctx.use_self_closing_space() else ""
-    return f"{self._tag_start(inline, ctx)}{space}/>"
+    return [*self._tag_start(inline, ctx), f"{space}/>"]
 
-  def _tag_start(self: Self, inline: bool, ctx: Context) -> str:
+  def _tag_start(self: Self,
+                 inline: bool,
+                 ctx: Context,
+                 indentation: Doc = INDENTATION) -> list[Doc]:
     attrs = process_attrs(self.attrs)
-    attrs_string = self._combine_attrs(attrs, inline, ctx)
-
-    return f"<{self.tag}{attrs_string}"
+    return [
+        f"<{self.tag}", *self._combine_attrs(attrs, inline, ctx, indentation)
+    ]
 
   def _close_tag(self: Self):
     return f"</{self.tag}>"
@@ -275,59 +497,113 @@ class Element(Child):
     return self.children == []
 
   def _is_verbatim_tag(self: Self, ctx: Context):
-    pref = ctx.get_preference(self.tag)
-    return pref == Preference.Verbatim
+    return ctx.is_verbatim(self.tag_id)
 
-  def render_verbatim(self: Self, ctx: Context):
+  def _doc_verbatim(self: Self, children: list[Child],
+                    ctx: Context) -> "LayoutSteps":
     openTag = self._open_tag(False, ctx)
     closeTag = self._close_tag()
-    contents = "".join([c.render_verbatim(ctx) for c in self.children])
-    endIndent = str(ctx.indent) if "\n" in contents else ""
-    should_use_cdata = ctx.should_use_cdata(self.tag, contents)
-    if should_use_cdata:
-      contents_unescaped = xmlunescape(contents)
-      return f"{ctx.indent}{openTag}{CDATA_OPEN}{contents_unescaped.rstrip(" ")}{endIndent}{CDATA_CLOSE}{closeTag}"
-    return f"{ctx.indent}{openTag}{contents.rstrip(" ")}{endIndent}{closeTag}"
-
-  def _render_root(self: Self, ctx: Context):
-    content = "\n".join([ch.render_block(ctx) for ch in self.children])
-    if ctx.should_add_doc_id():
-      return """<?xml version="1.0" encoding="UTF-8" ?>\n\n""" + content
-    else:
-      return content
+    use_cdata, contents = yield from self._verbatim_contents(children, ctx)
+    endIndent = INDENTATION if "\n" in contents else ""
+    if use_cdata:
+      return [
+          *openTag, CDATA_OPEN,
+          contents.rstrip(" "), endIndent, CDATA_CLOSE, closeTag
+      ]
+    return [*openTag, contents.rstrip(" "), endIndent, closeTag]
+
+  def _verbatim_text(self: Self, ctx: Context) -> "LayoutSteps":
+    indent = str(ctx.indent)
+    openTag = "".join(self._open_tag(False, ctx, indent))
+    closeTag = self._close_tag()
+    use_cdata, contents = yield from self._verbatim_contents(self.children, ctx)
+    endIndent = indent if "\n" in contents else ""
+    if use_cdata:
+      return f"{indent}{openTag}{CDATA_OPEN}{contents.rstrip(" ")}{endIndent}{CDATA_CLOSE}{closeTag}"
+    return f"{indent}{openTag}{contents.rstrip(" ")}{endIndent}{closeTag}"
+
+  def _verbatim_contents(self: Self, children: list[Child],
+                         ctx: Context) -> "LayoutSteps":
+    """Whether the verbatim contents go in a CDATA section, and the contents
+    themselves, unescaped if they do. When the source already has them in
+    that form, they are copied from it instead of being rebuilt."""
+    source_form = self._source_contents(ctx)
+    if source_form is not None:
+      in_cdata, contents = source_form
+      if ctx.should_use_cdata(self.tag_id, contents, not in_cdata) == in_cdata:
+        return in_cdata, contents
+    texts = []
+    inner = ctx.inside(self.tag_id)
+    for c in children:
+      texts.append((yield from _child_doc(c, Mode.Verbatim, inner)))
+    contents = "".join(texts)
+    if ctx.should_use_cdata(self.tag_id, contents):
+      return True, xmlunescape(contents)
+    return False, contents
+
+  def _source_contents(self: Self, ctx: Context) -> tuple[bool, str] | None:
+    """The contents of the element as they are in the source, if they are
+    only text and are written the way the formatter would write them: either
+    escaped, or in a single CDATA section. Whether they are in a CDATA
+    section is returned with the contents, which exclude the section
+    delimiters. None otherwise."""
+    source = ctx.source
+    start, end = self.inner_start, self.inner_end
+    if source is None or start is None:
+      return None
+    if source.startswith(CDATA_OPEN, start, end):
+      if (source.find(CDATA_CLOSE, start, end) != end - len(CDATA_CLOSE) or
+          source.find("\r", start, end) >= 0):
+        return None
+      return True, source[start + len(CDATA_OPEN):end - len(CDATA_CLOSE)]
+    if NOT_ESCAPED_TEXT.search(source, start, end):
+      return None
+    return False, source[start:end]
 
-  def _will_inline(self: Self, ctx: Context):
+  def _doc_root(self: Self, children: list[Child],
+                ctx: Context) -> "LayoutSteps":
+    parts = [INDENTATION]
+    if ctx.should_add_doc_id():
+      parts.insert(0, """<?xml version="1.0" encoding="UTF-8" ?>\n\n""")
+    for idx, ch in enumerate(children):
+      if idx > 0:
+        parts.append(LINE)
+      parts.append((yield from _child_doc(ch, Mode.Block, ctx)))
+    return parts
+
+  def _will_inline(self: Self, children: list[Child], ctx: Context):
     """Will inline if:
        - tag prefers inlined, or
        - tag does not force block and all the element's
          children prefer to be inlined"""
-    if self.is_inlineable(ctx):
+    if ctx.must_inline(self.tag_id, children == []):
       return True
     if self._must_block(ctx):
       return False
-    for ch in self.children:
-      if not ch.is_inlineable(ctx):
+    inner = ctx.inside(self.tag_id)
+    for ch in children:
+      if not ch.is_inlineable(inner):
         return False
     return True
 
   def _must_block(self: Self, ctx: Context):
-    return ctx.must_block(self.tag)
+    return ctx.must_block(self.tag_id)
 
-  def _combine_attrs(self: Self, items: list[str], inline: bool,
-                     ctx: Context) -> str:
+  def _combine_attrs(self: Self, items: list[str], inline: bool, ctx: Context,
+                     indentation: Doc) -> list[Doc]:
     if len(items) == 0:
-      return ""
+      return []
     multiline_attrs, multi_attr_indent = ctx.get_multiline_attrs()
     if inline or multiline_attrs == "never" or multiline_attrs > len(items):
-      return ''.join(items)
+      return [''.join(items)]
+    elif multi_attr_indent > 0:
+      extra = "\n" + (multi_attr_indent - 1) * " "
+      return [part for item in items for part in (extra, indentation, item)]
     else:
-      strings = [f"{ctx.indent}{item}" for item in items]
-      if multi_attr_indent > 0:
-        extra = "\n" + (multi_attr_indent - 1) * " "
-        return "".join([extra + s for s in strings])
-      else:
-        extra = "\n" + (1 + len(self.tag)) * " "
-        return strings[0] + "".join([extra + s for s in strings[1:]])
+      extra = "\n" + (1 + len(self.tag)) * " "
+      return [indentation, items[0]] + [
+          part for item in items[1:] for part in (extra, indentation, item)
+      ]
 
 
 class ElementWithInlineComment(Child):
@@ -342,21 +618,87 @@ class ElementWithInlineComment(Child):
     self.spacing = spacing
     self.comment = comment
 
-  def render_inline(self: Self, ctx: Context) -> str:
-    return (self.el.render_inline(ctx) + self.spacing +
-            self.comment.render_inline(ctx))
+  def doc_inline(self: Self, ctx: Context) -> Doc:
+    return self.with_comment(self.el.doc_inline(ctx), ctx)
 
-  def render_block(self: Self, ctx: Context) -> str:
-    return (self.el.render_block(ctx) + self.spacing +
-            self.comment.render_inline(ctx))
+  def doc_block(self: Self, ctx: Context) -> Doc:
+    return self.with_comment(self.el.doc_block(ctx), ctx)
 
-  def render_verbatim(self: Self, ctx: Context) -> str:
+  def with_comment(self: Self, doc: Doc, ctx: Context) -> Doc:
+    """The layout of the element, followed by the spacing and comment."""
+    return [doc, self.spacing, self.comment.doc_inline(ctx)]
+
+  def verbatim_text(self: Self, ctx: Context) -> str:
     raise NotImplementedError
 
   def is_inlineable(self: Self, ctx: Context) -> bool:
     return self.el.is_inlineable(ctx)
 
 
+LayoutSteps: TypeAlias = Generator[tuple[Element, Mode, Context], Doc, Doc]
+"""A generator building the layout of an element. See `_lay_out`."""
+
+
+def _lay_out(steps: LayoutSteps) -> Doc:
+  """Run a layout generator to its end, and return its result. The layouts
+  of the elements it asks for are built by their own generators, kept on an
+  explicit stack, so that the depth of the tree does not matter."""
+  # The generators running, with the element, mode and context of each
+  stack = [(None, None, None, steps)]
+  value = None
+  while True:
+    element, mode, ctx, steps = stack[-1]
+    try:
+      child, child_mode, child_ctx = steps.send(value)
+    except StopIteration as stop:
+      stack.pop()
+      value = stop.value
+      if element is not None:
+        value = element._finish_layout(value, mode, ctx)
+      if not stack:
+        return value
+      continue
+    value = child._cached_layout(child_mode, child_ctx)
+    if value is None:
+      stack.append((child, child_mode, child_ctx,
+                    child._layout_steps(child_mode, child_ctx)))
+
+
+def _request(element: Element, mode: Mode, ctx: Context) -> LayoutSteps:
+  """The steps that only ask for the layout of `element`."""
+  return (yield (element, mode, ctx))
+
+
+def _child_doc(ch: Child, mode: Mode, ctx: Context) -> LayoutSteps:
+  """The layout of a child in the given mode, asked for from `_lay_out`
+  if it holds an element, and built directly otherwise."""
+  if isinstance(ch, Element):
+    return (yield (ch, mode, ctx))
+  if isinstance(ch, ElementWithInlineComment) and mode is not Mode.Verbatim:
+    return ch.with_comment((yield (ch.el, mode, ctx)), ctx)
+  if mode is Mode.Block:
+    return ch.doc_block(ctx)
+  if mode is Mode.Inline:
+    return ch.doc_inline(ctx)
+  return ch.verbatim_text(ctx)
+
+
+def _same_children(a: list[Child], b: list[Child]) -> bool:
+  return len(a) == len(b) and all(x is y for x, y in zip(a, b))
+
+
+def fill_words(text: str) -> list[Doc]:
+  """Split text at its whitespace into words separated by possible
+  line breaks."""
+  words = XML_WHITESPACE.split(text)
+  parts = [words[0]] if words[0] else []
+  for word in words[1:]:
+    parts.append(SOFT_BREAK)
+    if word:
+      parts.append(word)
+  return parts
+
+
 def process_attrs(attrs: Attrs) -> Attrs:
   sorted_items = sorted(attrs.items(), key=cmp_to_key(compare_attrs))
 
@@ -387,10 +729,6 @@ def not_at_start(children: list[Child]) -> bool:
   return children != [] and not isinstance(children[-1], EmptyLine)
 
 
-def not_at_end(children: list[Child], idx: int) -> bool:
-  return idx < len(children) - 1
-
-
 def is_blank_string(el: Child) -> bool:
   return isinstance(el, Text) and el.txt.strip() == ""
 
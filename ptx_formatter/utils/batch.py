@@ -0,0 +1,255 @@
+"""
+Formatting many documents sent over a stream, such as standard input, in a
+single run, so that the cost of starting the formatter is paid only once.
+
+Each line of the input is a JSON object with the document under `text`, and
+optionally:
+- `path`, the file the document comes from. Its configuration is found as
+  for the files formatted in place.
+- `config`, a `ptx-formatter.toml` or `pyproject.toml` file whose
+  configuration is used instead.
+- `id`, any value, which is copied to the result.
+
+Each line of the output is a JSON object for one document of the input, in
+the same order: with the formatted document under `text`, or with an `error`,
+along with its `line` and `column` if it is a parse error. The `id` and
+`path` of the document are copied to it. Blank lines of the input are
+skipped.
+
+Documents are formatted by a pool of workers, each of which reads every
+configuration once and keeps it for the later documents. A result is
+written as soon as it and all the results before it are ready, so that a
+caller can send one document at a time and wait for its result.
+"""
+from concurrent.futures import (BrokenExecutor, Executor, Future,
+                                ProcessPoolExecutor, ThreadPoolExecutor)
+import json
+from pathlib import Path
+import queue
+import threading
+from typing import Callable, Iterable, Self, TextIO
+import xml.etree.ElementTree as ET
+
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils.config import Config
+from ptx_formatter.utils.discovery import ConfigFinder
+from ptx_formatter.utils.workers import process_context
+
+COPIED_KEYS = ("id", "path")
+"""The keys of a document that are copied to its result."""
+
+
+class BatchFormatter:
+  """Formats the documents of a batch, keeping the configurations it reads."""
+  _config: Config | None
+  """The configuration of the documents that do not name one, or None to
+  find it from their path."""
+  _finder: ConfigFinder
+
+  def __init__(self: Self,
+               config: Config = None,
+               adjust: Callable[[Config], None] = None):
+    """`adjust` is applied to the configurations read from files, as in
+    `ptx_formatter.utils.discovery.ConfigFinder`."""
+    self._config = config
+    self._finder = ConfigFinder(adjust)
+
+  def config_for(self: Self, record: dict) -> Config:
+    if record.get("config") is not None:
+      return self._finder.config_from(record["config"])
+    if self._config is not None:
+      return self._config
+    return self._finder.config_for(record.get("path") or Path.cwd())
+
+  def format(self: Self, record: dict) -> dict:
+    """The result for a document of the batch. Errors are recorded in the
+    result rather than raised."""
+    result = {k: record[k] for k in COPIED_KEYS if k in record}
+    try:
+      text = record.get("text")
+      if not isinstance(text, str):
+        raise ValueError("The document has no text")
+      result["text"] = formatPretext(text, self.config_for(record))
+    except Exception as e:
+      result.update(_error(e))
+    return result
+
+
+def run_batch(lines: Iterable[str],
+              out: TextIO,
+              jobs: int = 1,
+              config: Config = None,
+              adjust: Callable[[Config], None] = None) -> int:
+  """Format the documents of the JSON `lines`, writing a JSON line to `out`
+  for each of them. With more than one job, the documents are formatted in
+  that many worker processes. Returns the number of documents that
+  failed.
+
+  A worker process that dies fails every document waiting in its pool.
+  These are formatted again in a new pool, and a document that fails this
+  way twice is formatted in a worker of its own, so that only a document
+  that kills its worker by itself is reported as failed."""
+  workers = _Workers(jobs, config, adjust)
+  # The results in the order of the input, with a bound on how many are
+  # waiting, so that a large input is not read all at once
+  results = queue.Queue(maxsize=4 * jobs)
+  writer = _ResultWriter(results, out, workers)
+  writer.start()
+  try:
+    for line in lines:
+      if line.strip() != "":
+        record = _record(line)
+        results.put((record, _submit(workers, record)))
+  finally:
+    results.put(None)
+    writer.join()
+    workers.shutdown()
+  if writer.error is not None:
+    raise writer.error
+  return writer.failed
+
+
+class _Workers:
+  """The pool of workers of a batch, started again when one of them dies."""
+  _processes: int | None
+  """The number of worker processes, or None for a single thread."""
+  _config: Config | None
+  _adjust: Callable[[Config], None] | None
+  _executor: Executor
+  _lock: threading.Lock
+  """Held while the pool is started again."""
+
+  def __init__(self: Self, jobs: int, config: Config | None,
+               adjust: Callable[[Config], None]):
+    self._processes = jobs if jobs > 1 else None
+    self._config = config
+    self._adjust = adjust
+    self._executor = self._start(self._processes)
+    self._lock = threading.Lock()
+
+  def submit(self: Self, record: dict) -> Future:
+    with self._lock:
+      try:
+        return self._executor.submit(_format_in_worker, record)
+      except BrokenExecutor:
+        self._executor.shutdown(wait=False)
+        self._executor = self._start(self._processes)
+        return self._executor.submit(_format_in_worker, record)
+
+  def submit_alone(self: Self, record: dict) -> Future:
+    """Format a document in a worker of its own, which nothing else can
+    kill."""
+    executor = self._start(1 if self._processes else None)
+    future = executor.submit(_format_in_worker, record)
+    executor.shutdown(wait=False)
+    return future
+
+  def shutdown(self: Self):
+    self._executor.shutdown()
+
+  def _start(self: Self, processes: int | None) -> Executor:
+    if processes is not None:
+      return ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=process_context(),
+                                 initializer=_init_worker,
+                                 initargs=(self._config, self._adjust))
+    return ThreadPoolExecutor(max_workers=1,
+                              initializer=_init_worker,
+                              initargs=(self._config, self._adjust))
+
+
+class _ResultWriter(threading.Thread):
+  """Writes the results in order as they are ready, formatting again the
+  documents whose pool broke."""
+  _results: queue.Queue
+  """The documents of the input with the futures of their results, in
+  order, then None."""
+  _out: TextIO
+  _workers: _Workers
+  failed: int
+  """The number of documents that failed."""
+  error: Exception | None
+  """The error raised while writing, if any. The remaining results are then
+  dropped."""
+
+  def __init__(self: Self, results: queue.Queue, out: TextIO,
+               workers: _Workers):
+    super().__init__(daemon=True)
+    self._results = results
+    self._out = out
+    self._workers = workers
+    self.failed = 0
+    self.error = None
+
+  def run(self: Self):
+    while True:
+      item = self._results.get()
+      if item is None:
+        return
+      result = self._result(*item)
+      if "error" in result:
+        self.failed += 1
+      if self.error is None:
+        try:
+          self._out.write(json.dumps(result) + "\n")
+          self._out.flush()
+        except Exception as e:
+          self.error = e
+
+  def _result(self: Self, record: dict, future: Future) -> dict:
+    retries = [self._workers.submit, self._workers.submit_alone]
+    while True:
+      try:
+        return future.result()
+      except BrokenExecutor as e:
+        # A worker died, which fails all the documents of its pool
+        if retries != []:
+          future = retries.pop(0)(record)
+          continue
+        error = e
+      except Exception as e:
+        # The worker process could not run the job
+        error = e
+      result = {k: record[k] for k in COPIED_KEYS if k in record}
+      result.update(_error(error))
+      return result
+
+
+def _record(line: str) -> dict | Exception:
+  """The document of a line of the input, or the reason it has none."""
+  try:
+    record = json.loads(line)
+  except ValueError as e:
+    return e
+  if not isinstance(record, dict):
+    return ValueError("The document is not a JSON object")
+  return record
+
+
+def _submit(workers: _Workers, record: dict | Exception) -> Future:
+  if isinstance(record, Exception):
+    future = Future()
+    future.set_result(_error(record))
+    return future
+  return workers.submit(record)
+
+
+def _error(e: Exception) -> dict:
+  """The fields of the result for a document that failed."""
+  error = {"error": "out of memory" if isinstance(e, MemoryError) else str(e)}
+  if isinstance(e, ET.ParseError):
+    error["line"], error["column"] = e.position
+  return error
+
+
+_worker_formatter: BatchFormatter | None = None
+"""The formatter of the current worker of `run_batch`."""
+
+
+def _init_worker(config: Config | None, adjust: Callable[[Config], None]):
+  global _worker_formatter
+  _worker_formatter = BatchFormatter(config, adjust)
+
+
+def _format_in_worker(record: dict) -> dict:
+  return _worker_formatter.format(record)
@@ -1,21 +1,57 @@
 """Represents various settings for the formatter."""
 from enum import Enum
+import fnmatch
 
 from os.path import dirname, join
-from typing import Dict, Literal, Mapping, Self, TextIO
+import re
+from typing import Dict, Iterable, Literal, Mapping, Self, TextIO
 import tomlkit
 
+from ptx_formatter.utils.rules import (PathRules, compile_path_rules,
+                                       is_path_rule)
+from ptx_formatter.utils.tags import (intern_tag, keep_tags, tag_count,
+                                      tag_name)
+
 Preference = Enum(
     'Preference',
     ['No', 'Verbatim', 'Inline', 'InlineEmpty', 'Block', 'BlockNoIndent'])
 
+# The bits of the flags returned by `Config.tag_flags`.
+VERBATIM = 1
+INLINE = 2
+INLINE_EMPTY = 4
+BLOCK = 8
+NO_INDENT = 16
+EMPTYLINE_BEFORE = 32
+EMPTYLINE_AFTER = 64
+CDATA = 128
+"""The tag is in the list of tags that use cdata."""
+
+PREFERENCE_FLAGS = {
+    Preference.No: 0,
+    Preference.Verbatim: VERBATIM,
+    Preference.Inline: INLINE,
+    Preference.InlineEmpty: INLINE_EMPTY,
+    Preference.Block: BLOCK,
+    Preference.BlockNoIndent: BLOCK | NO_INDENT,
+}
+PREFERENCE_MASK = VERBATIM | INLINE | INLINE_EMPTY | BLOCK | NO_INDENT
+"""The bits of the flags set by the preference of the tag."""
+
 
 class Config:
   """A configuration object for the formatter. The details in this object
   should only matter to developers. Users of the formatter should
   specify the desired behavior via configuration files."""
   _tag_prefs: Dict[str, Preference]
-  """Preferences regarding how various tags should be formatted."""
+  """Preferences regarding how various tags should be formatted, by tag name
+  or by pattern (see `get_pref`)."""
+  _tag_patterns: list[tuple[re.Pattern, Preference]]
+  """The patterns among the keys of `_tag_prefs`, compiled, the most specific
+  first."""
+  _path_rules: PathRules | None
+  """The path rules among the keys of `_tag_prefs`, such as `li > p`,
+  compiled, or None if there are none. See `ptx_formatter.utils.rules`."""
   _base_indent: str
   """The base indent to be used. Defaults to 2 spaces."""
   _add_doc_id: bool
@@ -48,25 +84,112 @@ class Config:
   If True, a space is present after the tag/attributes and before the closing />
   in a self-closing tag.
   """
+  _max_line_width: Literal["never"] | int
+  """
+  The line width at which the text of inline elements is wrapped, or `"never"`
+  to keep inline elements on a single line.
+  """
+  _flags: list[int]
+  """The flags of each tag, indexed by tag id, for the tags seen so far.
+  Emptied whenever a setting they depend on changes."""
 
   def __init__(self: Self, base_indent: str | int = 2):
     """Create a configuration object with minimal settings."""
     self._tag_prefs = {}
+    self._tag_patterns = []
+    self._path_rules = None
     self.set_indent(base_indent)
     self._add_doc_id = False
     self._cdata = "never"
     self._emptyline_after = []
     self._emptyline_before = []
     self._self_closing_space = True
+    self._max_line_width = "never"
+    self._flags = []
+
+  def __getstate__(self: Self) -> dict:
+    # Tag ids differ between processes
+    return {**self.__dict__, "_flags": [], "_path_rules": None}
+
+  def __setstate__(self: Self, state: dict):
+    self.__dict__.update(state)
+    self._path_rules = self._compile_path_rules()
+    self._intern_tags()
 
   def get_pref(self: Self, tag: str) -> Preference:
-    """Retrieve the preference setting for a tag string."""
-    return self._tag_prefs.get(tag, Preference.No)
+    """Retrieve the preference setting for a tag string.
+
+    Tags can be given by name, or by a shell-style pattern such as `svg:*`
+    or `*-preamble`, where `*` matches any characters, `?` a single one and
+    `[...]` one of a set. A tag's own name wins over patterns, and among
+    patterns the one with the most characters other than wildcards wins.
+    Lookups go through `tag_flags`, which keeps the result for each tag, so
+    patterns cost nothing once a tag has been seen.
+
+    Path rules such as `li > p` are not looked up here, but by
+    `ptx_formatter.utils.context.Context`, which knows the ancestors."""
+    pref = self._tag_prefs.get(tag)
+    if pref is not None:
+      return pref
+    if tag is not None:
+      for regex, pref in self._tag_patterns:
+        if regex.match(tag):
+          return pref
+    return Preference.No
+
+  def tag_flags(self: Self, tag_id: int) -> int:
+    """The preference, emptyline and cdata settings of the tag with the
+    given id (see `ptx_formatter.utils.tags`), packed in the bits of an int."""
+    try:
+      return self._flags[tag_id]
+    except IndexError:
+      pass
+    # Tags seen for the first time since the flags were last computed
+    flags = self._flags
+    flags = flags + [
+        self._compute_flags(tag_name(id))
+        for id in range(len(flags), tag_count())
+    ]
+    self._flags = flags
+    return flags[tag_id]
+
+  def _compute_flags(self: Self, tag: str | None) -> int:
+    flags = PREFERENCE_FLAGS[self.get_pref(tag)]
+    if tag in self._emptyline_before:
+      flags |= EMPTYLINE_BEFORE
+    if tag in self._emptyline_after:
+      flags |= EMPTYLINE_AFTER
+    if (isinstance(self._cdata, Iterable) and
+        not isinstance(self._cdata, str) and tag in self._cdata):
+      flags |= CDATA
+    return flags
 
   def add_tag_prefs(self: Self, prefs: Mapping[str, Preference]):
     """Add preference settings for tags, in the form of a dictionary."""
     for k, v in prefs.items():
       self._tag_prefs[k] = v
+    patterns = [(k, v)
+                for k, v in self._tag_prefs.items()
+                if is_tag_pattern(k) and not is_path_rule(k)]
+    # Later patterns win ties, and sorting keeps the order of equal keys
+    patterns.reverse()
+    patterns.sort(key=lambda item: -_pattern_specificity(item[0]))
+    self._tag_patterns = [
+        (re.compile(fnmatch.translate(k)), v) for k, v in patterns
+    ]
+    self._path_rules = self._compile_path_rules()
+    self._intern_tags()
+    self._flags = []
+
+  def path_rules(self: Self) -> PathRules | None:
+    """The compiled path rules, or None if there are none."""
+    return self._path_rules
+
+  def _compile_path_rules(self: Self) -> PathRules | None:
+    return compile_path_rules(
+        tuple((k, PREFERENCE_FLAGS[v])
+              for k, v in self._tag_prefs.items()
+              if is_path_rule(k)))
 
   def set_indent(self: Self, base_indent: str | int):
     """
@@ -93,6 +216,8 @@ class Config:
     - a list of tags to apply cdata to those tags. They must also be set verbatim.
     - an integer. If the content contains that many characters to be escaped, then use cdata."""
     self._cdata = cdata
+    self._intern_tags()
+    self._flags = []
 
   def set_multiline_attrs(self: Self,
                           have_multiline: Literal["never"] | int = "never",
@@ -110,13 +235,44 @@ class Config:
 
   def set_emptyline_before(self: Self, tags: list[str]):
     self._emptyline_before = tags
+    self._intern_tags()
+    self._flags = []
 
   def set_emptyline_after(self: Self, tags: list[str]):
     self._emptyline_after = tags
+    self._intern_tags()
+    self._flags = []
+
+  def _intern_tags(self: Self):
+    # The tags named or matched by the settings keep ids of their own when
+    # the ids of `ptx_formatter.utils.tags` run out
+    names = [*self._emptyline_before, *self._emptyline_after]
+    if isinstance(self._cdata, Iterable) and not isinstance(self._cdata, str):
+      names.extend(self._cdata)
+    for tag in self._tag_prefs:
+      names.extend(step.strip() for step in tag.split(">"))
+    for name in names:
+      if is_tag_pattern(name):
+        keep_tags(name)
+      else:
+        intern_tag(name)
 
   def set_self_closing_space(self: Self, b: bool):
     self._self_closing_space = b
 
+  def set_max_line_width(self: Self, width: Literal["never"] | int):
+    """
+    Set the line width at which the text of elements rendered inline is
+    wrapped onto more lines, or `"never"` (the default) to keep them on one line.
+    Only the whitespace directly inside such an element is used for breaking.
+    Raises `ValueError` for anything other than a positive int or `"never"`.
+    """
+    if width != "never" and (not isinstance(width, int) or
+                             isinstance(width, bool) or width < 1):
+      raise ValueError(f"Invalid max-line-width {width!r}: expected a "
+                       'positive integer or "never"')
+    self._max_line_width = width
+
   def print(self: Self) -> str:
     """
     Forms a [TOML](https://toml.io/en/) file description of the configuration.
@@ -161,11 +317,17 @@ class Config:
         ))
     doc.add("self-closing-space", self._self_closing_space)
     doc.add(tomlkit.nl())
+    doc.add(
+        tomlkit.comment(
+            "Wrap the text of inline elements at this line width, or never wrap."
+        ))
+    doc.add("max-line-width", self._max_line_width)
+    doc.add(tomlkit.nl())
     doc.add(tomlkit.nl())
     tags = tomlkit.table()
     doc.add(
         tomlkit.comment(
-            "Only add to these lists of tags for cases where you want to force the behavior."
+            "Only add to these lists of tags for cases where you want to force the behavior. Tags can also be patterns, like \"svg:*\" or \"*-preamble\", where * matches any characters and ? a single one. A tag's own name wins over patterns, and a more specific pattern over a less specific one. A tag can be given with its parents, like \"li > p\" for the p elements directly in an li; such paths win over the tag itself, and longer paths over shorter ones."
         ))
     doc.add("tags", tags)
     tags.add(tomlkit.comment("Verbatim tags."))
@@ -205,8 +367,16 @@ class Config:
 
     You can use the result produced by `print` as a blueprint.
     """
+    return cls.fromOpts(_read_opts(fp))
+
+  @classmethod
+  def fromOpts(cls, opts: Mapping) -> Self:
+    """
+    Create a configuration object from options already read from a
+    [TOML](https://toml.io/en/) file, for instance from the
+    `[tool.ptx-formatter]` table of a `pyproject.toml` file.
+    """
     config = cls()
-    opts = _read_opts(fp)
     config.set_indent(opts.get('indent', 2))
     config.set_add_doc_id(opts.get('include-doc-id', False))
     config.set_cdata(opts.get('use-cdata', "never"))
@@ -215,6 +385,7 @@ class Config:
     config.set_emptyline_before(opts.get("emptyline-before", []))
     config.set_emptyline_after(opts.get("emptyline-after", []))
     config.set_self_closing_space(opts.get("self-closing-space", True))
+    config.set_max_line_width(opts.get("max-line-width", "never"))
     prefs = {}
     for k, tagList in opts.get('tags', {}).items():
       pref = preference_from_string(k)
@@ -230,12 +401,25 @@ class Config:
     return arr
 
 
-def _read_opts(fp: TextIO | str) -> tomlkit.TOMLDocument:
+def _read_opts(fp: TextIO | str) -> dict:
+  """Read the TOML options as plain Python values, so that the
+  configuration does not hold on to (slower) tomlkit items."""
   if isinstance(fp, str):
     with open(fp, "r") as fp:
-      return tomlkit.load(fp)
+      return tomlkit.load(fp).unwrap()
   else:
-    return tomlkit.load(fp)
+    return tomlkit.load(fp).unwrap()
+
+
+def is_tag_pattern(tag: str) -> bool:
+  """Whether a tag of the configuration is a pattern. Tag names cannot
+  contain the wildcards `*`, `?` and `[`."""
+  return any(c in tag for c in "*?[")
+
+
+def _pattern_specificity(pattern: str) -> int:
+  """The number of characters of the pattern that are not wildcards."""
+  return len(re.sub(r"\[[^\]]*\]|[*?]", "", pattern))
 
 
 PREFERENCE_FROM_STRING = {
@@ -1,8 +1,13 @@
 from enum import Enum
 from typing import Dict, Iterable, Literal, Mapping, Self
 
-from ptx_formatter.utils.config import Preference, Config
+from ptx_formatter.utils.config import (BLOCK, CDATA, EMPTYLINE_AFTER,
+                                        EMPTYLINE_BEFORE, INLINE, INLINE_EMPTY,
+                                        NO_INDENT, PREFERENCE_MASK, VERBATIM,
+                                        Config)
 from ptx_formatter.utils.indent import Indent
+from ptx_formatter.utils.rules import NO_RULE, PathRules
+from ptx_formatter.utils.shared import SharedDocs
 
 import re
 
@@ -17,51 +22,138 @@ class Context:
   """The tag preferences."""
   indent: Indent
   """The current indent level."""
-
-  def __init__(self: Self, config: Config, indent: Indent = None) -> None:
+  record_spans: bool
+  """Whether elements should mark their span in the layout document,
+  so that their place in the output can be found."""
+  source: str | None
+  """The source text the elements were parsed from, if available. Parts
+  of it can then be copied to the output as they are."""
+  shared: SharedDocs | None
+  """The documents shared with the renderings of the same tree under
+  other configurations, if there are any."""
+  deferred: bool
+  """Whether the layouts of the children laid out in block mode are only
+  built when the printer reaches them, so that the output can be written
+  as it is laid out. See `ptx_formatter.utils.doc.Defer`."""
+  rules: PathRules | None
+  """The path rules of the configuration, if there are any."""
+  state: int
+  """The state of the path rules reached by the ancestors of the elements
+  laid out in this context. See `ptx_formatter.utils.rules`."""
+
+  def __init__(self: Self,
+               config: Config,
+               indent: Indent = None,
+               record_spans: bool = False,
+               source: str = None,
+               shared: SharedDocs = None,
+               deferred: bool = False,
+               state: int = 0) -> None:
     self.config = config
     self.indent = indent or Indent(config._base_indent)
-
-  def get_preference(self: Self, tag: str) -> Preference:
-    return self.config.get_pref(tag)
+    self.record_spans = record_spans
+    self.source = source
+    self.shared = shared
+    self.deferred = deferred
+    self.rules = config.path_rules()
+    self.state = state
+
+  def tag_flags(self: Self, tag_id: int) -> int:
+    """The flags of the tag (see `Config.tag_flags`) for an element in this
+    context, with the preference of the path rule it matches, if any."""
+    flags = self.config.tag_flags(tag_id)
+    if self.rules is not None:
+      pref = self.rules.move(self.state, tag_id)[1]
+      if pref != NO_RULE:
+        flags = flags & ~PREFERENCE_MASK | pref
+    return flags
+
+  def is_verbatim(self: Self, tag_id: int) -> bool:
+    return self.tag_flags(tag_id) & VERBATIM != 0
 
   def should_add_doc_id(self: Self) -> bool:
     return self.config._add_doc_id
 
-  def should_use_cdata(self: Self, tag: str, contents: str) -> bool:
+  def should_use_cdata(self: Self,
+                       tag_id: int,
+                       contents: str,
+                       escaped: bool = True) -> bool:
+    """Whether the verbatim `contents` of a tag should be written in a CDATA
+    section. The contents are escaped text, unless `escaped` is false."""
     if self.config._cdata == "always":
       return True
     if self.config._cdata == "never":
       return False
     if isinstance(self.config._cdata, Iterable):
-      return tag in self.config._cdata
+      return self.tag_flags(tag_id) & CDATA != 0
     # Else it's a number. Need to count escaped units in contents
-    escaped_count = len(ESCAPES_REGEX.findall(contents))
+    if escaped:
+      escaped_count = len(ESCAPES_REGEX.findall(contents))
+    else:
+      escaped_count = sum(map(contents.count, "&<>"))
     return escaped_count >= self.config._cdata
 
   def get_multiline_attrs(self: Self) -> tuple[Literal["never"] | int, int]:
     return self.config._multiline_attrs
 
-  def must_inline(self: Self, tag: str, is_empty: bool) -> bool:
-    pref = self.get_preference(tag)
-    return pref == Preference.Inline or (pref == Preference.InlineEmpty and
-                                         is_empty)
+  def must_inline(self: Self, tag_id: int, is_empty: bool) -> bool:
+    flags = self.tag_flags(tag_id)
+    return flags & INLINE != 0 or (is_empty and flags & INLINE_EMPTY != 0)
+
+  def must_block(self: Self, tag_id: int) -> bool:
+    return self.tag_flags(tag_id) & BLOCK != 0
+
+  def get_child_context(self: Self, tag_id: int) -> Self:
+    """The context of the children of an element with the tag, laid out
+    in block mode."""
+    if self.tag_flags(tag_id) & NO_INDENT:
+      return self.inside(tag_id)
+    return Context(self.config, self.indent.incr(), self.record_spans,
+                   self.source, self.shared, self.deferred,
+                   self._state_inside(tag_id))
+
+  def inside(self: Self, tag_id: int) -> Self:
+    """The context of the children of an element with the tag, at the same
+    indent. This is the context itself when there are no path rules."""
+    if self.rules is None:
+      return self
+    return Context(self.config, self.indent, self.record_spans, self.source,
+                   self.shared, self.deferred, self._state_inside(tag_id))
 
-  def must_block(self: Self, tag: str) -> bool:
-    pref = self.get_preference(tag)
-    return pref == Preference.Block or pref == Preference.BlockNoIndent
+  def _state_inside(self: Self, tag_id: int) -> int:
+    if self.rules is None:
+      return 0
+    return self.rules.move(self.state, tag_id)[0]
 
-  def get_child_context(self: Self, tag: str) -> Self:
-    tagPref = self.get_preference(tag)
-    if tagPref == Preference.BlockNoIndent:
-      return self
-    return Context(self.config, self.indent.incr())
+  def recording_spans(self: Self) -> Self:
+    """A copy of this context in which elements mark their spans."""
+    return Context(self.config, self.indent, True, self.source, self.shared,
+                   self.deferred, self.state)
 
-  def must_emptyline_before(self: Self, tag: str) -> bool:
-    return tag in self.config._emptyline_before
+  def with_source(self: Self, source: str) -> Self:
+    """A copy of this context for elements parsed from `source`."""
+    return Context(self.config, self.indent, self.record_spans, source,
+                   self.shared, self.deferred, self.state)
 
-  def must_emptyline_after(self: Self, tag: str) -> bool:
-    return tag in self.config._emptyline_after
+  def deferring(self: Self) -> Self:
+    """A copy of this context in which block layouts are deferred."""
+    return Context(self.config, self.indent, self.record_spans, self.source,
+                   self.shared, True, self.state)
+
+  def has_emptylines(self: Self) -> bool:
+    """Whether empty lines are inserted around any tag."""
+    return bool(self.config._emptyline_before or self.config._emptyline_after)
+
+  def must_emptyline_before(self: Self, tag_id: int) -> bool:
+    return self.config.tag_flags(tag_id) & EMPTYLINE_BEFORE != 0
+
+  def must_emptyline_after(self: Self, tag_id: int) -> bool:
+    return self.config.tag_flags(tag_id) & EMPTYLINE_AFTER != 0
 
   def use_self_closing_space(self: Self) -> bool:
     return self.config._self_closing_space
+
+  def max_line_width(self: Self) -> int | None:
+    """The line width to wrap inline elements at, or None for no wrapping."""
+    width = self.config._max_line_width
+    return None if width == "never" else width
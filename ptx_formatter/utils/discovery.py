@@ -0,0 +1,137 @@
+"""
+Discovery of the configuration that applies to a file.
+
+The configuration of a file comes from the closest directory, starting with
+the file's own directory and walking up, that contains either a
+`ptx-formatter.toml` file, or a `pyproject.toml` file with a
+`[tool.ptx-formatter]` table. The first one wins if a directory has both.
+Files with no such directory above them use the standard configuration.
+"""
+import os
+from pathlib import Path
+from typing import Callable, Self
+
+from ptx_formatter.utils.config import Config, _read_opts
+
+CONFIG_FILE = "ptx-formatter.toml"
+"""The name of a configuration file that is discovered."""
+
+PYPROJECT_FILE = "pyproject.toml"
+"""The name of a project file that can hold the configuration."""
+
+PYPROJECT_TABLE = "ptx-formatter"
+"""The name of the table under `[tool]` of a project file that holds the
+configuration."""
+
+
+class ConfigFinder:
+  """Finds the configuration of files, reading every configuration file
+  only once.
+
+  The configuration file that applies to each directory is remembered, as is
+  every configuration read, along with the modification time of its file.
+  A configuration file that changes is read again the next time it is
+  needed, and one that is removed no longer applies."""
+
+  _adjust: Callable[[Config], None] | None
+  """Changes applied to every configuration once it is read, such as the
+  command-line options."""
+  _dirs: dict[Path, Path | None]
+  """The configuration file that applies to each directory seen, or None
+  if it is the standard configuration."""
+  _configs: dict[Path, tuple[int, Config | None]]
+  """The configurations read from each file, along with the modification
+  time of the file when it was read. None for project files without a
+  configuration table."""
+  _standard: Config | None
+  """The standard configuration, once it is needed."""
+
+  def __init__(self: Self, adjust: Callable[[Config], None] = None):
+    self._adjust = adjust
+    self._dirs = {}
+    self._configs = {}
+    self._standard = None
+
+  def config_for(self: Self, path: Path | str) -> Config:
+    """The configuration of a file, or of the files in a directory. Files
+    that use the same configuration file get the same `Config` object."""
+    config_file = self.config_file_for(path)
+    if config_file is not None:
+      config = self._load(config_file)
+      if config is not None:
+        return config
+      # The configuration file or table was removed since the directory
+      # was seen
+      self._dirs.clear()
+      return self.config_for(path)
+    if self._standard is None:
+      self._standard = self._adjusted(Config.standard())
+    return self._standard
+
+  def config_from(self: Self, config_file: Path | str) -> Config:
+    """The configuration in a given `ptx-formatter.toml` or `pyproject.toml`
+    file. Raises `ValueError` if a project file has no configuration
+    table, and `FileNotFoundError` if there is no such file."""
+    config = self._load(Path(config_file).absolute())
+    if config is None:
+      if not Path(config_file).is_file():
+        raise FileNotFoundError(f"No configuration file {config_file}")
+      raise ValueError(f"No [tool.{PYPROJECT_TABLE}] table in {config_file}")
+    return config
+
+  def config_file_for(self: Self, path: Path | str) -> Path | None:
+    """The file the configuration of a file or directory comes from, or None
+    for the standard configuration."""
+    path = Path(path).absolute()
+    return self._config_file_in(path if path.is_dir() else path.parent)
+
+  def _config_file_in(self: Self, directory: Path) -> Path | None:
+    # Walk up until a directory seen before or the file system root
+    missing = []
+    found = None
+    while True:
+      if directory in self._dirs:
+        found = self._dirs[directory]
+        break
+      missing.append(directory)
+      found = self._config_file_at(directory)
+      if found is not None or directory.parent == directory:
+        break
+      directory = directory.parent
+    for directory in missing:
+      self._dirs[directory] = found
+    return found
+
+  def _config_file_at(self: Self, directory: Path) -> Path | None:
+    """The configuration file in the directory itself, if there is one."""
+    config_file = directory / CONFIG_FILE
+    if config_file.is_file():
+      return config_file
+    pyproject = directory / PYPROJECT_FILE
+    if pyproject.is_file() and self._load(pyproject) is not None:
+      return pyproject
+    return None
+
+  def _load(self: Self, config_file: Path) -> Config | None:
+    """The configuration in the file, or None if it is a project file
+    without a configuration table, or if the file is gone."""
+    try:
+      mtime = os.stat(config_file).st_mtime_ns
+      cached = self._configs.get(config_file)
+      if cached is not None and cached[0] == mtime:
+        return cached[1]
+      opts = _read_opts(str(config_file))
+    except FileNotFoundError:
+      # Deleted since the directory was seen
+      self._configs.pop(config_file, None)
+      return None
+    if config_file.name == PYPROJECT_FILE:
+      opts = opts.get("tool", {}).get(PYPROJECT_TABLE)
+    config = None if opts is None else self._adjusted(Config.fromOpts(opts))
+    self._configs[config_file] = (mtime, config)
+    return config
+
+  def _adjusted(self: Self, config: Config) -> Config:
+    if self._adjust is not None:
+      self._adjust(config)
+    return config
@@ -0,0 +1,294 @@
+"""
+An intermediate document representation for the formatted output, in the
+style of Wadler's "A prettier printer", along with a linear-time printer
+that lays it out.
+
+A document (`Doc`) is one of:
+- a `str`, which is output as-is. Text may contain newlines (for instance
+  verbatim content). Such newlines are not followed by any indentation.
+- a `list` of documents, which are output one after the other.
+- `LINE`, a line break followed by the current indentation.
+- `SOFTLINE`, which is a single space when its enclosing group fits on the
+  line, and a `LINE` otherwise.
+- `INDENTATION`, which outputs the current indentation.
+- a `Nest`, which increases the indentation used by the line breaks of its
+  contents.
+- a `Group`, whose contents are laid out flat (soft lines become spaces) if
+  they fit in the remaining width, and broken otherwise.
+- a `Mark`, which does not change the output but records where the output
+  of its contents starts and ends.
+- a `Defer`, whose contents are only built when the printer reaches them,
+  so that the output before it can be written first.
+
+Documents are built once from the `ptx_formatter.utils.ast.Element` tree and
+are not modified afterwards, so parts of them can be freely shared.
+"""
+from typing import Callable, Iterator, Self, TypeAlias
+
+
+class _Marker:
+  """The line breaks and indentation markers of the document language."""
+
+  name: str
+
+  def __init__(self: Self, name: str):
+    self.name = name
+
+  def __repr__(self: Self) -> str:
+    return self.name
+
+
+LINE = _Marker("LINE")
+SOFTLINE = _Marker("SOFTLINE")
+INDENTATION = _Marker("INDENTATION")
+
+
+class Nest:
+  """Increases the indentation of the line breaks within `doc`."""
+  __slots__ = ("indent", "doc")
+
+  indent: str
+  doc: "Doc"
+
+  def __init__(self: Self, indent: str, doc: "Doc"):
+    self.indent = indent
+    self.doc = doc
+
+  def __repr__(self: Self) -> str:
+    return f"Nest({self.indent!r}, {self.doc!r})"
+
+
+class Group:
+  """Lays out `doc` flat if it fits in the remaining width."""
+  __slots__ = ("doc",)
+
+  doc: "Doc"
+
+  def __init__(self: Self, doc: "Doc"):
+    self.doc = doc
+
+  def __repr__(self: Self) -> str:
+    return f"Group({self.doc!r})"
+
+
+class Mark:
+  """Records the span of the output of `doc` under `key`, if `layout` is
+  asked to keep track of marks."""
+  __slots__ = ("key", "doc")
+
+  key: object
+  doc: "Doc"
+
+  def __init__(self: Self, key: object, doc: "Doc"):
+    self.key = key
+    self.doc = doc
+
+  def __repr__(self: Self) -> str:
+    return f"Mark({self.key!r}, {self.doc!r})"
+
+
+class Defer:
+  """Stands for the document `make(*args)`, built when it is needed. The
+  printer does not keep it once it is laid out, so that the documents of
+  the parts already output can be freed."""
+  __slots__ = ("make", "args", "_doc")
+
+  make: Callable[..., "Doc"]
+  args: tuple
+
+  def __init__(self: Self, make: Callable[..., "Doc"], *args):
+    self.make = make
+    self.args = args
+    self._doc = None
+
+  def doc(self: Self) -> "Doc":
+    """The document, kept until `take` is called."""
+    if self._doc is None:
+      self._doc = self.make(*self.args)
+    return self._doc
+
+  def take(self: Self) -> "Doc":
+    """The document, no longer kept."""
+    doc = self.doc()
+    self._doc = None
+    return doc
+
+  def __repr__(self: Self) -> str:
+    return f"Defer({self.make!r}, {self.args!r})"
+
+
+class _MarkEnd:
+  __slots__ = ("key",)
+
+  def __init__(self: Self, key: object):
+    self.key = key
+
+
+Doc: TypeAlias = str | list | _Marker | Nest | Group | Mark | Defer
+
+SOFT_BREAK = Group(SOFTLINE)
+"""A single possible line break, taken only when the text up to the next
+possible break would not fit."""
+
+CHUNK_SIZE = 1 << 16
+"""The default size of the pieces produced by `layout`."""
+
+
+def render(doc: Doc, width: int | None = None, marks: dict = None) -> str:
+  """Lay out the document into a string. Groups are always flat if
+  `width` is `None`. See `layout` for `marks`."""
+  return "".join(layout(doc, width, None, marks))
+
+
+def layout(doc: Doc,
+           width: int | None = None,
+           chunk_size: int | None = CHUNK_SIZE,
+           marks: dict = None) -> Iterator[str]:
+  """Lay out the document, producing the output in pieces of about
+  `chunk_size` characters as soon as they are ready. If `chunk_size` is
+  `None`, the output comes as a single piece.
+
+  If a `marks` dictionary is provided, the `(start, end)` offsets in the
+  output of each `Mark` are stored in it under the mark's key."""
+  out = []
+  size = 0
+  flushed = 0
+  col = 0
+  stack = [("", False, doc)]
+  pop = stack.pop
+  push = stack.append
+  while stack:
+    indent, flat, d = pop()
+    t = type(d)
+    if t is str:
+      out.append(d)
+      size += len(d)
+      nl = d.rfind("\n")
+      col = col + len(d) if nl < 0 else len(d) - nl - 1
+    elif t is list:
+      stack.extend([(indent, flat, x) for x in reversed(d)])
+      continue
+    elif d is LINE or (d is SOFTLINE and not flat):
+      out.append("\n")
+      out.append(indent)
+      size += 1 + len(indent)
+      col = len(indent)
+    elif d is SOFTLINE:
+      out.append(" ")
+      size += 1
+      col += 1
+    elif d is INDENTATION:
+      out.append(indent)
+      size += len(indent)
+      col += len(indent)
+    elif t is Nest:
+      push((indent + d.indent, flat, d.doc))
+      continue
+    elif t is Group:
+      flat = flat or width is None or _fits(width - col, indent, d.doc, stack)
+      push((indent, flat, d.doc))
+      continue
+    elif t is Mark:
+      if marks is not None:
+        marks[d.key] = flushed + size
+        push((indent, flat, _MarkEnd(d.key)))
+      push((indent, flat, d.doc))
+      continue
+    elif t is _MarkEnd:
+      marks[d.key] = (marks[d.key], flushed + size)
+      continue
+    elif t is Defer:
+      push((indent, flat, d.take()))
+      continue
+    else:
+      raise TypeError(f"Not a document: {d!r}")
+    if chunk_size is not None and size >= chunk_size:
+      yield "".join(out)
+      out = []
+      flushed += size
+      size = 0
+  yield "".join(out)
+
+
+def _fits(remaining: int, indent: str, doc: Doc, stack: list) -> bool:
+  """Whether `doc` laid out flat, followed by the rest of the document up
+  to its next line break, fits in the `remaining` width. Only looks ahead
+  as far as the remaining width, which keeps the printer linear."""
+  todo = [(indent, True, doc)]
+  rest = len(stack)
+  while remaining >= 0:
+    if not todo:
+      if rest == 0:
+        return True
+      rest -= 1
+      todo.append(stack[rest])
+    indent, flat, d = todo.pop()
+    t = type(d)
+    if t is str:
+      nl = d.find("\n")
+      if nl >= 0:
+        return remaining >= nl
+      remaining -= len(d)
+    elif t is list:
+      todo.extend([(indent, flat, x) for x in reversed(d)])
+    elif d is LINE:
+      return True
+    elif d is SOFTLINE:
+      if not flat:
+        return True
+      remaining -= 1
+    elif d is INDENTATION:
+      remaining -= len(indent)
+    elif t is Nest:
+      todo.append((indent + d.indent, flat, d.doc))
+    elif t is Group or t is Mark:
+      todo.append((indent, flat, d.doc))
+    elif t is Defer:
+      todo.append((indent, flat, d.doc()))
+  return False
+
+
+def _is_break(d: Doc) -> bool:
+  return d is LINE or d is SOFT_BREAK or d is SOFTLINE
+
+
+def lstrip_parts(parts: list[Doc]) -> list[Doc]:
+  """Remove the leading whitespace of a list of parts, the same way that
+  `str.lstrip` would on the rendered result. Stops at the first part that
+  is not text or a line break. Modifies the list in place."""
+  start = 0
+  while start < len(parts):
+    first = parts[start]
+    if type(first) is str:
+      stripped = first.lstrip()
+      if stripped:
+        parts[start] = stripped
+        break
+    elif not _is_break(first):
+      break
+    start += 1
+  if start:
+    del parts[:start]
+  return parts
+
+
+def rstrip_parts(parts: list[Doc]) -> list[Doc]:
+  """Remove the trailing whitespace of a list of parts, the same way that
+  `str.rstrip` would on the rendered result. Stops at the first part that
+  is not text or a line break. Modifies the list in place."""
+  while parts:
+    last = parts[-1]
+    if type(last) is str:
+      stripped = last.rstrip()
+      if stripped:
+        parts[-1] = stripped
+        break
+    elif not _is_break(last):
+      break
+    parts.pop()
+  return parts
+
+
+def strip_parts(parts: list[Doc]) -> list[Doc]:
+  """Remove leading and trailing whitespace from a list of parts."""
+  return lstrip_parts(rstrip_parts(parts))
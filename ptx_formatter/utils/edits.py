@@ -0,0 +1,86 @@
+"""
+Computes the text edits that turn a source document into its formatted
+version, by aligning the parsed tree with the spans of its elements in the
+formatted output.
+"""
+from typing import Iterable, NamedTuple
+
+from ptx_formatter.utils.ast import Element
+
+
+class TextEdit(NamedTuple):
+  """Replace the source text between `start` and `end` with `replacement`.
+  Offsets are into the source string."""
+  start: int
+  end: int
+  replacement: str
+
+
+def compute_edits(source: str, output: str, root: Element,
+                  spans: dict[Element, tuple[int, int]]) -> list[TextEdit]:
+  """Find the edits that turn `source` into `output`.
+
+  `root` is the tree parsed from `source`, with the source offsets of its
+  elements, and `spans` holds the offsets of the same elements in `output`.
+  Subtrees whose source and output are the same are skipped as a whole.
+  Otherwise the text between the child elements is compared, and the
+  children are checked in turn.
+
+  A child that makes up more than half of its element is not compared as a
+  whole, as most of its text was just compared with the element: only its
+  own text is, and its children are checked in turn. A character is then
+  compared as part of at most one subtree for each halving of the document,
+  so the work is at most the size of the document times its log, whatever
+  the depth of the tree."""
+  edits = []
+  todo = [(root, 0, len(output), True)]
+  while todo:
+    el, out_start, out_end, compare = todo.pop()
+    if compare and _same(source, el.start, el.end, output, out_start, out_end):
+      continue
+    kids = [ch for ch in el.children if isinstance(ch, Element)]
+    if any(kid not in spans for kid in kids):
+      # The children were laid out as verbatim text
+      _add_edit(edits, source, el.start, el.end, output, out_start, out_end)
+      continue
+    size = el.end - el.start
+    src_pos, out_pos = el.start, out_start
+    for kid in kids:
+      kid_start, kid_end = spans[kid]
+      _add_edit(edits, source, src_pos, kid.start, output, out_pos, kid_start)
+      todo.append((kid, kid_start, kid_end, 2 * (kid.end - kid.start) <= size))
+      src_pos, out_pos = kid.end, kid_end
+    _add_edit(edits, source, src_pos, el.end, output, out_pos, out_end)
+  edits.sort()
+  return edits
+
+
+def apply_edits(text: str, edits: Iterable[TextEdit]) -> str:
+  """Apply non-overlapping edits, sorted by position, to the text."""
+  parts = []
+  pos = 0
+  for start, end, replacement in edits:
+    parts.append(text[pos:start])
+    parts.append(replacement)
+    pos = end
+  parts.append(text[pos:])
+  return "".join(parts)
+
+
+def _same(source: str, s0: int, s1: int, output: str, o0: int, o1: int) -> bool:
+  return s1 - s0 == o1 - o0 and source[s0:s1] == output[o0:o1]
+
+
+def _add_edit(edits: list[TextEdit], source: str, s0: int, s1: int, output: str,
+              o0: int, o1: int):
+  """Add an edit replacing `source[s0:s1]` by `output[o0:o1]`, leaving out
+  any common start and end."""
+  if _same(source, s0, s1, output, o0, o1):
+    return
+  while s0 < s1 and o0 < o1 and source[s0] == output[o0]:
+    s0 += 1
+    o0 += 1
+  while s1 > s0 and o1 > o0 and source[s1 - 1] == output[o1 - 1]:
+    s1 -= 1
+    o1 -= 1
+  edits.append(TextEdit(s0, s1, output[o0:o1]))
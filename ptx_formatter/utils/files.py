@@ -0,0 +1,62 @@
+"""
+Reading source files and writing them back safely.
+
+Files are replaced atomically: the new contents go to a temporary file in the
+same directory, which is then renamed over the original. A crash part way
+through leaves either the old or the new file, never a truncated one.
+"""
+from enum import Enum
+import os
+from pathlib import Path
+import tempfile
+
+
+class Sync(str, Enum):
+  """When written files are flushed to the disk."""
+  always = "always"
+  """Each file, before it replaces the original. The safest choice."""
+  batch = "batch"
+  """All files at once, at the end of the run."""
+  never = "never"
+  """Leave it to the operating system."""
+
+
+def read_source(path: Path | str) -> tuple[bytes, str]:
+  """The contents of a UTF-8 file, both as bytes and as text with its line
+  endings turned into `\\n`, as when reading in text mode."""
+  with open(path, "rb") as f:
+    data = f.read()
+  text = data.decode("utf-8")
+  if "\r" in text:
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+  return data, text
+
+
+def replace_file(path: Path | str, data: bytes, fsync: bool = True):
+  """Replace the contents of a file atomically, keeping its permissions.
+  With `fsync`, the new contents are on the disk before they replace the
+  old ones. A symbolic link is followed, and its target replaced."""
+  path = os.path.realpath(path)
+  directory, name = os.path.split(path)
+  fd, tmp = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+  try:
+    with os.fdopen(fd, "wb") as f:
+      f.write(data)
+      if fsync:
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+    os.replace(tmp, path)
+  except BaseException:
+    try:
+      os.unlink(tmp)
+    except OSError:
+      pass
+    raise
+  if fsync:
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+      os.fsync(dir_fd)
+    finally:
+      os.close(dir_fd)
@@ -0,0 +1,193 @@
+"""
+Formatting only the parts of a document on some of its lines, such as the
+lines an author changed, so that the rest of a large file stays as it is.
+
+The lines are mapped to the smallest elements that can be laid out on their
+own: elements laid out in block mode, which start a line of the source.
+Only those elements are laid out again, at the place they have in the tree,
+and the text around them is kept byte for byte. The work done besides the
+parse is proportional to the size of these elements. When the lines reach
+the top level of the document, it is formatted as a whole.
+"""
+from pathlib import Path
+import re
+import subprocess
+from typing import Iterable, TypeAlias
+
+from ptx_formatter.utils.ast import Element, Processing
+from ptx_formatter.utils.context import Context
+from ptx_formatter.utils.doc import INDENTATION, Nest, render
+from ptx_formatter.utils.edits import TextEdit
+
+LineRange: TypeAlias = tuple[int, int]
+"""The first and last line of a range, counting from 1. Both are included."""
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@", re.M)
+
+
+def parse_line_range(text: str) -> LineRange:
+  """The range of a `START:END` string. Raises `ValueError` if it is not
+  one."""
+  match = re.fullmatch(r"\s*(\d+)\s*:\s*(\d+)\s*", text)
+  if match is None:
+    raise ValueError(f"Invalid line range {text!r}: expected START:END")
+  start, end = int(match[1]), int(match[2])
+  if start < 1 or end < start:
+    raise ValueError(
+        f"Invalid line range {text!r}: lines count from 1, and END "
+        "cannot be before START")
+  return start, end
+
+
+def git_hunks(path: Path | str) -> list[LineRange] | None:
+  """The lines of a file changed since the last commit, as `git diff`
+  reports them, or None if git does not track the file, in which case all
+  of it is new. Raises `RuntimeError` if git fails, for instance outside of
+  a repository."""
+  path = Path(path).resolve()
+  tracked = _git(path, "ls-files", "--", path.name)
+  if tracked.returncode != 0:
+    raise RuntimeError(tracked.stderr.strip() or "git ls-files failed")
+  if tracked.stdout.strip() == "":
+    return None
+  diff = _git(path, "diff", "--no-color", "--no-ext-diff", "-U0", "HEAD", "--",
+              path.name)
+  if diff.returncode != 0:
+    raise RuntimeError(diff.stderr.strip() or "git diff failed")
+  ranges = []
+  for match in HUNK_HEADER.finditer(diff.stdout):
+    start = int(match[1])
+    count = 1 if match[2] is None else int(match[2])
+    if count == 0:
+      # Lines removed after `start`: the lines around them are touched
+      ranges.append((max(start, 1), start + 1))
+    else:
+      ranges.append((start, start + count - 1))
+  return ranges
+
+
+def line_edits(source: str, root: Element, ctx: Context,
+               lines: Iterable[LineRange]) -> list[TextEdit] | None:
+  """The edits that format the elements of `root` on the given lines, or
+  None if the whole document must be formatted. `ctx` is the context of
+  the document."""
+  units = []
+  for start, end in _offsets(source, lines):
+    selected = _select(source, root, ctx, start, end)
+    if selected is None:
+      return None
+    units.extend(selected)
+  # Keep the outermost of nested elements. They are sorted by start, with
+  # the outer element first when two start together.
+  units.sort(key=lambda unit: (unit[0].start, -unit[0].end))
+  edits = []
+  last_end = -1
+  width = ctx.max_line_width()
+  for element, element_ctx in units:
+    if element.start < last_end:
+      continue
+    last_end = element.end
+    line_start = source.rfind("\n", 0, element.start) + 1
+    doc = Nest(str(element_ctx.indent),
+               [INDENTATION, element.doc_block(element_ctx)])
+    text = render(doc, width)
+    if source[line_start:element.end] != text:
+      edits.append(TextEdit(line_start, element.end, text))
+  return edits
+
+
+def _offsets(source: str, lines: Iterable[LineRange]) -> list[tuple[int, int]]:
+  """The spans of the source text on each of the line ranges, from the start
+  of their first line to the end of their last one, left out if they are
+  past the end of the text. The text is only scanned up to the last line."""
+  lines = list(lines)
+  if lines == []:
+    return []
+  # The offsets of the starts of the lines, as far as needed
+  starts = [0]
+  needed = max(last for _, last in lines) + 1
+  pos = 0
+  while len(starts) < needed:
+    pos = source.find("\n", pos) + 1
+    if pos == 0:
+      break
+    starts.append(pos)
+  result = []
+  for first, last in lines:
+    if first <= len(starts):
+      end = starts[last] - 1 if last < len(starts) else len(source)
+      result.append((starts[first - 1], end))
+  return result
+
+
+def _select(source: str, root: Element, ctx: Context, start: int,
+            end: int) -> list[tuple[Element, Context]] | None:
+  """The elements to format for the source from `start` to `end`, with the
+  contexts they are laid out in, or None for the whole document."""
+  # The elements around the span, with their contexts, from the root down
+  path = [(root, ctx)]
+  while True:
+    element, element_ctx = path[-1]
+    if element is not root and not _lays_out_children(element, element_ctx):
+      break
+    child_ctx = (element_ctx if element is root else
+                 element_ctx.get_child_context(element.tag_id))
+    touched = [
+        ch for ch in element.children
+        if isinstance(ch, Element) and ch.start <= end and ch.end > start
+    ]
+    if (len(touched) == 1 and touched[0].inner_start <= start and
+        end <= touched[0].inner_end and
+        not touched[0].is_inlineable(child_ctx)):
+      path.append((touched[0], child_ctx))
+      continue
+    if touched == [] and element is root:
+      # Only text, comments or blank lines between the top-level elements
+      return []
+    if touched != [] and all(_is_unit(source, ch, child_ctx) for ch in touched):
+      return [(ch, child_ctx) for ch in touched]
+    break
+  # The innermost element that can be laid out on its own
+  for element, element_ctx in reversed(path):
+    if element is root:
+      return None
+    if _is_unit(source, element, element_ctx):
+      return [(element, element_ctx)]
+
+
+def _lays_out_children(element: Element, ctx: Context) -> bool:
+  """Whether the children of the element are laid out in block mode."""
+  tag = element.tag_id
+  if ctx.must_block(tag):
+    return True
+  if not ctx.is_verbatim(tag) and not ctx.must_inline(tag, False):
+    # An element or instruction that is not inlineable is kept by the
+    # normalization of the children, which can be long, and makes a block
+    inner = ctx.inside(tag)
+    for ch in element.children:
+      if isinstance(ch, (Element, Processing)) and not ch.is_inlineable(inner):
+        return True
+  children = element._block_children(ctx)
+  if element._is_verbatim_tag(ctx) and children != []:
+    return False
+  return not element._will_inline(children, ctx)
+
+
+def _is_unit(source: str, element: Element, ctx: Context) -> bool:
+  """Whether the element can be laid out on its own: it is laid out in
+  block mode, and nothing but whitespace comes before it on its first line
+  of the source or after it on its last one."""
+  line_start = source.rfind("\n", 0, element.start) + 1
+  line_end = source.find("\n", element.end)
+  if line_end == -1:
+    line_end = len(source)
+  return (source[line_start:element.start].strip() == "" and
+          source[element.end:line_end].strip() == "" and
+          not element.is_inlineable(ctx))
+
+
+def _git(path: Path, *args: str) -> subprocess.CompletedProcess:
+  return subprocess.run(["git", *args],
+                        cwd=path.parent,
+                        capture_output=True,
+                        text=True)
@@ -1,55 +1,104 @@
-import re
-from typing import Dict, Self, Set
+from typing import Dict, Iterator, Self
 from ptx_formatter.utils.ast import Attrs
 
-NAMESPACED_PATTERN = re.compile(r"^\{([^\}]+)\}(.+)$")
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
 
 
 class Namespace:
-  """Manages the active namespaces for the formatter."""
+  """Manages the active namespaces for the formatter.
 
-  _active_ns: Dict[str, str]
-  """A dictionary mapping between uris and the corresponding
-     namespace abbreviations"""
-  _new_ns: Set[str]
-  """Any possible newly-introduced namespace. Only exists
+  Namespace declarations are scoped to the element they appear on, and
+  can hide the declarations of enclosing elements, so every prefix and
+  every uri keeps a stack of its bindings, innermost last."""
+
+  _uris: Dict[str, list[str]]
+  """The uris bound to each prefix. The empty prefix stands for the
+     default namespace."""
+  _prefixes: Dict[str, list[str]]
+  """The prefixes bound to each uri."""
+  _new_ns: list[tuple[str, str]]
+  """Any newly-introduced namespace, as a prefix and uri. Only exists
      for the small amount of time between the calls to start_ns
      and start."""
+  _names: Dict[str, str]
+  """The prefixed form of the `{uri}local` names of elements seen since
+     the namespace bindings last changed."""
+  _attr_names: Dict[str, str]
+  """The same for attribute names, which never use the default
+     namespace."""
 
   def __init__(self: Self):
-    self._active_ns = {'http://www.w3.org/XML/1998/namespace': 'xml'}
-    self._new_ns = set()
+    self._uris = {"xml": [XML_NAMESPACE]}
+    self._prefixes = {XML_NAMESPACE: ["xml"]}
+    self._new_ns = []
+    self._names = {}
+    self._attr_names = {}
 
   def adjust_str(self: Self, s: str) -> str:
-    m = NAMESPACED_PATTERN.search(s)
-    if m is not None:
-      prefix = self._active_ns[m[1]]
-      return f"{prefix}:{m[2]}"
-    else:
+    """The prefixed form of an element name given as `{uri}local`.
+    Names without a namespace are returned as they are."""
+    if s[:1] != "{":
       return s
+    name = self._names.get(s)
+    if name is None:
+      name = self._names[s] = self._prefixed(s, False)
+    return name
 
   def adjust_attrs(self: Self, attrs: Attrs) -> Attrs:
-    return {self.adjust_str(k): v for k, v in attrs.items()}
+    """The attributes with their names prefixed. The same dictionary is
+    returned if none of them has a namespace."""
+    for k in attrs:
+      if k[:1] == "{":
+        break
+    else:
+      return attrs
+    return {self._adjust_attr(k): v for k, v in attrs.items()}
 
-  def process_new_ns(self: Self):
-    for value in self._new_ns:
-      if value is not None:
-        key = f"xmlns:{self._active_ns[value]}"
-        yield key, value
-    self._new_ns = set()
+  def process_new_ns(self: Self) -> Iterator[tuple[str, str]]:
+    """The declaration attributes of the namespaces introduced since the
+    last call."""
+    for prefix, uri in self._new_ns:
+      yield (f"xmlns:{prefix}" if prefix else "xmlns"), uri
+    self._new_ns = []
 
   def remove_prefix(self: Self, prefix: str):
-    uri = self._find_uri_for_prefix(prefix)
-    del self._active_ns[uri]
+    uri = self._uris[prefix].pop()
+    prefixes = self._prefixes[uri]
+    # Bindings are removed in the reverse order they were added in, so this
+    # is almost always the last one
+    idx = len(prefixes) - 1
+    while prefixes[idx] != prefix:
+      idx -= 1
+    del prefixes[idx]
+    self._names.clear()
+    self._attr_names.clear()
 
   def add_prefix(self: Self, prefix: str, uri: str):
-    self._active_ns[uri] = prefix
+    self._uris.setdefault(prefix, []).append(uri)
+    self._prefixes.setdefault(uri, []).append(prefix)
+    self._names.clear()
+    self._attr_names.clear()
     # We need to remember the newly introduced ns
     # so we add it to the attributes list
-    self._new_ns.add(uri)
+    self._new_ns.append((prefix, uri))
+
+  def _adjust_attr(self: Self, s: str) -> str:
+    if s[:1] != "{":
+      return s
+    name = self._attr_names.get(s)
+    if name is None:
+      name = self._attr_names[s] = self._prefixed(s, True)
+    return name
+
+  def _prefixed(self: Self, s: str, attribute: bool) -> str:
+    uri, local = s[1:].split("}", 1)
+    prefix = self._prefix_for(uri, attribute)
+    return f"{prefix}:{local}" if prefix else local
 
-  def _find_uri_for_prefix(self: Self, prefix: str) -> str | None:
-    for uri, _prefix in self._active_ns.items():
-      if _prefix == prefix:
-        return uri
-    return None
+  def _prefix_for(self: Self, uri: str, attribute: bool) -> str:
+    """The innermost prefix bound to `uri` that is not hidden by another
+    binding of the same prefix."""
+    for prefix in reversed(self._prefixes.get(uri, ())):
+      if self._uris[prefix][-1] == uri and (prefix or not attribute):
+        return prefix
+    raise KeyError(uri)
@@ -0,0 +1,159 @@
+"""
+Per-file records of a formatting run, for finding the files that fail to
+format or take most of the time.
+
+Each file formatted gets a `FileReport` with its status, its size before and
+after, the number of elements and depth of its tree, and the time spent
+parsing and rendering it. A `ReportWriter` writes the records either as JSON
+lines, one per file as soon as it is done, or as a single JSON document at
+the end of the run.
+"""
+from enum import Enum
+import json
+import sys
+from time import perf_counter
+from typing import Self, TextIO
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+from ptx_formatter.formatter import Formatter, keep_final_newline
+from ptx_formatter.utils.ast import Element
+from ptx_formatter.utils.config import Config
+
+
+def is_out_of_memory(e: Exception) -> bool:
+  """Whether the error is running out of memory, in Python or in the
+  parser."""
+  return isinstance(e, MemoryError) or (
+      isinstance(e, ET.ParseError) and
+      e.code == expat.errors.codes[expat.errors.XML_ERROR_NO_MEMORY])
+
+
+class Status(str, Enum):
+  """What happened to a file."""
+  unchanged = "unchanged"
+  """The file was already formatted."""
+  reformatted = "reformatted"
+  """The formatting of the file changed."""
+  error = "error"
+  """The file could not be read, formatted or written."""
+  skipped = "skipped"
+  """The file was not formatted, for example because it is too large."""
+
+
+class FileReport:
+  """The record of one file. Fields that are not known, like the timings of
+  a file that could not be read, are None and left out of `as_dict`."""
+  path: str
+  status: Status
+  input_bytes: int | None
+  output_bytes: int | None
+  elements: int | None
+  """The number of elements in the tree."""
+  max_depth: int | None
+  """The depth of the most deeply nested element. Top-level elements are at
+  depth 1."""
+  parse_ms: float | None
+  render_ms: float | None
+  error: str | None
+  """Why the file failed or was skipped."""
+  line: int | None
+  """The line of a parse error, starting at 1."""
+  column: int | None
+  """The column of a parse error, starting at 0."""
+
+  def __init__(self: Self, path: str):
+    self.path = path
+    self.status = Status.unchanged
+    self.input_bytes = None
+    self.output_bytes = None
+    self.elements = None
+    self.max_depth = None
+    self.parse_ms = None
+    self.render_ms = None
+    self.error = None
+    self.line = None
+    self.column = None
+
+  def fail(self: Self, e: Exception):
+    """Record an error, with its position if it is a parse error."""
+    self.status = Status.error
+    self.error = "out of memory" if is_out_of_memory(e) else str(e)
+    if isinstance(e, ET.ParseError):
+      self.line, self.column = e.position
+
+  def skip(self: Self, reason: str):
+    self.status = Status.skipped
+    self.error = reason
+
+  def as_dict(self: Self) -> dict:
+    return {k: v for k, v in vars(self).items() if v is not None}
+
+
+def format_with_report(text: str, config: Config, report: FileReport) -> str:
+  """Format a document like `ptx_formatter.formatPretext`, recording the
+  shape of its tree and the time spent in each step."""
+  start = perf_counter()
+  formatter = Formatter(text, config)
+  parsed = perf_counter()
+  result = keep_final_newline(text, formatter.format())
+  report.parse_ms = round((parsed - start) * 1000, 3)
+  report.render_ms = round((perf_counter() - parsed) * 1000, 3)
+  report.elements, report.max_depth = tree_shape(formatter.root)
+  return result
+
+
+def tree_shape(root: Element) -> tuple[int, int]:
+  """The number of elements below `root`, and the depth of the most deeply
+  nested one."""
+  count = 0
+  max_depth = 0
+  stack = [(root, 0)]
+  while stack:
+    element, depth = stack.pop()
+    for child in element.children:
+      if isinstance(child, Element):
+        count += 1
+        max_depth = max(max_depth, depth + 1)
+        stack.append((child, depth + 1))
+  return count, max_depth
+
+
+class ReportWriter:
+  """Writes the records of a run to a file, or to standard output for the
+  target `-`.
+
+  Standard output and files whose name ends with `.jsonl` get one JSON
+  object per line, written as each file is done. Other files get a single
+  JSON object at the end, with the records under `files` and the number of
+  files with each status under `summary`."""
+  _out: TextIO
+  _lines: bool
+  """Whether records are written as JSON lines."""
+  _records: list[dict]
+  """The records kept for the final document."""
+  _counts: dict[str, int]
+
+  def __init__(self: Self, target: str):
+    self._lines = target == "-" or target.endswith(".jsonl")
+    self._out = sys.stdout if target == "-" else open(
+        target, "w", encoding="utf-8")
+    self._records = []
+    self._counts = {status.value: 0 for status in Status}
+
+  def add(self: Self, report: FileReport):
+    record = report.as_dict()
+    self._counts[report.status.value] += 1
+    if self._lines:
+      self._out.write(json.dumps(record) + "\n")
+      self._out.flush()
+    else:
+      self._records.append(record)
+
+  def close(self: Self):
+    if not self._lines:
+      document = {"files": self._records, "summary": self._counts}
+      json.dump(document, self._out, indent=2)
+      self._out.write("\n")
+    if self._out is not sys.stdout:
+      self._out.close()
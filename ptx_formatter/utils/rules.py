@@ -0,0 +1,121 @@
+"""
+Tag preferences that depend on the ancestors of an element.
+
+A path rule such as `li > p` applies to the `p` elements whose parent is an
+`li`, and `chapter > section > title` to the titles of sections directly in
+chapters. Each step of a path is a tag name or a pattern, as in the other
+entries of the `[tags]` table. A matching path rule wins over the preference
+of the tag itself, and a longer one over a shorter one.
+
+The rules are compiled into an automaton whose states stand for the partial
+matches of the rules along the path from the root to an element. The
+context of the contents of an element holds the state reached at it (see
+`ptx_formatter.utils.context.Context.inside`), so that finding the rule of
+a child, and the state inside it, is one lookup, whatever the depth. States
+and their transitions are built as tags are met, and kept.
+"""
+from functools import cache
+import fnmatch
+import re
+import threading
+from typing import Self
+
+from ptx_formatter.utils.tags import tag_name
+
+NO_RULE = -1
+"""The preference flags of a tag that no rule matches."""
+
+
+def is_path_rule(tag: str) -> bool:
+  """Whether a tag of the configuration is a path rule."""
+  return ">" in tag
+
+
+class PathRules:
+  """The compiled form of a list of path rules. The state of the root is 0."""
+  _steps: list[tuple[str | re.Pattern, ...]]
+  """The steps of each rule, as names or compiled patterns."""
+  _flags: list[int]
+  """The preference flags of each rule."""
+  _states: list[frozenset[tuple[int, int]]]
+  """The partial matches of each state: the rules, with the number of their
+  steps matched by the last tags of the path."""
+  _state_ids: dict[frozenset[tuple[int, int]], int]
+  _moves: list[dict[int, tuple[int, int]]]
+  """For each state and tag id met in it, the state inside an element with
+  that tag and the preference flags of the element, or `NO_RULE`."""
+  _lock: threading.Lock
+
+  def __init__(self: Self, rules: tuple[tuple[str, int], ...]):
+    """`rules` are pairs of a path rule and its preference flags, with the
+    later rules winning over the earlier ones of the same length. Raises
+    `ValueError` for a malformed rule."""
+    self._steps = [_compile_rule(rule) for rule, _ in rules]
+    self._flags = [flags for _, flags in rules]
+    self._states = [frozenset()]
+    self._state_ids = {frozenset(): 0}
+    self._moves = [{}]
+    self._lock = threading.Lock()
+
+  def move(self: Self, state: int, tag_id: int) -> tuple[int, int]:
+    """The state inside an element with the given tag, met in `state`, and
+    the preference flags of that element, or `NO_RULE`."""
+    move = self._moves[state].get(tag_id)
+    if move is None:
+      with self._lock:
+        move = self._compute_move(state, tag_id)
+        self._moves[state][tag_id] = move
+    return move
+
+  def _compute_move(self: Self, state: int, tag_id: int) -> tuple[int, int]:
+    tag = tag_name(tag_id)
+    partial = set()
+    best = None
+    # Every rule can start at the element, besides the matches in progress
+    candidates = list(self._states[state])
+    candidates.extend((rule, 0) for rule in range(len(self._steps)))
+    for rule, matched in candidates:
+      steps = self._steps[rule]
+      if not _step_matches(steps[matched], tag):
+        continue
+      if matched + 1 < len(steps):
+        partial.add((rule, matched + 1))
+      elif best is None or (len(steps), rule) > (len(self._steps[best]), best):
+        best = rule
+    partial = frozenset(partial)
+    next_state = self._state_ids.get(partial)
+    if next_state is None:
+      next_state = len(self._states)
+      self._states.append(partial)
+      self._state_ids[partial] = next_state
+      self._moves.append({})
+    return next_state, NO_RULE if best is None else self._flags[best]
+
+
+@cache
+def compile_path_rules(rules: tuple[tuple[str, int], ...]) -> PathRules | None:
+  """The compiled form of the rules, shared by all configurations with the
+  same rules, or None if there are none."""
+  if rules == ():
+    return None
+  return PathRules(rules)
+
+
+def _compile_rule(rule: str) -> tuple[str | re.Pattern, ...]:
+  steps = tuple(step.strip() for step in rule.split(">"))
+  for step in steps:
+    if step == "" or any(c.isspace() for c in step):
+      raise ValueError(
+          f"Invalid tag path {rule!r}: steps must be tags separated by >")
+  return tuple(
+      re.compile(fnmatch.translate(step)) if any(c in step
+                                                 for c in "*?[") else step
+      for step in steps)
+
+
+def _step_matches(step: str | re.Pattern, tag: str | None) -> bool:
+  if tag is None:
+    return False
+  if type(step) is str:
+    return step == tag
+  return step.match(tag) is not None
@@ -0,0 +1,125 @@
+"""
+Sharing of layout documents between renderings of one tree under several
+configurations.
+
+The layout document of an element depends on the settings of the tags in
+its subtree, on the settings that apply to all tags (indent, attributes,
+cdata, line width) and on its indent level. When two configurations agree
+on all of these for an element, the document built for the first one is
+reused for the second, along with the whole subtree it covers.
+
+Rendering under a configuration with the settings of one seen before reuses
+all of its documents, except those of the elements that were changed since,
+see `forget`. The documents of the last `MAX_CONFIGS` such settings are kept.
+"""
+import copy
+from typing import Iterable, Self
+
+from ptx_formatter.utils.config import Config
+from ptx_formatter.utils.doc import Doc
+from ptx_formatter.utils.tags import ROOT_TAG_ID, tag_count
+
+MAX_CONFIGS = 8
+"""The number of configurations whose documents are kept."""
+
+
+class SharedDocs:
+  """The documents built so far for each configuration, and which of them
+  can be reused for the configuration currently rendered."""
+
+  _configs: list[Config]
+  """Copies of the configurations rendered so far, as they were when
+  rendered, the current one last. A configuration can be changed between
+  renderings, and is then compared by its settings like any other."""
+  _docs: list[dict]
+  """The documents built or reused for each configuration, keyed by
+  element, then by layout mode and indent level."""
+  _reusable: list[tuple[int, dict]]
+  """For the current configuration, the documents of the earlier
+  configurations that use the same settings for all tags, along with the
+  mask of the tag ids whose settings differ."""
+
+  def __init__(self: Self):
+    self._configs = []
+    self._docs = []
+    self._reusable = []
+
+  def start(self: Self, config: Config):
+    """Start the rendering under another configuration, or again under
+    one with the settings of one rendered before."""
+    self._reusable = []
+    current = None
+    for idx, (other, docs) in enumerate(zip(self._configs, self._docs)):
+      mask = _differing_tags(other, config)
+      if mask is not None:
+        self._reusable.append((mask, docs))
+      if mask == 0 and current is None:
+        # The same settings: its documents are the current ones
+        current = idx
+    if current is None:
+      self._configs.append(copy.deepcopy(config))
+      self._docs.append({})
+      if len(self._configs) > MAX_CONFIGS:
+        del self._configs[0]
+        del self._docs[0]
+    else:
+      self._configs.append(self._configs.pop(current))
+      self._docs.append(self._docs.pop(current))
+
+  def get(self: Self, element, block: bool, level: int) -> Doc | None:
+    """The document of `element` in block or inline mode at the given
+    indent level, if one from an earlier configuration can be reused. It
+    is then kept for the current configuration as well."""
+    key = (block, level)
+    mask = element.tag_mask()
+    for differing, docs in self._reusable:
+      if mask & differing == 0:
+        element_docs = docs.get(element)
+        if element_docs is not None:
+          doc = element_docs.get(key)
+          if doc is not None:
+            self.put(element, block, level, doc)
+            return doc
+    return None
+
+  def put(self: Self, element, block: bool, level: int, doc: Doc):
+    """Keep the document built for `element` under the current
+    configuration."""
+    key = (block, level)
+    element_docs = self._docs[-1].get(element)
+    if element_docs is None:
+      self._docs[-1][element] = element_docs = {}
+    element_docs[key] = doc
+
+  def forget(self: Self, elements: Iterable):
+    """Forget the documents of elements whose contents changed. They are
+    built again the next time they are needed."""
+    for element in elements:
+      for docs in self._docs:
+        docs.pop(element, None)
+
+
+def _differing_tags(a: Config, b: Config) -> int | None:
+  """The mask of the ids of the tags whose settings differ between two
+  configurations, or None if settings that apply to all tags differ."""
+  if (a._base_indent != b._base_indent or
+      a._multiline_attrs != b._multiline_attrs or
+      a._self_closing_space != b._self_closing_space or
+      a._max_line_width != b._max_line_width or
+      _cdata_mode(a) != _cdata_mode(b) or
+      # Equal rules are compiled once, so their states agree
+      a.path_rules() is not b.path_rules()):
+    return None
+  mask = 0
+  for id in range(tag_count()):
+    if a.tag_flags(id) != b.tag_flags(id):
+      mask |= 1 << id
+  if a._add_doc_id != b._add_doc_id:
+    mask |= 1 << ROOT_TAG_ID
+  return mask
+
+
+def _cdata_mode(config: Config):
+  # With a list of tags, the cdata setting is part of the tag flags
+  cdata = config._cdata
+  return list if not isinstance(cdata, (str, int)) else cdata
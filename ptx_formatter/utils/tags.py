@@ -0,0 +1,81 @@
+"""
+Interning of tag names into small integer ids.
+
+Every tag name seen by the formatter gets an id once, when its element is
+created, and keeps it for the life of the process. Per-tag settings can then
+be kept in lists indexed by id (see `ptx_formatter.utils.config.Config.tag_flags`)
+instead of being looked up by name for every element rendered.
+
+A long-running process can meet any number of tag names, so the table is
+bounded: once `MAX_TAG_IDS` ids are taken, the new tags of documents share
+`OTHER_TAG_ID`. The tags named by configurations, and those matching the
+patterns of configurations, always get ids of their own, so that their
+settings apply (see `keep_tags`).
+
+Ids are only meaningful within a process. Anything sent to another process
+should refer to tags by name.
+"""
+import fnmatch
+import re
+import threading
+
+ROOT_TAG_ID = 0
+"""The id of the tag `None` of the root element."""
+OTHER_TAG_ID = 1
+"""The id shared by the tags met once all the ids are taken. Its name is
+None, so they get the settings of a tag that the configuration does not
+name and that no pattern matches."""
+MAX_TAG_IDS = 2048
+"""The number of ids given to the tags of documents."""
+
+_ids: dict[str | None, int] = {None: ROOT_TAG_ID}
+_names: list[str | None] = [None, None]
+_kept_patterns: dict[str, re.Pattern] = {}
+"""The patterns of the tags that get ids of their own, see `keep_tags`."""
+_lock = threading.Lock()
+
+
+def tag_id(tag: str | None) -> int:
+  """The id of a tag name, assigning a new one if the name is new, or
+  `OTHER_TAG_ID` if all the ids are taken and no kept pattern matches it."""
+  id = _ids.get(tag)
+  if id is None:
+    if len(_names) >= MAX_TAG_IDS and not any(
+        regex.match(tag) for regex in list(_kept_patterns.values())):
+      return OTHER_TAG_ID
+    id = intern_tag(tag)
+  return id
+
+
+def keep_tags(pattern: str):
+  """Give the tags matching a shell-style pattern ids of their own, even
+  once all the ids are taken, so that the settings a configuration gives
+  them apply. A pattern such as `*`, which matches every tag, lifts the
+  bound on the ids."""
+  if pattern not in _kept_patterns:
+    with _lock:
+      _kept_patterns[pattern] = re.compile(fnmatch.translate(pattern))
+
+
+def intern_tag(tag: str | None) -> int:
+  """The id of a tag name, assigning a new one if the name is new, even if
+  all the ids are taken. Only for the tags named by configurations."""
+  id = _ids.get(tag)
+  if id is None:
+    with _lock:
+      id = _ids.get(tag)
+      if id is None:
+        id = len(_names)
+        _names.append(tag)
+        _ids[tag] = id
+  return id
+
+
+def tag_name(id: int) -> str | None:
+  """The tag name with the given id."""
+  return _names[id]
+
+
+def tag_count() -> int:
+  """The number of ids assigned so far. Ids range from 0 to this number."""
+  return len(_names)
@@ -0,0 +1,176 @@
+"""
+Lazy discovery of the files to format in a directory tree.
+
+Directories are read with `os.scandir` one at a time, and files are produced
+as soon as they are found, so that formatting can start while the rest of
+the tree is still being read. Excluded directories are not entered at all.
+
+Exclusions use the pattern syntax of `.gitignore` files:
+- `name` matches files and directories with that name at any depth, and
+  `*`, `?` and `[...]` match within a name as in shell patterns.
+- a pattern with a `/` at the start or in the middle, like `/output` or
+  `doc/build`, only matches relative to where it is defined.
+- `**` matches any number of directories, as in `**/generated` or `a/**/b`.
+- a pattern ending with `/` only matches directories.
+- a pattern starting with `!` includes again what an earlier pattern
+  excluded. The last matching pattern wins.
+
+The `.gitignore` files found along the way apply to their own directory and
+everything below it. Hidden files and directories, whose name starts with a
+dot, are always skipped, and symbolic links to directories are not followed.
+"""
+import os
+from pathlib import Path
+import re
+from typing import Iterable, Iterator, NamedTuple
+
+DEFAULT_EXCLUDES = [
+    "node_modules/",
+    "output/",
+    "generated-assets/",
+    "__pycache__/",
+]
+"""Directories skipped unless other exclude patterns are given. Hidden
+directories like `.git/` are always skipped."""
+
+GITIGNORE = ".gitignore"
+
+
+class Rule(NamedTuple):
+  """A compiled exclude pattern."""
+  base: str
+  """The path of the directory the pattern is defined in, relative to the
+  root of the walk, with a trailing `/`, or empty for the root itself."""
+  regex: re.Pattern
+  """Matches the path of an entry, relative to `base`."""
+  negated: bool
+  """Whether matching entries are included again."""
+  dir_only: bool
+  """Whether the pattern only matches directories."""
+
+
+def walk_files(root: Path | str,
+               suffix: str = ".ptx",
+               excludes: Iterable[str] = DEFAULT_EXCLUDES,
+               gitignore: bool = True) -> Iterator[Path]:
+  """Produce the files under `root` whose names end with `suffix`, skipping
+  the ones matched by the `excludes` patterns or, if `gitignore` is set, by
+  the `.gitignore` files in the tree. The entries of each directory are
+  produced in sorted order, directories as they are entered."""
+  root = Path(root)
+  # A stack of the directories being read: the entries still to go through,
+  # the path of the directory relative to the root, and the rules that apply
+  stack = [_read_dir(root, "", compile_patterns(excludes), gitignore)]
+  while stack:
+    entries, rel, rules = stack[-1]
+    entry = next(entries, None)
+    if entry is None:
+      stack.pop()
+      continue
+    if entry.name.startswith("."):
+      continue
+    path = rel + entry.name
+    is_dir = entry.is_dir(follow_symlinks=False)
+    if is_excluded(rules, path, is_dir):
+      continue
+    if is_dir:
+      stack.append(_read_dir(Path(entry.path), path + "/", rules, gitignore))
+    elif entry.name.endswith(suffix) and entry.is_file():
+      yield Path(entry.path)
+
+
+def is_excluded(rules: list[Rule], path: str, is_dir: bool) -> bool:
+  """Whether the entry at `path`, relative to the root of the walk, is
+  excluded by the rules."""
+  excluded = False
+  for rule in rules:
+    if rule.dir_only and not is_dir:
+      continue
+    if excluded == rule.negated and path.startswith(rule.base):
+      if rule.regex.match(path, len(rule.base)):
+        excluded = not rule.negated
+  return excluded
+
+
+def compile_patterns(patterns: Iterable[str], base: str = "") -> list[Rule]:
+  """Compile exclude patterns defined in the directory `base`, relative to
+  the root of the walk. Blank lines and comments starting with `#` are
+  skipped."""
+  rules = []
+  for pattern in patterns:
+    pattern = pattern.rstrip("\n").rstrip(" ")
+    if pattern == "" or pattern.startswith("#"):
+      continue
+    negated = pattern.startswith("!")
+    if negated:
+      pattern = pattern[1:]
+    elif pattern.startswith("\\"):
+      pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if pattern == "":
+      continue
+    regex = _translate(pattern.lstrip("/"))
+    if "/" not in pattern:
+      # Matches a name at any depth
+      regex = "(?:.*/)?" + regex
+    rules.append(Rule(base, re.compile(regex + "$"), negated, dir_only))
+  return rules
+
+
+def _read_dir(directory: Path, rel: str, rules: list[Rule],
+              gitignore: bool) -> tuple[Iterator[os.DirEntry], str, list[Rule]]:
+  try:
+    with os.scandir(directory) as it:
+      entries = sorted(it, key=lambda entry: entry.name)
+  except OSError:
+    entries = []
+  if gitignore and any(entry.name == GITIGNORE for entry in entries):
+    try:
+      with open(directory / GITIGNORE, "r", encoding="utf-8") as f:
+        rules = rules + compile_patterns(f, rel)
+    except (OSError, UnicodeDecodeError):
+      pass
+  return iter(entries), rel, rules
+
+
+def _translate(pattern: str) -> str:
+  """The regular expression for a pattern with no leading or trailing `/`."""
+  parts = pattern.split("/")
+  regex = []
+  for idx, part in enumerate(parts):
+    last = idx == len(parts) - 1
+    if part == "**":
+      regex.append(".*" if last else "(?:.*/)?")
+    else:
+      regex.append(_translate_name(part) + ("" if last else "/"))
+  return "".join(regex)
+
+
+def _translate_name(name: str) -> str:
+  """The regular expression for a shell pattern matching within a name."""
+  regex = []
+  idx = 0
+  while idx < len(name):
+    c = name[idx]
+    idx += 1
+    if c == "*":
+      regex.append("[^/]*")
+    elif c == "?":
+      regex.append("[^/]")
+    elif c == "\\" and idx < len(name):
+      regex.append(re.escape(name[idx]))
+      idx += 1
+    elif c == "[":
+      end = name.find("]", idx + 1)
+      if end < 0:
+        regex.append("\\[")
+        continue
+      chars = name[idx:end]
+      if chars.startswith("!"):
+        chars = "^" + chars[1:]
+      regex.append("[" + chars.replace("\\", "\\\\") + "]")
+      idx = end + 1
+    else:
+      regex.append(re.escape(c))
+  return "".join(regex)
@@ -0,0 +1,256 @@
+"""
+Running jobs in a supervised worker process, with a limit on the time and
+memory each job can use.
+
+A `FileWorker` sends one job at a time to its process and waits for the
+result. A job that takes longer than the time limit gets its process killed,
+and one that goes over the memory limit fails with a `MemoryError` or, if
+that is not possible, takes its process down with it. Either way the job
+fails, and the next job starts a fresh process, so that one pathological
+input cannot stall or exhaust the whole run.
+
+A `FileWorkerPool` keeps several workers busy at once, one per thread, and
+gives the results in the order of the jobs, so that the output of a run does
+not depend on which job finishes first.
+
+The memory limit is set on the address space of the worker process, on top
+of what the process uses when each job starts. It is only available on
+systems with the `resource` module, and ignored elsewhere.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from multiprocessing.connection import Connection
+import os
+import threading
+from typing import Any, Callable, Iterable, Iterator, Self
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+
+class FileWorker:
+  """A worker process that runs `job` on the arguments of each call to
+  `run`. The process is started when it is first needed, and started again
+  after it is killed or dies."""
+  _job: Callable[..., Any]
+  _timeout: float | None
+  """The seconds a job can take, or None for no limit."""
+  _max_memory: float | None
+  """The megabytes a job can use, or None for no limit."""
+  _process: multiprocessing.process.BaseProcess | None
+  _conn: Connection | None
+  """The end of the pipe to the current process."""
+
+  def __init__(self: Self,
+               job: Callable[..., Any],
+               timeout: float | None = None,
+               max_memory: float | None = None):
+    self._job = job
+    self._timeout = timeout
+    self._max_memory = max_memory
+    self._process = None
+    self._conn = None
+
+  def run(self: Self, *args) -> Any:
+    """The result of the job on `args`. Exceptions raised by the job are
+    raised again here. Raises `TimeoutError` if the job takes too long,
+    and `RuntimeError` if the worker process dies."""
+    if self._process is None:
+      self._start()
+    try:
+      self._conn.send(args)
+    except OSError:
+      # The process died between jobs
+      self._stop()
+      self._start()
+      self._conn.send(args)
+    if not self._conn.poll(self._timeout):
+      self._stop()
+      raise TimeoutError(f"timed out after {self._timeout:g} seconds")
+    try:
+      ok, result = self._conn.recv()
+    except EOFError:
+      exitcode = self._stop()
+      raise RuntimeError(
+          f"the worker process ended unexpectedly (exit code {exitcode})"
+      ) from None
+    if not ok:
+      if isinstance(result, MemoryError):
+        # The memory the job got is not always given back to the system
+        self._stop()
+      raise result
+    return result
+
+  def close(self: Self):
+    """Stop the worker process."""
+    if self._process is not None:
+      try:
+        self._conn.send(None)
+      except OSError:
+        pass
+      self._process.join(1)
+      self._stop()
+
+  def __enter__(self: Self) -> Self:
+    return self
+
+  def __exit__(self: Self, *exc):
+    self.close()
+
+  def _start(self: Self):
+    context = process_context()
+    self._conn, child = context.Pipe()
+    self._process = context.Process(target=_serve,
+                                    args=(child, self._job, self._max_memory),
+                                    daemon=True)
+    self._process.start()
+    child.close()
+    # The time limit is for the jobs, not for starting the process
+    try:
+      self._conn.recv()
+    except EOFError:
+      exitcode = self._stop()
+      raise RuntimeError(
+          f"the worker process failed to start (exit code {exitcode})"
+      ) from None
+
+  def _stop(self: Self) -> int | None:
+    """Kill the process if it is still running. Returns its exit code."""
+    process = self._process
+    if process.is_alive():
+      process.kill()
+    process.join()
+    self._conn.close()
+    self._process = None
+    self._conn = None
+    return process.exitcode
+
+
+class FileWorkerPool:
+  """Several `FileWorker`s running `job`, each driven by a thread of its own.
+  The workers are started as they are needed."""
+  _job: Callable[..., Any]
+  _size: int
+  _timeout: float | None
+  _max_memory: float | None
+  _workers: list[FileWorker]
+  """The workers started so far."""
+  _local: threading.local
+  """The worker of each thread, under `worker`."""
+  _lock: threading.Lock
+
+  def __init__(self: Self,
+               job: Callable[..., Any],
+               size: int,
+               timeout: float | None = None,
+               max_memory: float | None = None):
+    self._job = job
+    self._size = size
+    self._timeout = timeout
+    self._max_memory = max_memory
+    self._workers = []
+    self._local = threading.local()
+    self._lock = threading.Lock()
+
+  def map(self: Self, fn: Callable[[Any, FileWorker], Any],
+          items: Iterable) -> Iterator[Any]:
+    """The results of `fn(item, worker)` for each of the `items`, in order,
+    where `worker` is the worker of the thread making the call. The items
+    are taken as the workers need them, so they can come from a lazy
+    iterable. An exception raised by `fn` is raised again here."""
+    with ThreadPoolExecutor(max_workers=self._size) as executor:
+      pending = deque()
+      for item in items:
+        pending.append(executor.submit(self._call, fn, item))
+        if len(pending) >= 2 * self._size:
+          yield pending.popleft().result()
+      while pending:
+        yield pending.popleft().result()
+
+  def close(self: Self):
+    """Stop all the workers."""
+    for worker in self._workers:
+      worker.close()
+    self._workers = []
+
+  def __enter__(self: Self) -> Self:
+    return self
+
+  def __exit__(self: Self, *exc):
+    self.close()
+
+  def _call(self: Self, fn: Callable[[Any, FileWorker], Any], item: Any) -> Any:
+    worker = getattr(self._local, "worker", None)
+    if worker is None:
+      worker = FileWorker(self._job, self._timeout, self._max_memory)
+      self._local.worker = worker
+      with self._lock:
+        self._workers.append(worker)
+    return fn(item, worker)
+
+
+def process_context() -> multiprocessing.context.BaseContext:
+  """The context worker processes are started in. Their callers often run
+  threads, and a process forked from one can inherit locks that are never
+  released, so they are started by a fork server where there is one, and
+  spawned elsewhere."""
+  if "forkserver" in multiprocessing.get_all_start_methods():
+    return multiprocessing.get_context("forkserver")
+  return multiprocessing.get_context("spawn")
+
+
+def _serve(conn: Connection, job: Callable[..., Any], max_memory: float | None):
+  conn.send(None)
+  while True:
+    try:
+      args = conn.recv()
+    except EOFError:
+      return
+    if args is None:
+      return
+    limits = None
+    if max_memory is not None:
+      # Each job gets the whole budget, whatever the earlier ones kept
+      limits = _limit_memory(max_memory)
+    try:
+      reply = (True, job(*args))
+    except Exception as e:
+      # The traceback keeps the frames of the job, and all they hold, alive
+      reply = (False, e.with_traceback(None))
+    finally:
+      # Sending the reply must not run out of the memory the job used up
+      if limits is not None:
+        resource.setrlimit(resource.RLIMIT_AS, limits)
+    try:
+      conn.send(reply)
+    except Exception as e:
+      # The result or the exception could not be pickled
+      conn.send((False, RuntimeError(str(e))))
+
+
+def _limit_memory(max_memory: float) -> tuple[int, int] | None:
+  """Limit the address space of the current process to `max_memory`
+  megabytes more than it uses now. Returns the limits it had before, or
+  None where there are none."""
+  if resource is None:
+    return None
+  limit = _address_space() + int(max_memory * 1024 * 1024)
+  previous = resource.getrlimit(resource.RLIMIT_AS)
+  _, hard = previous
+  if hard != resource.RLIM_INFINITY:
+    limit = min(limit, hard)
+  resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+  return previous
+
+
+def _address_space() -> int:
+  """The size of the address space of the current process, where the
+  system tells, and 0 otherwise."""
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+  except (OSError, ValueError):
+    return 0
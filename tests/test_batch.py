@@ -0,0 +1,105 @@
+import io
+import json
+import os
+from pathlib import Path
+import tempfile
+from typing import Self
+import unittest
+from unittest.mock import patch
+
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils import batch
+from ptx_formatter.utils.batch import BatchFormatter, run_batch
+
+
+def batch_lines(records: list) -> list[str]:
+  return [json.dumps(record) + "\n" for record in records]
+
+
+def run(lines: list[str], jobs: int = 1) -> tuple[list[dict], int]:
+  out = io.StringIO()
+  failed = run_batch(lines, out, jobs)
+  return [json.loads(line) for line in out.getvalue().splitlines()], failed
+
+
+def _format_or_die(record: dict) -> dict:
+  if record.get("id") == "die":
+    os._exit(1)
+  return batch._format_in_worker(record)
+
+
+class TestBatch(unittest.TestCase):
+
+  def setUp(self: Self):
+    self._tmp = tempfile.TemporaryDirectory()
+    self.root = Path(self._tmp.name)
+
+  def tearDown(self: Self):
+    self._tmp.cleanup()
+
+  def test_results_come_in_input_order(self: Self):
+    texts = [
+        f"<section><p>{i}</p>{'<p>x</p>' * (i % 7) * 50}</section>"
+        for i in range(40)
+    ]
+    lines = batch_lines([{"id": i, "text": t} for i, t in enumerate(texts)])
+    for jobs in (1, 3):
+      results, failed = run(lines, jobs)
+      self.assertEqual(failed, 0)
+      self.assertEqual([r["id"] for r in results], list(range(40)))
+      self.assertEqual([r["text"] for r in results],
+                       [formatPretext(t) for t in texts])
+
+  def test_errors_are_reported_in_place(self: Self):
+    lines = ["not json\n", "\n", "[1]\n"] + batch_lines([{
+        "id": "bad",
+        "path": "a.ptx",
+        "text": "<p>\n<em></p>"
+    }, {
+        "id": "empty"
+    }, {
+        "text": "<p/>"
+    }])
+    results, failed = run(lines)
+    self.assertEqual(failed, 4)
+    self.assertEqual(len(results), 5)
+    self.assertIn("error", results[0])
+    self.assertEqual(results[1], {"error": "The document is not a JSON object"})
+    self.assertEqual(results[2]["id"], "bad")
+    self.assertEqual(results[2]["path"], "a.ptx")
+    self.assertEqual((results[2]["line"], results[2]["column"]), (2, 6))
+    self.assertEqual(results[3], {
+        "id": "empty",
+        "error": "The document has no text"
+    })
+    self.assertEqual(results[4], {"text": "<p />"})
+
+  def test_configs_come_from_the_path_or_the_config_key(self: Self):
+    (self.root / "sub").mkdir()
+    (self.root / "sub" / "ptx-formatter.toml").write_text("indent = 4\n")
+    (self.root / "tabs.toml").write_text('indent = "\\t"\n')
+    formatter = BatchFormatter()
+    text = "<section><p>x</p></section>"
+    by_path = formatter.format({
+        "path": str(self.root / "sub" / "a.ptx"),
+        "text": text
+    })
+    by_config = formatter.format({
+        "path": str(self.root / "sub" / "a.ptx"),
+        "config": str(self.root / "tabs.toml"),
+        "text": text
+    })
+    self.assertEqual(by_path["text"], "<section>\n    <p>x</p>\n</section>")
+    self.assertEqual(by_config["text"], "<section>\n\t<p>x</p>\n</section>")
+
+  def test_only_the_document_that_kills_its_worker_fails(self: Self):
+    records = [{"id": i, "text": f"<p>{i}</p>"} for i in range(20)]
+    records.insert(3, {"id": "die", "text": "<p/>"})
+    with patch.object(batch, "_format_in_worker", _format_or_die):
+      results, failed = run(batch_lines(records), 2)
+    self.assertEqual(failed, 1)
+    self.assertEqual([r["id"] for r in results], [r["id"] for r in records])
+    self.assertIn("error", results[3])
+    del results[3]
+    self.assertEqual([r.get("text") for r in results],
+                     [f"<p>{i}</p>" for i in range(20)])
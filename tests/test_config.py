@@ -1,7 +1,14 @@
 from typing import Self
 import unittest
 
-from ptx_formatter.utils.config import Config, Preference
+import io
+import pickle
+
+from ptx_formatter.utils.config import (BLOCK, CDATA, EMPTYLINE_BEFORE,
+                                        INLINE_EMPTY, NO_INDENT, VERBATIM,
+                                        Config, Preference)
+from ptx_formatter.formatter import formatPretext, formatPretextConfigs
+from ptx_formatter.utils.tags import tag_id, tag_name
 
 
 class TestConfig(unittest.TestCase):
@@ -12,3 +19,115 @@ class TestConfig(unittest.TestCase):
     self.assertEqual(config._add_doc_id, False)
     self.assertEqual(config.get_pref("ul"), Preference.Block)
     self.assertEqual(config.get_pref("var"), Preference.InlineEmpty)
+
+  def test_tag_flags(self: Self):
+    config = Config.standard()
+    self.assertEqual(config.tag_flags(tag_id("ul")), BLOCK)
+    self.assertEqual(config.tag_flags(tag_id("var")), INLINE_EMPTY)
+    self.assertEqual(config.tag_flags(tag_id("not-a-pretext-tag")), 0)
+    self.assertEqual(tag_name(tag_id("ul")), "ul")
+
+  def test_tag_flags_follow_settings(self: Self):
+    config = Config.standard()
+    config.tag_flags(tag_id("pre"))
+    config.add_tag_prefs({"pre": Preference.BlockNoIndent})
+    config.set_emptyline_before(["pre"])
+    self.assertEqual(config.tag_flags(tag_id("pre")),
+                     BLOCK | NO_INDENT | EMPTYLINE_BEFORE)
+    config.add_tag_prefs({"pre": Preference.Verbatim})
+    config.set_cdata(["pre"])
+    self.assertEqual(config.tag_flags(tag_id("pre")),
+                     VERBATIM | EMPTYLINE_BEFORE | CDATA)
+
+  def test_tag_flags_are_not_pickled(self: Self):
+    config = Config.standard()
+    config.tag_flags(tag_id("ul"))
+    self.assertEqual(pickle.loads(pickle.dumps(config))._flags, [])
+
+  def test_tag_patterns(self: Self):
+    config = Config()
+    config.add_tag_prefs({
+        "svg:*": Preference.Verbatim,
+        "*-preamble": Preference.Inline,
+        "svg:text": Preference.Block,
+        "pf:?": Preference.InlineEmpty,
+    })
+    self.assertEqual(config.get_pref("svg:path"), Preference.Verbatim)
+    self.assertEqual(config.get_pref("svg:text"), Preference.Block)
+    self.assertEqual(config.get_pref("latex-preamble"), Preference.Inline)
+    self.assertEqual(config.get_pref("pf:x"), Preference.InlineEmpty)
+    self.assertEqual(config.get_pref("pf:xy"), Preference.No)
+    self.assertEqual(config.get_pref("svg"), Preference.No)
+    self.assertEqual(config.tag_flags(tag_id("svg:circle")), VERBATIM)
+
+  def test_more_specific_tag_pattern_wins(self: Self):
+    config = Config()
+    config.add_tag_prefs({
+        "svg:t*": Preference.Block,
+        "*": Preference.Inline,
+        "svg:*": Preference.Verbatim,
+    })
+    self.assertEqual(config.get_pref("svg:tspan"), Preference.Block)
+    self.assertEqual(config.get_pref("svg:g"), Preference.Verbatim)
+    self.assertEqual(config.get_pref("p"), Preference.Inline)
+
+  def test_tag_patterns_from_toml(self: Self):
+    config = Config.fromFile(
+        io.StringIO('[tags]\nverbatim = ["svg:*"]\nblock = ["*-preamble"]\n'))
+    self.assertEqual(config.get_pref("svg:g"), Preference.Verbatim)
+    self.assertEqual(config.get_pref("latex-preamble"), Preference.Block)
+    self.assertIn("'svg:*'", config.print())
+    copy = pickle.loads(pickle.dumps(config))
+    self.assertEqual(copy.tag_flags(tag_id("svg:g")), VERBATIM)
+
+  def test_path_rules(self: Self):
+    config = Config.fromFile(
+        io.StringIO('[tags]\nblock = ["li", "p"]\n'
+                    'inline = ["li > p", "ul > li > p > *"]\n'))
+    text = ("<div><ul><li><p>a</p><p>b<em>c</em></p></li></ul>"
+            "<section><p>d</p></section></div>")
+    self.assertEqual(
+        formatPretext(text, config),
+        "<div>\n  <ul>\n    <li>\n      <p>a</p><p>b<em>c</em></p>\n    </li>"
+        "\n  </ul>"
+        "\n  <section>\n    <p>\n      d\n    </p>\n  </section>\n</div>")
+    self.assertIn("'li > p'", config.print())
+
+  def test_longer_path_rule_wins(self: Self):
+    config = Config()
+    config.add_tag_prefs({
+        "section > section > title": Preference.Inline,
+        "section > title": Preference.Block,
+        "title": Preference.Inline,
+        "section": Preference.Block,
+    })
+    text = "<section><title>a</title><section><title>b</title></section></section>"
+    self.assertEqual(
+        formatPretext(text, config), "<section>\n  <title>\n    a\n  </title>"
+        "\n  <section>\n    <title>b</title>\n  </section>\n</section>")
+
+  def test_path_rules_with_other_configs(self: Self):
+    config = Config.standard()
+    copy = pickle.loads(pickle.dumps(config))
+    copy.add_tag_prefs({"li > p": Preference.Inline})
+    text = "<ul><li><p>a</p></li></ul>"
+    self.assertEqual(formatPretextConfigs(text, [config, copy]), [
+        "<ul>\n  <li>\n    <p>a</p>\n  </li>\n</ul>",
+        "<ul>\n  <li><p>a</p></li>\n</ul>"
+    ])
+
+  def test_invalid_path_rule(self: Self):
+    with self.assertRaises(ValueError):
+      Config().add_tag_prefs({"li p > x": Preference.Inline})
+
+  def test_invalid_max_line_width(self: Self):
+    config = Config()
+    config.set_max_line_width(80)
+    config.set_max_line_width("never")
+    for width in ["80", 0, -3, 8.5, True, None]:
+      with self.assertRaisesRegex(ValueError, "max-line-width"):
+        config.set_max_line_width(width)
+    with self.assertRaisesRegex(ValueError, "max-line-width"):
+      Config.fromFile(io.StringIO('max-line-width = "80"\n'))
+    config = Config.fromFile(io.StringIO("max-line-width = 80\n"))
+    self.assertEqual(config._max_line_width, 80)
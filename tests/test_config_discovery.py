@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+import tempfile
+from typing import Self
+import unittest
+
+from ptx_formatter.utils.discovery import ConfigFinder
+
+
+class TestConfigDiscovery(unittest.TestCase):
+
+  def setUp(self: Self):
+    self._tmp = tempfile.TemporaryDirectory()
+    self.root = Path(self._tmp.name)
+    (self.root / "sub" / "deeper").mkdir(parents=True)
+    (self.root / "other").mkdir()
+    self.finder = ConfigFinder()
+
+  def tearDown(self: Self):
+    self._tmp.cleanup()
+
+  def test_standard_config_without_config_file(self: Self):
+    self.assertIsNone(self.finder.config_file_for(self.root / "a.ptx"))
+    config = self.finder.config_for(self.root / "a.ptx")
+    self.assertEqual(config._base_indent, "  ")
+
+  def test_finds_config_file_in_parent_directories(self: Self):
+    (self.root / "ptx-formatter.toml").write_text("indent = 4\n")
+    path = self.root / "sub" / "deeper" / "a.ptx"
+    self.assertEqual(self.finder.config_file_for(path),
+                     self.root / "ptx-formatter.toml")
+    self.assertEqual(self.finder.config_for(path)._base_indent, "    ")
+
+  def test_closest_config_file_wins(self: Self):
+    (self.root / "ptx-formatter.toml").write_text("indent = 4\n")
+    (self.root / "sub" / "pyproject.toml").write_text(
+        '[project]\nname = "x"\n\n[tool.ptx-formatter]\nindent = "\\t"\n')
+    sub = self.finder.config_for(self.root / "sub" / "deeper" / "a.ptx")
+    other = self.finder.config_for(self.root / "other" / "b.ptx")
+    self.assertEqual(sub._base_indent, "\t")
+    self.assertEqual(other._base_indent, "    ")
+
+  def test_pyproject_without_table_is_skipped(self: Self):
+    (self.root / "ptx-formatter.toml").write_text("indent = 4\n")
+    (self.root / "sub" / "pyproject.toml").write_text('[project]\nname = "x"\n')
+    config = self.finder.config_for(self.root / "sub" / "a.ptx")
+    self.assertEqual(config._base_indent, "    ")
+
+  def test_config_read_once_per_file(self: Self):
+    (self.root / "ptx-formatter.toml").write_text("indent = 4\n")
+    first = self.finder.config_for(self.root / "sub" / "a.ptx")
+    second = self.finder.config_for(self.root / "other" / "b.ptx")
+    self.assertIs(first, second)
+
+  def test_config_read_again_when_changed(self: Self):
+    config_file = self.root / "ptx-formatter.toml"
+    config_file.write_text("indent = 4\n")
+    first = self.finder.config_for(self.root / "a.ptx")
+    config_file.write_text("indent = 3\n")
+    mtime = os.stat(config_file).st_mtime_ns + 1_000_000_000
+    os.utime(config_file, ns=(mtime, mtime))
+    second = self.finder.config_for(self.root / "a.ptx")
+    self.assertEqual(second._base_indent, "   ")
+
+  def test_config_file_removed(self: Self):
+    (self.root / "ptx-formatter.toml").write_text("indent = 4\n")
+    config_file = self.root / "sub" / "ptx-formatter.toml"
+    config_file.write_text("indent = 3\n")
+    path = self.root / "sub" / "a.ptx"
+    self.assertEqual(self.finder.config_for(path)._base_indent, "   ")
+    config_file.unlink()
+    self.assertEqual(self.finder.config_for(path)._base_indent, "    ")
+    with self.assertRaises(FileNotFoundError):
+      self.finder.config_from(config_file)
+
+  def test_adjust_is_applied(self: Self):
+    finder = ConfigFinder(lambda config: config.set_indent(1))
+    self.assertEqual(finder.config_for(self.root / "a.ptx")._base_indent, " ")
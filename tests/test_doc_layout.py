@@ -0,0 +1,65 @@
+import unittest
+
+from ptx_formatter.utils.doc import (INDENTATION, LINE, SOFT_BREAK, Defer,
+                                     Group, Nest, SOFTLINE, layout, render,
+                                     rstrip_parts, strip_parts)
+
+
+class TestDocLayout(unittest.TestCase):
+
+  def test_text_and_lists_are_concatenated(self):
+    self.assertEqual(render(["<a>", ["b", "c"], "</a>"]), "<a>bc</a>")
+
+  def test_lines_are_indented_by_nesting(self):
+    doc = [
+        "<a>",
+        Nest("  ", [LINE, "<b>", Nest("  ", [LINE, "x"])]), LINE, "</a>"
+    ]
+    self.assertEqual(render(doc), "<a>\n  <b>\n    x\n</a>")
+
+  def test_newlines_inside_text_are_not_indented(self):
+    self.assertEqual(render(Nest("  ", [LINE, "a\nb", INDENTATION, "c"])),
+                     "\n  a\nb  c")
+
+  def test_groups_are_flat_without_width(self):
+    self.assertEqual(render(Group(["a", SOFTLINE, "b"])), "a b")
+
+  def test_groups_break_when_they_do_not_fit(self):
+    doc = Group(["aaaa", SOFTLINE, "bbbb"])
+    self.assertEqual(render(doc, 9), "aaaa bbbb")
+    self.assertEqual(render(doc, 8), "aaaa\nbbbb")
+
+  def test_soft_breaks_fill_the_line(self):
+    words = ["one", SOFT_BREAK, "two", SOFT_BREAK, "three", SOFT_BREAK, "four"]
+    self.assertEqual(render(Nest("  ", words), 12), "one two\n  three four")
+
+  def test_layout_produces_chunks(self):
+    doc = [f"<p>{i}</p>" for i in range(1000)]
+    chunks = list(layout(doc, chunk_size=100))
+    self.assertGreater(len(chunks), 1)
+    self.assertEqual("".join(chunks), render(doc))
+
+  def test_deferred_documents_are_built_when_reached(self):
+    built = []
+
+    def make(idx):
+      built.append(idx)
+      return [LINE, f"<p>{idx}</p>"]
+
+    doc = Nest("  ", ["<a>", [Defer(make, idx) for idx in range(100)]])
+    chunks = layout(doc, chunk_size=10)
+    self.assertEqual(next(chunks), "<a>\n  <p>0</p>")
+    self.assertEqual(built, [0])
+    self.assertEqual("".join(chunks),
+                     "".join(f"\n  <p>{i}</p>" for i in range(1, 100)))
+    self.assertEqual(built, list(range(100)))
+
+  def test_groups_look_into_deferred_documents(self):
+    doc = [Group(["aaaa", SOFTLINE]), Defer(lambda: "bbbb")]
+    self.assertEqual(render(doc, 9), "aaaa bbbb")
+    self.assertEqual(render(doc, 8), "aaaa\nbbbb")
+
+  def test_strip_parts_behaves_like_string_strip(self):
+    parts = [" \n", LINE, "  a ", ["<b/>"], " c  ", SOFT_BREAK, "\n "]
+    self.assertEqual(strip_parts(parts), ["a ", ["<b/>"], " c"])
+    self.assertEqual(rstrip_parts([["<b/>"], " "]), [["<b/>"]])
@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+import tempfile
+from typing import Self
+import unittest
+
+from ptx_formatter.utils.files import read_source, replace_file
+
+
+class TestFiles(unittest.TestCase):
+
+  def setUp(self: Self):
+    self._tmp = tempfile.TemporaryDirectory()
+    self.root = Path(self._tmp.name)
+    self.path = self.root / "a.ptx"
+    self.path.write_bytes("<p>é</p>\r\n".encode("utf-8"))
+
+  def tearDown(self: Self):
+    self._tmp.cleanup()
+
+  def test_read_source_normalizes_line_endings(self: Self):
+    data, text = read_source(self.path)
+    self.assertEqual(data, "<p>é</p>\r\n".encode("utf-8"))
+    self.assertEqual(text, "<p>é</p>\n")
+
+  def test_replace_file_keeps_permissions(self: Self):
+    os.chmod(self.path, 0o640)
+    for fsync in [True, False]:
+      replace_file(self.path, b"<p/>\n", fsync)
+      self.assertEqual(self.path.read_bytes(), b"<p/>\n")
+      self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+    self.assertEqual(os.listdir(self.root), ["a.ptx"])
+
+  def test_replace_file_follows_symbolic_links(self: Self):
+    link = self.root / "link.ptx"
+    link.symlink_to(self.path)
+    replace_file(link, b"<p/>\n")
+    self.assertTrue(link.is_symlink())
+    self.assertEqual(self.path.read_bytes(), b"<p/>\n")
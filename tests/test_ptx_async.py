@@ -0,0 +1,82 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import unittest
+from unittest.mock import patch
+
+from ptx_formatter.aio import (MAX_PENDING_CHUNKS, format_many_async,
+                               format_pretext_async, iter_format_pretext_async)
+from ptx_formatter.formatter import PtxFormatter, formatPretext
+from ptx_formatter.utils.config import Config
+
+document = """<?xml version="1.0" encoding="UTF-8" ?>
+<!-- A comment before the root -->
+<section><title>A title</title><p>A paragraph</p></section>
+"""
+
+
+class TestPtxAsync(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self) -> None:
+    self.config = Config.standard()
+    self.config.set_add_doc_id(True)
+    self.expected = formatPretext(document, self.config)
+
+  async def test_format_pretext_async_matches_formatPretext(self):
+    result = await format_pretext_async(document, self.config)
+    self.assertEqual(result, self.expected)
+
+  async def test_format_pretext_async_with_custom_executor(self):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+      result = await format_pretext_async(document,
+                                          self.config,
+                                          executor=executor)
+    self.assertEqual(result, self.expected)
+
+  async def test_format_many_async_keeps_order(self):
+    texts = [f"<p>Paragraph {i}</p>" for i in range(20)]
+    results = await format_many_async(texts, self.config, limit=3)
+    self.assertEqual(results, [formatPretext(t, self.config) for t in texts])
+
+  async def test_format_many_async_raises_errors(self):
+    with self.assertRaises(ExceptionGroup):
+      await format_many_async(["<p>fine</p>", "<p>broken"], self.config)
+
+  async def test_iter_format_streams_pieces(self):
+    pieces = [p async for p in iter_format_pretext_async(document, self.config)]
+    self.assertGreater(len(pieces), 1)
+    self.assertEqual("".join(pieces), self.expected)
+
+  async def test_iter_format_waits_for_the_consumer(self):
+    rendered = []
+    iter_format = PtxFormatter.iter_format
+
+    def spy(session, text):
+      for chunk in iter_format(session, text, chunk_size=10):
+        rendered.append(chunk)
+        yield chunk
+
+    text = "<section>" + "<p>A paragraph</p>" * 200 + "</section>"
+    with patch.object(PtxFormatter, "iter_format", spy):
+      pieces = iter_format_pretext_async(text, self.config)
+      first = await anext(pieces)
+      await asyncio.sleep(0.2)
+      self.assertLessEqual(len(rendered), MAX_PENDING_CHUNKS + 2)
+      rest = [p async for p in pieces]
+    self.assertGreater(len(rendered), MAX_PENDING_CHUNKS + 2)
+    self.assertEqual(first + "".join(rest), formatPretext(text, self.config))
+
+  async def test_iter_format_with_process_executor(self):
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+      pieces = [
+          p async for p in iter_format_pretext_async(
+              document, self.config, executor=executor)
+      ]
+    self.assertEqual(pieces, [self.expected])
+
+  async def test_format_pretext_async_can_be_cancelled(self):
+    task = asyncio.create_task(format_pretext_async(document, self.config))
+    task.cancel()
+    with self.assertRaises(asyncio.CancelledError):
+      await task
@@ -40,3 +40,28 @@ class TestPtxCdataFormatting(ExpressionTestCase):
     f(x) &gt; 5 &amp; g(x) = 2
   </input>
 </section>""".strip())
+
+  def test_cdata_converted_to_escaped_text(self):
+    self.config.set_cdata("never")
+    self.assertBecomes("<pre><![CDATA[f(x) > 5 & g(x) < 2]]></pre>",
+                       "<pre>f(x) &gt; 5 &amp; g(x) &lt; 2</pre>")
+
+  def test_escaped_text_converted_to_cdata(self):
+    self.config.set_cdata("always")
+    self.assertBecomes("<pre>f(x) &gt; 5 &amp; g(x) &lt; 2</pre>",
+                       "<pre><![CDATA[f(x) > 5 & g(x) < 2]]></pre>")
+
+  def test_other_references_are_escaped_as_needed(self):
+    self.config.set_cdata("never")
+    self.assertBecomes("<pre>&quot;a&quot; &#60; b > c</pre>",
+                       '<pre>"a" &lt; b &gt; c</pre>')
+
+  def test_several_cdata_sections_are_joined(self):
+    self.config.set_cdata("always")
+    self.assertBecomes("<pre><![CDATA[a < b]]> <![CDATA[c]]></pre>",
+                       "<pre><![CDATA[a < b c]]></pre>")
+
+  def test_line_endings_are_normalized(self):
+    self.config.set_cdata("always")
+    self.assertBecomes("<pre><![CDATA[\r\n  a < b\r\n]]></pre>",
+                       "<pre><![CDATA[\n  a < b\n]]></pre>")
@@ -1,12 +1,15 @@
 import difflib
 import unittest
+from unittest.mock import patch
 import pytest
 from typer.testing import CliRunner
 
 from ptx_formatter.cli import app
+from ptx_formatter.utils.workers import FileWorker, resource
 
 from shutil import copyfile
 from os.path import dirname, join
+import json
 import os
 
 sampleFiles = ["fewNewlines.ptx", "fewWithListing.ptx"]
@@ -46,6 +49,24 @@ class TestPtxCli(unittest.TestCase):
     self.assertEqual(result.exit_code, 0)
     self.assertEqual(result.output, inputContents)
 
+  def test_formatter_writes_stdout_in_pieces_of_the_buffer_size(self):
+    inputContents = "".join(getLines(self.tmp_path / sampleFiles[0])[2:])
+    result = self.runner.invoke(app, ["--buffer-size", "10"],
+                                input=inputContents)
+    self.assertEqual(result.exit_code, 0)
+    self.assertEqual(result.output, inputContents)
+
+  def test_batch_formats_json_lines_from_stdin(self):
+    documents = [{"id": 1, "text": "<p>a</p>"}, {"id": 2, "text": "<p>"}]
+    result = self.runner.invoke(app, ["--batch", "-j", "1"],
+                                input="".join(
+                                    json.dumps(d) + "\n" for d in documents))
+    self.assertEqual(result.exit_code, 1)
+    results = [json.loads(line) for line in result.output.splitlines()]
+    self.assertEqual(results[0], {"id": 1, "text": "<p>a</p>"})
+    self.assertEqual(results[1]["id"], 2)
+    self.assertIn("error", results[1])
+
   def test_formatter_can_rewrite_file_in_place(self):
     inputFile = self.tmp_path / sampleFiles[0]
     backupFile = self.tmp_path / ("backup" + sampleFiles[0])
@@ -89,6 +110,236 @@ class TestPtxCli(unittest.TestCase):
     for inputFile, backupFile in backups:
       self.assertFilesEqual(inputFile, backupFile)
 
+  def test_compare_reports_changed_files_per_config(self):
+    standard = self.tmp_path / "standard.toml"
+    wide = self.tmp_path / "wide.toml"
+    copyfile(join(dirname(__file__), "..", "ptx_formatter", "config.toml"),
+             standard)
+    wide.write_text("indent = 4\n")
+    result = self.runner.invoke(
+        app,
+        ["--compare", "-c",
+         str(standard), "-c",
+         str(wide),
+         str(self.tmp_path)])
+    self.assertEqual(result.exit_code, 0)
+    lines = result.output.splitlines()
+    self.assertEqual(lines[0], f"{standard}: 0 of 2 files would change")
+    self.assertEqual(lines[1], f"{wide}: 2 of 2 files would change")
+    self.assertEqual(lines[2:],
+                     [f"  {self.tmp_path / file}" for file in sampleFiles])
+
+  def test_compare_counts_unreadable_files_as_failed(self):
+    standard = join(dirname(__file__), "..", "ptx_formatter", "config.toml")
+    broken = self.tmp_path / "broken.ptx"
+    broken.write_bytes(b"<p>\xff</p>")
+    result = self.runner.invoke(
+        app, ["--compare", "-c", standard,
+              str(self.tmp_path)])
+    self.assertEqual(result.exit_code, 1)
+    lines = result.output.splitlines()
+    self.assertTrue(lines[0].startswith(f"ERROR: {broken}: "))
+    self.assertEqual(lines[1], f"{standard}: 0 of 2 files would change")
+
+  def test_several_config_files_require_compare(self):
+    config = join(dirname(__file__), "..", "ptx_formatter", "config.toml")
+    result = self.runner.invoke(app, ["-c", config, "-c", config], input="<p/>")
+    self.assertNotEqual(result.exit_code, 0)
+
+  def test_recursive_uses_discovered_config_per_directory(self):
+    os.makedirs(self.tmp_path / "subproject")
+    subFile = self.tmp_path / "subproject" / sampleFiles[0]
+    copyfile(self.tmp_path / sampleFiles[0], subFile)
+    (self.tmp_path / "subproject" /
+     "ptx-formatter.toml").write_text("indent = 4\n")
+    result = self.runner.invoke(app, ["-pr", str(self.tmp_path)])
+    self.assertEqual(result.exit_code, 0)
+    self.assertIn("\n  <title>", (self.tmp_path / sampleFiles[0]).read_text())
+    self.assertIn("\n    <title>", subFile.read_text())
+
+  def test_recursive_skips_excluded_directories(self):
+    os.makedirs(self.tmp_path / "drafts")
+    draft = self.tmp_path / "drafts" / "draft.ptx"
+    draft.write_text("<section><p>x</p></section>")
+    result = self.runner.invoke(
+        app, ["-pr", "--extend-exclude", "drafts/",
+              str(self.tmp_path)])
+    self.assertEqual(result.exit_code, 0)
+    self.assertEqual(draft.read_text(), "<section><p>x</p></section>")
+    result = self.runner.invoke(app, ["-pr", str(self.tmp_path)])
+    self.assertNotEqual(draft.read_text(), "<section><p>x</p></section>")
+
+  def test_in_place_only_writes_changed_files(self):
+    unchanged = self.tmp_path / sampleFiles[0]
+    changed = self.tmp_path / "changed.ptx"
+    changed.write_text("<section><p>x</p></section>")
+    os.utime(unchanged, ns=(0, 0))
+    result = self.runner.invoke(app, ["-pr", str(self.tmp_path)])
+    self.assertEqual(result.exit_code, 0)
+    self.assertEqual(os.stat(unchanged).st_mtime_ns, 0)
+    size = len(changed.read_bytes())
+    self.assertIn(f"1 of 3 files reformatted, {size} bytes written.",
+                  result.output)
+
+  def test_report_records_each_file_and_goes_past_errors(self):
+    broken = self.tmp_path / "broken.ptx"
+    broken.write_text("<section>\n  <p>x</section>")
+    changed = self.tmp_path / "changed.ptx"
+    changed.write_text("<section><p>x</p></section>")
+    reportFile = self.tmp_path / "report.json"
+    result = self.runner.invoke(
+        app, ["-pr", "--report",
+              str(reportFile),
+              str(self.tmp_path)])
+    self.assertEqual(result.exit_code, 1)
+    self.assertIn(f"ERROR: {broken}:2:", result.output)
+    report = json.loads(reportFile.read_text())
+    self.assertEqual(report["summary"], {
+        "unchanged": 2,
+        "reformatted": 1,
+        "error": 1,
+        "skipped": 0
+    })
+    records = {record["path"]: record for record in report["files"]}
+    self.assertEqual(records[str(broken)]["status"], "error")
+    self.assertEqual(records[str(broken)]["line"], 2)
+    record = records[str(changed)]
+    self.assertEqual(record["status"], "reformatted")
+    self.assertEqual(record["input_bytes"], 27)
+    self.assertEqual(record["output_bytes"], len(changed.read_bytes()))
+    self.assertEqual((record["elements"], record["max_depth"]), (2, 2))
+    self.assertIn("parse_ms", record)
+    self.assertIn("render_ms", record)
+
+  def test_in_place_formats_several_files_in_parallel(self):
+    paths = []
+    for idx in range(6):
+      path = self.tmp_path / f"file{idx}.ptx"
+      path.write_text(f"<section><p>{idx}</p></section>")
+      paths.append(path)
+    broken = self.tmp_path / "broken.ptx"
+    broken.write_text("<section>\n  <p>x</section>")
+    args = [str(path) for path in paths[:3] + [broken] + paths[3:]]
+    result = self.runner.invoke(
+        app, ["-p", "-j", "3", "--report", "-", "--skip-doc-type", *args])
+    self.assertEqual(result.exit_code, 1)
+    records = [
+        json.loads(line)
+        for line in result.output.splitlines()
+        if line.startswith("{")
+    ]
+    self.assertEqual([record["path"] for record in records], args)
+    self.assertEqual([record["status"] for record in records],
+                     ["reformatted"] * 3 + ["error"] + ["reformatted"] * 3)
+    for idx, path in enumerate(paths):
+      self.assertEqual(path.read_text(),
+                       f"<section>\n  <p>{idx}</p>\n</section>")
+
+  def test_several_input_files_require_in_place(self):
+    files = [str(self.tmp_path / name) for name in sampleFiles]
+    result = self.runner.invoke(app, [*files, str(self.tmp_path / "out.ptx")])
+    self.assertNotEqual(result.exit_code, 0)
+    self.assertIn("require --in-place", result.output)
+
+  def test_report_to_stdout_as_json_lines(self):
+    inFile = self.tmp_path / sampleFiles[0]
+    result = self.runner.invoke(app, ["-p", "--report", "-", str(inFile)])
+    self.assertEqual(result.exit_code, 0)
+    record = json.loads(result.output.splitlines()[0])
+    self.assertEqual(record["path"], str(inFile))
+    self.assertEqual(record["status"], "unchanged")
+
+  def test_max_file_size_skips_large_files(self):
+    large = self.tmp_path / "large.ptx"
+    large.write_text("<section><p>" + "x" * 2000000 + "</p></section>")
+    result = self.runner.invoke(
+        app, ["-pr", "--max-file-size", "1",
+              str(self.tmp_path)])
+    self.assertEqual(result.exit_code, 0)
+    self.assertIn(f"SKIPPED: {large}: larger than 1 MB", result.output)
+    self.assertTrue(large.read_text().startswith("<section><p>xxx"))
+
+  def test_limits_format_files_in_a_worker_process(self):
+    changed = self.tmp_path / "changed.ptx"
+    changed.write_text("<section><p>x</p></section>")
+    result = self.runner.invoke(
+        app,
+        ["-pr", "--timeout", "60", "--max-memory", "1000",
+         str(self.tmp_path)])
+    self.assertEqual(result.exit_code, 0)
+    self.assertIn("1 of 3 files reformatted", result.output)
+    self.assertTrue(
+        changed.read_text().endswith("<section>\n  <p>x</p>\n</section>"))
+
+  @unittest.skipIf(resource is None, "no memory limits on this system")
+  def test_worker_is_replaced_after_running_out_of_memory(self):
+    big = self.tmp_path / "big.ptx"
+    big.write_text("<section>" + "<p>x</p>" * 300000 + "</section>")
+    small = self.tmp_path / "small.ptx"
+    small.write_text("<section><p>x</p></section>")
+    start = FileWorker._start
+    with patch.object(FileWorker, "_start", autospec=True,
+                      side_effect=start) as started:
+      result = self.runner.invoke(app, [
+          "-p", "-j", "1", "--timeout", "60", "--max-memory", "10",
+          str(big),
+          str(small)
+      ])
+    self.assertEqual(result.exit_code, 1)
+    self.assertIn(f"ERROR: {big}: out of memory", result.output)
+    self.assertIn("1 of 2 files reformatted", result.output)
+    self.assertEqual(started.call_count, 2)
+
+  def test_report_requires_in_place(self):
+    result = self.runner.invoke(app, ["--report", "-"], input="<p/>")
+    self.assertNotEqual(result.exit_code, 0)
+
+  def test_show_config_for_path(self):
+    configFile = self.tmp_path / "ptx-formatter.toml"
+    configFile.write_text("indent = 4\n")
+    result = self.runner.invoke(
+        app,
+        ["--show-config", str(self.tmp_path / sampleFiles[0])])
+    self.assertEqual(result.exit_code, 0)
+    self.assertIn(f"# Configuration from {configFile}\n", result.output)
+    self.assertIn('indent = "    "', result.output)
+
+  def test_lines_formats_only_the_elements_on_them(self):
+    text = "<section>\n<p>a</p>\n<p>b  </p>\n</section>\n"
+    result = self.runner.invoke(app, ["--lines", "3:3"], input=text)
+    self.assertEqual(result.exit_code, 0)
+    self.assertEqual(result.output,
+                     "<section>\n<p>a</p>\n  <p>b</p>\n</section>\n")
+
+  def test_lines_in_place(self):
+    inFile = self.tmp_path / "lines.ptx"
+    inFile.write_text("<section>\n<p>a</p>\n<p>b  </p>\n</section>\n")
+    result = self.runner.invoke(app, ["-p", "--lines", "2:2", str(inFile)])
+    self.assertEqual(result.exit_code, 0)
+    self.assertEqual(inFile.read_text(),
+                     "<section>\n  <p>a</p>\n<p>b  </p>\n</section>\n")
+
+  def test_lines_reject_limits(self):
+    inFile = self.tmp_path / "lines.ptx"
+    text = "<section>\n<p>a</p>\n<p>b  </p>\n</section>\n"
+    inFile.write_text(text)
+    for option in [["--timeout", "60"], ["--max-memory", "1000"]]:
+      result = self.runner.invoke(
+          app, ["-p", "--lines", "2:2", *option,
+                str(inFile)])
+      self.assertNotEqual(result.exit_code, 0)
+      self.assertIn("do not take", result.output)
+    self.assertEqual(inFile.read_text(), text)
+
+  def test_invalid_lines_are_an_error(self):
+    result = self.runner.invoke(app, ["--lines", "3"], input="<p/>")
+    self.assertNotEqual(result.exit_code, 0)
+    self.assertIn("START:END", result.output)
+
+  def test_git_hunks_requires_an_input_file(self):
+    result = self.runner.invoke(app, ["--git-hunks"], input="<p/>")
+    self.assertNotEqual(result.exit_code, 0)
+
   def assertFilesEqual(self, inFile, outFile):
     diff = difflib.unified_diff(getLines(inFile), getLines(outFile))
     errors = [l for l in diff]
@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import patch
+
+from ptx_formatter.formatter import formatPretext, formatPretextConfigs
+from ptx_formatter.utils.ast import Element
+from ptx_formatter.utils.config import Config, Preference
+
+document = """
+<section xml:id="sec-one">
+  <title>A title</title>
+  <p>Some <em>text</em> here</p>
+  <ul>
+    <li><p>one</p></li>
+    <li>two</li>
+  </ul>
+  <pre>x &lt; 3</pre>
+</section>
+""".lstrip()
+
+
+def configs() -> list[Config]:
+  configs = [Config.standard() for _ in range(6)]
+  for config in configs:
+    config.set_add_doc_id(False)
+  configs[1].set_emptyline_after(["title"])
+  configs[2].add_tag_prefs({"li": Preference.Block})
+  configs[3].set_cdata("always")
+  configs[4].set_indent(4)
+  configs[5].set_add_doc_id(True)
+  return configs
+
+
+class TestPtxConfigs(unittest.TestCase):
+
+  def test_formats_like_formatPretext_for_each_config(self):
+    expected = [formatPretext(document, config) for config in configs()]
+    self.assertEqual(formatPretextConfigs(document, configs()), expected)
+
+  def test_same_config_twice(self):
+    config = Config.standard()
+    results = formatPretextConfigs(document, [config, config])
+    self.assertEqual(results, [formatPretext(document, config)] * 2)
+
+  def test_only_differing_parts_are_laid_out_again(self):
+    laid_out = []
+    doc_block = Element._doc_block
+
+    def spy(element, ctx):
+      laid_out.append(element.tag)
+      return doc_block(element, ctx)
+
+    with patch.object(Element, "_doc_block", spy):
+      formatPretextConfigs(document, configs()[0:1])
+      once = list(laid_out)
+      laid_out.clear()
+      formatPretextConfigs(document, configs()[0:1] * 3)
+      self.assertEqual(laid_out, once)
+      laid_out.clear()
+      formatPretextConfigs(document, configs()[0:3:2])
+      self.assertEqual(laid_out[len(once):],
+                       [None, "section", "ul", "li", "li"])
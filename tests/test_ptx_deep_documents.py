@@ -0,0 +1,51 @@
+import sys
+import unittest
+
+from ptx_formatter.document import parse, render
+from ptx_formatter.formatter import formatPretext, formatPretextConfigs
+from ptx_formatter.utils.config import Config
+
+DEPTH = 50000
+
+
+def flat_config() -> Config:
+  """A configuration with no indent, so that the output of deeply nested
+  blocks stays linear in the depth."""
+  config = Config.standard()
+  config.set_indent(0)
+  return config
+
+
+class TestPtxDeepDocuments(unittest.TestCase):
+
+  def test_depth_is_above_the_recursion_limit(self):
+    self.assertGreater(DEPTH, 10 * sys.getrecursionlimit())
+
+  def test_deep_inline_elements(self):
+    text = f"<p>{'<em>' * DEPTH}x{'</em>' * DEPTH}</p>"
+    self.assertEqual(formatPretext(text), text)
+
+  def test_deep_block_elements(self):
+    text = ("<pretext>\n" + "<section>\n" * DEPTH + "<p>x</p>\n" +
+            "</section>\n" * DEPTH + "</pretext>\n")
+    self.assertEqual(formatPretext(text, flat_config()), text)
+
+  def test_deep_block_elements_under_several_configs(self):
+    text = ("<section>\n" * DEPTH + "<p>x</p>\n<p>y</p>\n" +
+            "</section>\n" * DEPTH)
+    configs = [flat_config(), flat_config()]
+    configs[1].set_emptyline_after(["p"])
+    flat, spaced = formatPretextConfigs(text, configs)
+    self.assertEqual(flat, text)
+    self.assertEqual(spaced, text.replace("</p>\n<p>", "</p>\n\n<p>"))
+
+  def test_deep_verbatim_element(self):
+    text = f"<pre>{'<c>' * DEPTH}x{'</c>' * DEPTH}</pre>"
+    self.assertEqual(formatPretext(text), text)
+
+  def test_render_deep_document(self):
+    text = f"<p>{'<em>' * DEPTH}x{'</em>' * DEPTH}</p>"
+    document = parse(text)
+    self.assertEqual(render(document), text)
+    document.edit(text.index("x"), text.index("x") + 1, "y")
+    self.assertEqual(render(document), text.replace("x", "y"))
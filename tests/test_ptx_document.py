@@ -0,0 +1,194 @@
+import marshal
+import pickle
+import unittest
+from unittest.mock import patch
+import xml.etree.ElementTree as ET
+
+from ptx_formatter.document import Document, parse, render
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils.ast import Element
+from ptx_formatter.utils.config import Config, Preference
+from ptx_formatter.utils.shared import MAX_CONFIGS
+from ptx_formatter.utils import tags
+from ptx_formatter.utils.tags import OTHER_TAG_ID, tag_count, tag_id
+
+document = """<?xml version="1.0" encoding="UTF-8" ?>
+<!-- A comment -->
+<section xml:id="sec-one" xmlns:xi="http://www.w3.org/2001/XInclude">
+  <title>A <em>title</em></title>
+  <p>Some <em>text</em> here</p> <!-- inline -->
+  <?processing instruction?>
+  <xi:include href="a.ptx"/>
+  <pre>x &lt; 3 &amp; é</pre>
+  <pre><![CDATA[a < b]]></pre>
+</section>
+"""
+
+
+def configs() -> list[Config]:
+  configs = [Config.standard() for _ in range(4)]
+  configs[1].set_indent(4)
+  configs[2].add_tag_prefs({"p": Preference.Block})
+  configs[3].set_cdata("always")
+  return configs
+
+
+class TestPtxDocument(unittest.TestCase):
+
+  def test_render_is_formatPretext(self):
+    parsed = parse(document)
+    for config in configs():
+      self.assertEqual(render(parsed, config), formatPretext(document, config))
+    self.assertEqual(render(parsed), formatPretext(document))
+
+  def test_config_changed_between_renders(self):
+    parsed = parse(document)
+    config = Config.standard()
+    render(parsed, config)
+    config.set_indent(6)
+    self.assertEqual(render(parsed, config), formatPretext(document, config))
+    config.add_tag_prefs({"title": Preference.Block})
+    self.assertEqual(render(parsed, config), formatPretext(document, config))
+
+  def test_kept_layouts_are_bounded(self):
+    parsed = parse(document)
+    for _ in range(20):
+      render(parsed, Config.standard())
+    self.assertEqual(len(parsed._layouts._docs), 1)
+    for indent in range(20):
+      config = Config.standard()
+      config.set_indent(indent)
+      render(parsed, config)
+    self.assertEqual(len(parsed._layouts._docs), MAX_CONFIGS)
+
+  def test_serialized_document_renders_the_same(self):
+    parsed = parse(document)
+    for copy in [
+        Document.from_bytes(parsed.to_bytes()),
+        pickle.loads(pickle.dumps(parsed, protocol=5))
+    ]:
+      self.assertEqual(copy.source, document)
+      for config in configs():
+        self.assertEqual(render(copy, config), render(parsed, config))
+
+  def test_serialized_form_has_tag_names(self):
+    _, _, nodes = marshal.loads(parse("<a><b/>x</a>").to_bytes())
+    self.assertEqual([node if type(node) is str else node[1] for node in nodes],
+                     [None, "a", "b", "x"])
+
+  def test_pickled_elements_get_tag_ids_again(self):
+    element = pickle.loads(pickle.dumps(Element("para", {"a": "b"})))
+    self.assertEqual(element.tag_id, tag_id("para"))
+    self.assertEqual(element.attrs, {"a": "b"})
+
+  def test_tag_ids_are_bounded(self):
+    # Without the patterns kept by the configurations of other tests
+    kept = patch.dict(tags._kept_patterns, clear=True)
+    with kept, patch.object(tags, "MAX_TAG_IDS", tag_count()):
+      config = Config.standard()
+      config.add_tag_prefs({"named-tag": Preference.Block})
+      count = tag_count()
+      text = "<p><new-tag>x</new-tag> <named-tag>y</named-tag></p>"
+      parsed = parse(text)
+      self.assertEqual(tag_count(), count)
+      self.assertEqual(parsed.root.children[0].children[0].tag_id, OTHER_TAG_ID)
+      formatted = render(parsed, config)
+    self.assertIn("\n  <named-tag>\n    y\n  </named-tag>\n", formatted)
+    self.assertEqual(formatted, formatPretext(text, config))
+
+  def test_tags_matching_patterns_keep_their_ids(self):
+    config = Config.standard()
+    config.add_tag_prefs({
+        "*-preamble": Preference.Verbatim,
+        "kept-list > kept-*": Preference.Block
+    })
+    text = ("<p><{0}-preamble>  a\n   b </{0}-preamble>"
+            "<kept-list><kept-{0}>x</kept-{0}></kept-list></p>")
+    # The same document with new tags, once all the ids are taken
+    expected = formatPretext(text.format("first"), config)
+    with patch.object(tags, "MAX_TAG_IDS", tag_count()):
+      parsed = parse(text.format("second"))
+      self.assertNotIn(OTHER_TAG_ID,
+                       [el.tag_id for el in parsed.root.children[0].children])
+      formatted = render(parsed, config)
+    self.assertEqual(formatted, expected.replace("first", "second"))
+
+  def test_deep_documents(self):
+    depth = 5000
+    text = "<a>" * depth + "x" + "</a>" * depth
+    copy = Document.from_bytes(parse(text).to_bytes())
+    element = copy.root
+    for _ in range(depth):
+      element = element.children[0]
+    self.assertEqual(element.children[0].txt, "x")
+
+  def test_from_bytes_rejects_other_data(self):
+    with self.assertRaises(ValueError):
+      Document.from_bytes(b"not a document")
+    with self.assertRaises(ValueError):
+      Document.from_bytes(marshal.dumps((0, "", [])))
+
+
+def spans(element: Element) -> list:
+  result = []
+  stack = [element]
+  while stack:
+    element = stack.pop()
+    result.append((element.tag, element.start, element.inner_start,
+                   element.inner_end, element.end))
+    stack.extend(ch for ch in element.children if isinstance(ch, Element))
+  return result
+
+
+class TestPtxDocumentEdits(unittest.TestCase):
+
+  def assertEdit(self, parsed: Document, old: str, new: str):
+    start = parsed.source.index(old)
+    expected = parsed.source.replace(old, new, 1)
+    parsed.edit(start, start + len(old), new)
+    self.assertEqual(parsed.source, expected)
+    self.assertEqual(spans(parsed.root), spans(parse(expected).root))
+    for config in configs():
+      self.assertEqual(render(parsed, config), formatPretext(expected, config))
+
+  def test_edit_inside_an_element(self):
+    parsed = parse(document)
+    for config in configs():
+      render(parsed, config)
+    section = [ch for ch in parsed.root.children if isinstance(ch, Element)][0]
+    title, p = section.children[1], section.children[3]
+    self.assertEdit(parsed, "Some", "Much <em>more</em>")
+    # Only the paragraph was parsed again
+    self.assertIn(section, parsed.root.children)
+    self.assertIs(section.children[1], title)
+    self.assertIs(section.children[3], p)
+    self.assertEqual(len(p.children), 5)
+
+  def test_edits_in_sequence(self):
+    parsed = parse(document)
+    render(parsed)
+    self.assertEdit(parsed, "title</em>", "heading</em>")
+    self.assertEdit(parsed, "x &lt; 3", "x &lt; 30")
+    self.assertEdit(parsed, "a < b", "a <<< b")
+    self.assertEdit(parsed, "<!-- inline -->", "")
+    self.assertEdit(parsed, '"a.ptx"', '"b.ptx"')
+
+  def test_edit_using_a_prefix_declared_above(self):
+    parsed = parse(document)
+    render(parsed)
+    self.assertEdit(parsed, "here", '<xi:include href="c.ptx"/>')
+
+  def test_edit_across_tags(self):
+    parsed = parse(document)
+    render(parsed)
+    self.assertEdit(parsed, "text</em> here", "text</em></p><p>here")
+    self.assertEdit(parsed, '<section xml:id="sec-one"', '<section xml:id="s"')
+    self.assertEdit(parsed, "<!-- A comment -->", "")
+
+  def test_edit_that_breaks_the_document(self):
+    parsed = parse(document)
+    start = document.index("<em>title")
+    with self.assertRaises(ET.ParseError):
+      parsed.edit(start, start + 4, "<em")
+    self.assertEqual(parsed.source, document)
+    self.assertEqual(render(parsed), formatPretext(document))
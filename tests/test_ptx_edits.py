@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import patch
+
+from ptx_formatter.formatter import formatPretext, formatPretextEdits
+from ptx_formatter.utils.config import Config
+from ptx_formatter.utils import edits as edits_module
+from ptx_formatter.utils.edits import TextEdit, apply_edits
+
+
+class TestPtxEdits(unittest.TestCase):
+
+  def setUp(self) -> None:
+    self.config = Config.standard()
+    self.config.set_add_doc_id(False)
+
+  def assertEditsFormat(self, text: str) -> list[TextEdit]:
+    edits = formatPretextEdits(text, self.config)
+    self.assertEqual(apply_edits(text, edits), formatPretext(text, self.config))
+    return edits
+
+  def test_formatted_document_has_no_edits(self):
+    self.assertEqual(
+        self.assertEditsFormat("<section>\n  <p>Some text</p>\n</section>"), [])
+
+  def test_edits_are_limited_to_changed_parts(self):
+    text = "<section>\n  <p>One</p>\n    <p>Two</p>\n  <p>Three</p>\n</section>"
+    self.assertEqual(self.assertEditsFormat(text), [TextEdit(25, 27, "")])
+
+  def test_edits_inside_nested_elements(self):
+    text = "<section>\n  <p>One</p>\n  <ul><li>  item </li></ul>\n</section>"
+    edits = self.assertEditsFormat(text)
+    self.assertTrue(all(edit.start > 23 for edit in edits))
+
+  def test_edits_with_doc_id_and_verbatim_content(self):
+    self.config.set_add_doc_id(True)
+    self.config.set_cdata("always")
+    self.assertEditsFormat(
+        "<section><pre>x &lt; 2</pre>\n<p>é and <em>ü</em></p></section>\n")
+
+  def test_edits_use_offsets_into_non_ascii_text(self):
+    text = "<!-- ñ -->\n<section>\n  <p>é ü</p>\n  <p> x</p>\n</section>"
+    edits = self.assertEditsFormat(text)
+    self.assertEqual(edits, [TextEdit(text.index(" x"), text.index("x"), "")])
+
+  def test_deep_elements_are_not_compared_again(self):
+    depth = 200
+    text = formatPretext(
+        "<section>" * depth + "<p a='1'>x</p><p>" + "y " * 2000 + "</p>" +
+        "</section>" * depth, self.config)
+    text = text.replace('a="1"', "a='1'")
+    compared = []
+    same = edits_module._same
+
+    def spy(source, s0, s1, *args):
+      compared.append(s1 - s0)
+      return same(source, s0, s1, *args)
+
+    with patch.object(edits_module, "_same", spy):
+      edits = self.assertEditsFormat(text)
+    self.assertEqual(len(edits), 1)
+    self.assertLess(sum(compared), 3 * len(text))
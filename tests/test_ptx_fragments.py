@@ -0,0 +1,47 @@
+import unittest
+import xml.etree.ElementTree as ET
+
+from ptx_formatter.formatter import formatFragment, formatPretext
+from ptx_formatter.utils.config import Config
+
+fragment = """
+<p>Some <em>text</em> here</p> <ul><li>one</li>
+<li><p>two</p></li></ul>
+<!-- a comment -->
+<pre>x &lt; 3</pre>
+"""
+
+
+class TestPtxFragments(unittest.TestCase):
+
+  def test_several_top_level_elements(self):
+    self.assertEqual(formatFragment("<p>a</p><p>b</p>"), "<p>a</p>\n<p>b</p>")
+
+  def test_mixed_text_and_elements(self):
+    self.assertEqual(formatFragment("  some <em>text</em> and <m>x</m> "),
+                     "some <em>text</em> and <m>x</m>")
+
+  def test_formats_like_the_contents_of_a_block_element(self):
+    config = Config.standard()
+    config.set_add_doc_id(False)
+    wrapped = formatPretext(f"<section>{fragment}</section>", config)
+    inner = "\n".join(wrapped.splitlines()[1:-1]) + "\n"
+    self.assertEqual(formatFragment(fragment, config, 1), inner)
+
+  def test_base_indent_level(self):
+    config = Config.standard()
+    config.set_indent("\t")
+    self.assertEqual(formatFragment("<ol><li>x</li></ol>", config, 2),
+                     "\t\t<ol>\n\t\t\t<li>x</li>\n\t\t</ol>")
+
+  def test_non_ascii_and_verbatim(self):
+    self.assertEqual(formatFragment("<p>é</p><pre>\n  ü\n</pre>", None, 1),
+                     "  <p>é</p>\n  <pre>\n  ü\n  </pre>")
+
+  def test_parse_error_positions_are_within_the_fragment(self):
+    with self.assertRaises(ET.ParseError) as cm:
+      formatFragment("<p>x</p><p>y</q>")
+    self.assertEqual(cm.exception.position, (1, 14))
+    with self.assertRaises(ET.ParseError) as cm:
+      formatFragment("<p>x</p>\n<p>y</q>")
+    self.assertEqual(cm.exception.position, (2, 6))
@@ -0,0 +1,112 @@
+from pathlib import Path
+import subprocess
+import tempfile
+import unittest
+
+from ptx_formatter.formatter import formatPretext, formatPretextLines
+from ptx_formatter.utils.config import Config
+from ptx_formatter.utils.lines import git_hunks, parse_line_range
+
+SOURCE = """<pretext>
+<book>
+<section>
+<title>A</title>
+<p>One</p>
+<ul><li>x</li>
+</ul>
+</section>
+<section>
+  <p>
+  Two</p>
+</section>
+</book>
+</pretext>
+"""
+
+
+class TestPtxLines(unittest.TestCase):
+
+  def setUp(self) -> None:
+    self.config = Config.standard()
+
+  def formatLines(self, *lines: tuple[int, int]) -> str:
+    return formatPretextLines(SOURCE, lines, self.config)
+
+  def test_only_the_elements_on_the_lines_change(self):
+    self.assertEqual(
+        self.formatLines((6, 6)),
+        SOURCE.replace("<ul><li>x</li>\n</ul>",
+                       "      <ul>\n        <li>x</li>\n      </ul>"))
+    self.assertEqual(self.formatLines((10, 11)),
+                     SOURCE.replace("  <p>\n  Two</p>", "      <p>Two</p>"))
+
+  def test_lines_on_a_start_tag_format_the_element(self):
+    self.assertEqual(
+        self.formatLines((9, 9)),
+        SOURCE.replace("<section>\n  <p>\n  Two</p>\n</section>",
+                       "    <section>\n      <p>Two</p>\n    </section>"))
+
+  def test_element_followed_by_more_on_its_line_is_laid_out_by_its_parent(self):
+    text = "<section>\n<p>One</p>\n<p>Two</p> <!-- c -->\n</section>\n"
+    self.assertEqual(formatPretextLines(text, [(3, 3)], self.config),
+                     formatPretext(text, self.config))
+
+  def test_several_ranges(self):
+    self.assertEqual(
+        self.formatLines((4, 4), (11, 11)),
+        SOURCE.replace("<title>A</title>", "      <title>A</title>").replace(
+            "  <p>\n  Two</p>", "      <p>Two</p>"))
+
+  def test_lines_around_the_root_format_the_whole_document(self):
+    self.assertEqual(self.formatLines((1, 1)), formatPretext(SOURCE))
+
+  def test_lines_past_the_end_change_nothing(self):
+    self.assertEqual(self.formatLines((20, 30)), SOURCE)
+
+  def test_formatted_lines_are_kept(self):
+    formatted = formatPretext(SOURCE)
+    for line in range(1, formatted.count("\n") + 1):
+      self.assertEqual(
+          formatPretextLines(formatted, [(line, line)], self.config), formatted)
+
+  def test_parse_line_range(self):
+    self.assertEqual(parse_line_range("3:7"), (3, 7))
+    for text in ["3", "0:2", "5:4", "a:b"]:
+      with self.assertRaises(ValueError):
+        parse_line_range(text)
+
+
+class TestGitHunks(unittest.TestCase):
+
+  def setUp(self) -> None:
+    self._tmp = tempfile.TemporaryDirectory()
+    self.root = Path(self._tmp.name)
+    self.git("init", "-q")
+
+  def tearDown(self) -> None:
+    self._tmp.cleanup()
+
+  def git(self, *args: str):
+    subprocess.run([
+        "git", "-c", "user.name=Test", "-c", "user.email=test@example.com",
+        *args
+    ],
+                   cwd=self.root,
+                   check=True)
+
+  def test_hunks_of_changed_lines(self):
+    path = self.root / "a.ptx"
+    path.write_text("".join(f"<p>{i}</p>\n" for i in range(1, 11)))
+    self.git("add", "a.ptx")
+    self.git("commit", "-q", "-m", "first")
+    lines = path.read_text().splitlines(keepends=True)
+    lines[2] = "<p>changed</p>\n"
+    lines[6:8] = ["<p>new</p>\n"] * 3
+    del lines[-1]
+    path.write_text("".join(lines))
+    self.assertEqual(git_hunks(path), [(3, 3), (7, 9), (10, 11)])
+
+  def test_untracked_file_has_no_hunks(self):
+    path = self.root / "b.ptx"
+    path.write_text("<p/>\n")
+    self.assertIsNone(git_hunks(path))
@@ -0,0 +1,48 @@
+from tests.expressionTestCase import ExpressionTestCase
+
+
+class TestPtxMaxLineWidth(ExpressionTestCase):
+
+  def test_inline_elements_are_not_wrapped_by_default(self):
+    self.assertStaysSame("""
+<section>
+  <p>This is a long paragraph with <em>some emphasis</em> and more words, that goes on and on.</p>
+</section>""".strip())
+
+  def test_long_inline_paragraphs_wrap_at_width(self):
+    self.config.set_max_line_width(40)
+    self.assertBecomes(
+        """
+<section>
+  <p>This is a long paragraph with <em>some emphasis</em> and more words, that should wrap at forty columns.</p>
+</section>""".strip(), """
+<section>
+  <p>This is a long paragraph with
+    <em>some emphasis</em> and more
+    words, that should wrap at forty
+    columns.</p>
+</section>""".strip())
+
+  def test_wrapped_paragraphs_stay_same(self):
+    self.config.set_max_line_width(40)
+    self.assertStaysSame("""
+<section>
+  <p>This is a long paragraph with
+    <em>some emphasis</em> and more
+    words, that should wrap at forty
+    columns.</p>
+</section>""".strip())
+
+  def test_short_paragraphs_are_joined_onto_one_line(self):
+    self.config.set_max_line_width(40)
+    self.assertBecomes("<p>Short\n  paragraph.</p>", "<p>Short paragraph.</p>")
+
+  def test_nested_inline_elements_and_verbatim_are_not_wrapped(self):
+    self.config.set_max_line_width(20)
+    self.assertStaysSame("""
+<section>
+  <p>Some
+    <c>code   with   spacing</c>
+    here</p>
+  <pre>A verbatim line that is much too long</pre>
+</section>""".strip())
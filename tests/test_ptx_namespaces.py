@@ -14,3 +14,29 @@ class TestPtxCdataFormatting(ExpressionTestCase):
 <pretext xml:id="something" color="purple" xmlns:xi="http://www.w3.org/2001/XInclude">
   <xi:include href="./sage/groups-info.xml" />
 </pretext>""".strip())
+
+  def test_default_namespace(self):
+    self.assertStaysSame("""
+<image>
+  <svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
+    <use xlink:href="#dot" />
+  </svg>
+</image>""".strip())
+
+  def test_same_namespace_declared_in_nested_elements(self):
+    self.assertStaysSame("""
+<pretext xmlns:xi="http://www.w3.org/2001/XInclude">
+  <chapter xmlns:xi="http://www.w3.org/2001/XInclude">
+    <xi:include href="a.ptx" />
+  </chapter>
+  <xi:include href="b.ptx" />
+</pretext>""".strip())
+
+  def test_prefix_hidden_by_nested_declaration(self):
+    self.assertStaysSame("""
+<pretext xmlns:a="http://example.com/one">
+  <a:b xmlns:a="http://example.com/two" xmlns:c="http://example.com/one">
+    <c:d a:e="f" />
+  </a:b>
+  <a:g />
+</pretext>""".strip())
@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import patch
+
+from ptx_formatter.formatter import PtxFormatter, formatPretext
+from ptx_formatter.utils.ast import Element
+from ptx_formatter.utils.config import Config
+
+snippets = [
+    "<p>Some <em>text</em> here</p>",
+    "<section>\n<title>A title</title><p>A paragraph</p></section>",
+    "<ul><li>one</li><li>two</li></ul>\n",
+    "<pre>x &lt; 3</pre>",
+]
+
+
+class TestPtxSession(unittest.TestCase):
+
+  def setUp(self) -> None:
+    self.config = Config.standard()
+    self.config.set_add_doc_id(False)
+    self.session = PtxFormatter(self.config)
+
+  def test_session_formats_like_formatPretext(self):
+    for snippet in snippets:
+      self.assertEqual(self.session.format(snippet),
+                       formatPretext(snippet, self.config))
+
+  def test_session_can_be_reused(self):
+    first = [self.session.format(snippet) for snippet in snippets]
+    second = [self.session.format(snippet) for snippet in snippets]
+    self.assertEqual(first, second)
+
+  def test_iter_format_gives_the_result_of_format(self):
+    for snippet in snippets:
+      self.assertEqual("".join(self.session.iter_format(snippet, 5)),
+                       self.session.format(snippet))
+
+  def test_iter_format_starts_before_the_document_is_laid_out(self):
+    sections = "".join(f"<section><p>{i}</p></section>" for i in range(1000))
+    text = f"<book>{sections}</book>"
+    built = []
+    doc_block = Element.doc_block
+    with patch.object(
+        Element, "doc_block",
+        lambda element, ctx: built.append(element) or doc_block(element, ctx)):
+      chunks = self.session.iter_format(text, 100)
+      first = next(chunks)
+      self.assertLess(len(built), 10)
+      rest = "".join(chunks)
+    self.assertEqual(first + rest, self.session.format(text))
+
+  def test_format_many_keeps_order_with_threads(self):
+    expected = [formatPretext(snippet, self.config) for snippet in snippets]
+    results = self.session.format_many(snippets * 5, workers=3)
+    self.assertEqual(results, expected * 5)
+
+  def test_format_many_keeps_order_with_processes(self):
+    expected = [formatPretext(snippet, self.config) for snippet in snippets]
+    results = self.session.format_many(snippets * 5,
+                                       workers=2,
+                                       executor="process",
+                                       chunksize=3)
+    self.assertEqual(results, expected * 5)
+
+  def test_format_many_rejects_unknown_executor(self):
+    with self.assertRaises(ValueError):
+      self.session.format_many(snippets, workers=2, executor="fibers")
@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import patch
+
+from ptx_formatter.document import parse, render
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils.ast import (SOURCE_SPACED, SOURCE_UNSPACED, Element)
+from ptx_formatter.utils.config import Config
+
+
+def laid_out_inline(text: str, config: Config = None) -> list[str]:
+  """The tags of the elements whose inline layout is built when formatting
+  the text, rather than copied from it."""
+  tags = []
+  doc_inline = Element._doc_inline
+
+  def spy(self, *args, **kwargs):
+    tags.append(self.tag)
+    return doc_inline(self, *args, **kwargs)
+
+  with patch.object(Element, "_doc_inline", spy):
+    formatPretext(text, config)
+  return tags
+
+
+class TestPtxSourcePassthrough(unittest.TestCase):
+
+  def test_formatted_inline_elements_are_copied(self):
+    text = (
+        '<section>\n  <p>Some <em>text</em> &amp; <m>x &lt; 1 &gt; 0</m>.</p>\n'
+        '  <p>A <xref ref="a" /> b</p>\n</section>')
+    self.assertEqual(formatPretext(text), text)
+    self.assertEqual(laid_out_inline(text), [])
+
+  def test_unformatted_inline_elements_are_laid_out(self):
+    for inner in [
+        "<em> text</em>", "<em>a > b</em>", "<em>a &#65; b</em>",
+        '<xref ref="a"/>', "<em></em>", '<xref ref = "a" />',
+        "<em>a<!-- c --></em>", "<em><![CDATA[x]]></em>"
+    ]:
+      text = f"<section>\n  <p>Some {inner}.</p>\n</section>"
+      self.assertIn("p", laid_out_inline(text))
+
+  def test_attribute_order_is_checked(self):
+    text = '<p><xref xml:id="b" ref="a" /></p>'
+    self.assertEqual(laid_out_inline(text), [])
+    text = '<p><xref ref="a" xml:id="b" /></p>'
+    self.assertEqual(laid_out_inline(text), ["p", "xref"])
+    self.assertEqual(formatPretext(text), '<p><xref xml:id="b" ref="a" /></p>')
+
+  def test_self_closing_space_setting(self):
+    config = Config.standard()
+    config.set_self_closing_space(False)
+    text = '<p>A <xref ref="a"/> b</p>'
+    self.assertEqual(laid_out_inline(text, config), [])
+    self.assertEqual(formatPretext(text, config), text)
+    self.assertEqual(formatPretext(text), '<p>A <xref ref="a" /> b</p>')
+    element = parse(text).root.children[0]
+    self.assertEqual(element.source_forms(text), SOURCE_UNSPACED)
+    element = parse(text.replace("/>", " />")).root.children[0]
+    self.assertEqual(element.source_forms(text.replace("/>", " />")),
+                     SOURCE_SPACED)
+
+  def test_edits_update_the_copied_source(self):
+    text = "<section>\n  <p>Some <em>text</em>.</p>\n</section>"
+    document = parse(text)
+    self.assertEqual(render(document), text)
+    start = text.index("text")
+    document.edit(start, start, "  ")
+    self.assertEqual(render(document),
+                     "<section>\n  <p>Some <em>text</em>.</p>\n</section>")
+    document.edit(start, start + 2, "a &gt; b ")
+    self.assertEqual(render(document), formatPretext(document.source))
@@ -0,0 +1,34 @@
+import unittest
+
+from ptx_formatter.formatter import formatPretext
+from ptx_formatter.utils.ast import (Comment, Element, ElementWithInlineComment,
+                                     Text)
+from ptx_formatter.utils.config import Config
+from ptx_formatter.utils.context import Context
+
+
+def wide_element(count: int) -> Element:
+  """An element with `count` rows, each followed by an inline comment."""
+  element = Element("tabular")
+  for idx in range(count):
+    element.addChild(Text("\n  "))
+    element.addChild(Element("row", {}, [Text(str(idx))]))
+    element.addChild(Text(" "))
+    element.addChild(Comment(f" row {idx} "))
+  element.addChild(Text("\n"))
+  return element
+
+
+class TestPtxWideElements(unittest.TestCase):
+
+  def test_normalizes_10k_children(self):
+    children = wide_element(10000)._block_children(Context(Config.standard()))
+    self.assertEqual(len(children), 10000)
+    self.assertTrue(
+        all(isinstance(ch, ElementWithInlineComment) for ch in children))
+
+  def test_formats_10k_rows(self):
+    rows = "".join(
+        f"\n  <row>{idx}</row> <!-- row {idx} -->" for idx in range(10000))
+    text = f"<tabular>{rows}\n</tabular>"
+    self.assertEqual(formatPretext(text), text)
@@ -0,0 +1,34 @@
+from typing import Self
+import unittest
+import xml.etree.ElementTree as ET
+
+from ptx_formatter.formatter import Formatter, formatPretext
+from ptx_formatter.utils.config import Config
+from ptx_formatter.utils.report import (FileReport, Status, format_with_report,
+                                        tree_shape)
+
+
+class TestReport(unittest.TestCase):
+
+  def test_tree_shape(self: Self):
+    formatter = Formatter("<a><b><c/>x<c/></b><!-- d --><b/></a>")
+    self.assertEqual(tree_shape(formatter.root), (5, 3))
+
+  def test_format_with_report_records_tree_and_timings(self: Self):
+    text = "<section><p>x</p></section>\n"
+    report = FileReport("a.ptx")
+    result = format_with_report(text, Config.standard(), report)
+    self.assertEqual(result, formatPretext(text))
+    self.assertEqual((report.elements, report.max_depth), (2, 2))
+    self.assertGreaterEqual(report.parse_ms, 0)
+    self.assertGreaterEqual(report.render_ms, 0)
+
+  def test_parse_errors_record_position(self: Self):
+    report = FileReport("a.ptx")
+    with self.assertRaises(ET.ParseError) as cm:
+      format_with_report("<a>\n  <b></a>", Config.standard(), report)
+    report.fail(cm.exception)
+    self.assertEqual(report.status, Status.error)
+    self.assertEqual((report.line, report.column), (2, 7))
+    self.assertEqual(set(report.as_dict()),
+                     {"path", "status", "error", "line", "column"})
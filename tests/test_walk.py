@@ -0,0 +1,66 @@
+from pathlib import Path
+import tempfile
+from typing import Self
+import unittest
+
+from ptx_formatter.utils.walk import compile_patterns, is_excluded, walk_files
+
+
+class TestWalk(unittest.TestCase):
+
+  def setUp(self: Self):
+    self._tmp = tempfile.TemporaryDirectory()
+    self.root = Path(self._tmp.name)
+    for name in [
+        "main.ptx", "notes.txt", "ch/one.ptx", "ch/two.ptx", "ch/drafts/x.ptx",
+        "output/web/a.ptx", "generated-assets/b.ptx", ".git/c.ptx",
+        "sub/output.ptx", "sub/deep/output/d.ptx"
+    ]:
+      path = self.root / name
+      path.parent.mkdir(parents=True, exist_ok=True)
+      path.write_text("<p/>")
+
+  def tearDown(self: Self):
+    self._tmp.cleanup()
+
+  def walk(self: Self, **kwargs) -> list[str]:
+    return [
+        path.relative_to(self.root).as_posix()
+        for path in walk_files(self.root, **kwargs)
+    ]
+
+  def test_default_excludes(self: Self):
+    self.assertEqual(self.walk(), [
+        "ch/drafts/x.ptx", "ch/one.ptx", "ch/two.ptx", "main.ptx",
+        "sub/output.ptx"
+    ])
+
+  def test_replaced_excludes(self: Self):
+    self.assertEqual(self.walk(excludes=["ch/"]), [
+        "generated-assets/b.ptx", "main.ptx", "output/web/a.ptx",
+        "sub/deep/output/d.ptx", "sub/output.ptx"
+    ])
+
+  def test_gitignore_applies_below_its_directory(self: Self):
+    (self.root / "ch" /
+     ".gitignore").write_text("# drafts\ndrafts/\n/two.ptx\n")
+    (self.root / ".gitignore").write_text("two.ptx\n!sub/\n")
+    self.assertEqual(self.walk(), ["ch/one.ptx", "main.ptx", "sub/output.ptx"])
+    self.assertEqual(len(self.walk(gitignore=False)), 5)
+
+  def test_patterns(self: Self):
+    rules = compile_patterns(
+        ["*.bak", "/top.ptx", "doc/**/gen/", "!keep.bak", "a[!x]c"])
+    for path, is_dir, excluded in [
+        ("a.bak", False, True),
+        ("dir/a.bak", False, True),
+        ("dir/keep.bak", False, False),
+        ("top.ptx", False, True),
+        ("dir/top.ptx", False, False),
+        ("doc/gen", True, True),
+        ("doc/a/b/gen", True, True),
+        ("doc/a/b/gen", False, False),
+        ("abc", False, True),
+        ("axc", False, False),
+    ]:
+      self.assertEqual(is_excluded(rules, path, is_dir), excluded, path)
@@ -0,0 +1,98 @@
+import os
+import time
+from typing import Self
+import unittest
+
+from ptx_formatter.utils.workers import FileWorker, FileWorkerPool, resource
+
+
+def _echo(value):
+  return value, os.getpid()
+
+
+def _sleep(seconds):
+  time.sleep(seconds)
+  return seconds
+
+
+def _allocate(megabytes):
+  return len(bytearray(megabytes * 1024 * 1024))
+
+
+_kept = []
+
+
+def _keep(megabytes):
+  _kept.append(bytearray(megabytes * 1024 * 1024))
+  return len(_kept)
+
+
+def _fail(message):
+  raise ValueError(message)
+
+
+def _run(item, worker):
+  return worker.run(item)
+
+
+def _exit(code):
+  if code != 0:
+    os._exit(code)
+  return code
+
+
+class TestWorkers(unittest.TestCase):
+
+  def test_runs_jobs_in_one_process(self: Self):
+    with FileWorker(_echo) as worker:
+      first, pid = worker.run(1)
+      second, other = worker.run(2)
+    self.assertEqual((first, second), (1, 2))
+    self.assertEqual(pid, other)
+    self.assertNotEqual(pid, os.getpid())
+
+  def test_slow_job_times_out_and_process_is_replaced(self: Self):
+    with FileWorker(_sleep, timeout=0.2) as worker:
+      start = time.perf_counter()
+      with self.assertRaises(TimeoutError):
+        worker.run(30)
+      self.assertLess(time.perf_counter() - start, 10)
+      self.assertEqual(worker.run(0), 0)
+
+  def test_job_exceptions_are_raised_again(self: Self):
+    with FileWorker(_fail) as worker:
+      with self.assertRaisesRegex(ValueError, "bad file"):
+        worker.run("bad file")
+
+  def test_process_that_dies_is_replaced(self: Self):
+    with FileWorker(_exit) as worker:
+      with self.assertRaisesRegex(RuntimeError, "exit code 3"):
+        worker.run(3)
+      self.assertEqual(worker.run(0), 0)
+
+  def test_pool_gives_results_in_order(self: Self):
+    delays = [0.05 * (idx % 3) for idx in range(12)]
+    with FileWorkerPool(_sleep, 3) as pool:
+      self.assertEqual(list(pool.map(_run, iter(delays))), delays)
+
+  def test_pool_runs_jobs_in_several_processes(self: Self):
+    with FileWorkerPool(_echo, 2) as pool:
+      pids = {pid for _, pid in pool.map(_run, range(20))}
+    self.assertLessEqual(len(pids), 2)
+    self.assertNotIn(os.getpid(), pids)
+
+  @unittest.skipIf(resource is None, "no memory limits on this system")
+  def test_memory_limit(self: Self):
+    with FileWorker(_allocate, max_memory=100) as worker:
+      self.assertEqual(worker.run(10), 10 * 1024 * 1024)
+      with self.assertRaises(MemoryError):
+        worker.run(400)
+      # The process that ran out of memory is replaced
+      self.assertIsNone(worker._process)
+      self.assertEqual(worker.run(10), 10 * 1024 * 1024)
+
+  @unittest.skipIf(resource is None, "no memory limits on this system")
+  def test_memory_limit_applies_to_each_job(self: Self):
+    with FileWorker(_keep, max_memory=100) as worker:
+      for count in range(1, 6):
+        self.assertEqual(worker.run(60), count)